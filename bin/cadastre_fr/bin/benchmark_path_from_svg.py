@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Mesure du temps de conversion des paths SVG générés par pdfparser en objets
+Path, avec Path.from_svg() (version rapide pour les commandes absolues) et
+avec Path.from_any_svg() (tokenizer général), en vérifiant que les deux
+donnent le même résultat.
+"""
+
+import sys
+import time
+import os.path
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from cadastre_fr.tools    import command_line_error
+from cadastre_fr.tools    import print_flush
+from cadastre_fr.geometry import Path
+from cadastre_fr.parser   import PDFPARSER
+
+
+HELP_MESSAGE = """Mesure du temps de conversion des paths SVG en Path
+OPTIONS:
+    -n <int> : nombre de répétitions (défaut: 5)
+USAGE: {0} [OPTIONS] FICHIER [FICHIER ...]
+           FICHIER est soit un pdf du cadastre (lu avec pdfparser), soit
+           la sortie texte de pdfparser (commande: pdfparser fichier.pdf)""".format(sys.argv[0])
+
+
+def read_svg_paths(filename):
+    """Retourne la liste des attributs d des paths du fichier."""
+    if filename.endswith(".pdf"):
+        data = subprocess.check_output([PDFPARSER, filename])
+    else:
+        with open(filename, "rb") as f:
+            data = f.read()
+    # Une ligne de path, puis une ligne de style:
+    return [line.rstrip() for line in data.decode("utf8").split("\n")[0:-1:2]]
+
+def same_paths(path1, path2):
+    return (path1.commands == path2.commands) and \
+        [(p.x, p.y) for p in path1.points] == [(p.x, p.y) for p in path2.points]
+
+def benchmark(function, liste, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for d in liste:
+            function(d)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv):
+    repeat = 5
+    i = 1
+    while i < len(argv):
+        if argv[i].startswith("-"):
+            if argv[i] in ["-h", "-help","--help"]:
+                command_line_error(None, HELP_MESSAGE)
+                return
+            elif argv[i] in ["-n"]:
+                repeat = int(argv[i+1])
+                del(argv[i:i+2])
+            else:
+                command_line_error("option invalide: " + argv[i], HELP_MESSAGE)
+                return
+        else:
+            i = i + 1
+    if len(argv) <= 1:
+        command_line_error("pas assez d'arguments", HELP_MESSAGE)
+        return
+    liste = []
+    for filename in argv[1:]:
+        liste.extend(read_svg_paths(filename))
+    nb_fast = 0
+    for d in liste:
+        fast = Path.from_absolute_svg(d)
+        if fast is not None:
+            nb_fast = nb_fast + 1
+            if not same_paths(fast, Path.from_any_svg(d)):
+                print_flush("ERREUR: résultat différent pour le path: " + d)
+                sys.exit(-1)
+    print_flush("%d paths, dont %d traités par la version rapide" % (len(liste), nb_fast))
+    time_any = benchmark(Path.from_any_svg, liste, repeat)
+    time_fast = benchmark(Path.from_svg, liste, repeat)
+    print_flush("Path.from_any_svg: %.3f s" % time_any)
+    print_flush("Path.from_svg:     %.3f s" % time_fast)
+    if time_fast > 0:
+        print_flush("gain: x%.1f" % (time_any / time_fast))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Mesure du temps de comparaison des caractères de référence de
+TextPathRecognizer (fichiers data/text_path_recognizer/reference-*.svg):
+comparaison de chaque caractère avec tous les autres avec
+Path.startswith(), comme le fait TextPathRecognizer.load_from_svg(), puis
+reconnaissance de mots formés par ces caractères.
+
+Les résultats des comparaisons (angle trouvé pour chaque couple de
+caractères) et des reconnaissances peuvent être enregistrés avec l'option
+-o pour vérifier qu'une autre version donne les mêmes.
+"""
+
+import sys
+import glob
+import time
+import pickle
+import random
+import os.path
+import xml.etree.ElementTree as ET
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from cadastre_fr.tools      import command_line_error
+from cadastre_fr.tools      import print_flush
+from cadastre_fr.geometry   import Path
+from cadastre_fr.geometry   import PointArray
+from cadastre_fr.recognizer import TextPathRecognizer
+from cadastre_fr.recognizer import TEXT_PATH_DATA_DIR
+
+
+HELP_MESSAGE = """Mesure du temps de comparaison des caractères de TextPathRecognizer
+OPTIONS:
+    -n <int>     : nombre de répétitions (défaut: 5)
+    -o <fichier> : enregistre les résultats dans le fichier (pickle)
+USAGE: {0} [OPTIONS] [FICHIER.svg ...]
+           par défaut les fichiers reference-*.svg de {1}""".format(sys.argv[0], TEXT_PATH_DATA_DIR)
+
+# Nombre de mots reconnus pour chaque fichier, et nombre maximal de
+# caractères par mot:
+NOMBRE_MOTS = 500
+NOMBRE_CARACTERES_MAX = 8
+
+
+def read_svg_glyphs(filename):
+    """Retourne la liste des couples (valeur, d) des paths du fichier."""
+    glyphs = []
+    for p in ET.parse(filename).getroot().iter('{http://www.w3.org/2000/svg}path'):
+        title = p.find('{http://www.w3.org/2000/svg}title')
+        if title != None:
+            glyphs.append((title.text, p.get('d')))
+    return glyphs
+
+def make_words(glyphs):
+    """Retourne une liste de mots (commandes, coordonnées) formés en
+       mettant bout à bout des caractères, dans un ordre reproductible."""
+    random.seed(0)
+    paths = [Path.from_svg(d) for value, d in glyphs]
+    words = []
+    for i in range(NOMBRE_MOTS):
+        commands = ""
+        coords = []
+        dx = 0
+        for path in random.sample(paths, random.randint(1, NOMBRE_CARACTERES_MAX)):
+            bbox = path.bbox()
+            commands += path.commands
+            for x, y in zip(path.points.xs(), path.points.ys()):
+                coords.append(x - bbox.x1 + dx)
+                coords.append(y)
+            dx += bbox.width() * 1.1
+        words.append((commands, coords))
+    return words
+
+def compare_all(paths, tolerance, min_scale, max_scale):
+    return [[paths[i].startswith(paths[j], tolerance=tolerance, min_scale=min_scale, max_scale=max_scale)
+             for j in range(len(paths)) if j != i]
+            for i in range(len(paths))]
+
+def recognize_all(recognizer, words):
+    results = []
+    for commands, coords in words:
+        found = recognizer.recognize(Path(commands, PointArray.from_points(zip(coords[0::2], coords[1::2]))))
+        results.append(None if found is None else (found[0], found[2]))
+    return results
+
+def benchmark(filename, repeat):
+    """Retourne les résultats et les meilleurs temps des comparaisons
+       et des reconnaissances pour le fichier."""
+    glyphs = read_svg_glyphs(filename)
+    # Sans le cache de recognize(), qui retrouverait les mêmes mots à
+    # chaque répétition:
+    recognizer = TextPathRecognizer(tolerance=0.05, min_scale=0.8, max_scale=1.2, memo_size=0)
+    recognizer.load_from_svg(filename)
+    words = make_words(glyphs)
+    time_compare = time_recognize = None
+    for i in range(repeat):
+        # Des paths neufs à chaque fois, sans les points normalisés
+        # gardés en cache par les précédentes comparaisons:
+        paths = [Path.from_svg(d) for value, d in glyphs]
+        start = time.time()
+        comparisons = compare_all(paths, recognizer.tolerance, recognizer.min_scale, recognizer.max_scale)
+        elapsed = time.time() - start
+        time_compare = elapsed if time_compare is None else min(time_compare, elapsed)
+        start = time.time()
+        recognitions = recognize_all(recognizer, words)
+        elapsed = time.time() - start
+        time_recognize = elapsed if time_recognize is None else min(time_recognize, elapsed)
+    return (comparisons, recognitions), len(glyphs), time_compare, time_recognize
+
+def main(argv):
+    repeat = 5
+    output = None
+    i = 1
+    while i < len(argv):
+        if argv[i].startswith("-"):
+            if argv[i] in ["-h", "-help","--help"]:
+                command_line_error(None, HELP_MESSAGE)
+                return
+            elif argv[i] in ["-n"]:
+                repeat = int(argv[i+1])
+                del(argv[i:i+2])
+            elif argv[i] in ["-o"]:
+                output = argv[i+1]
+                del(argv[i:i+2])
+            else:
+                command_line_error("option invalide: " + argv[i], HELP_MESSAGE)
+                return
+        else:
+            i = i + 1
+    filenames = argv[1:] or sorted(glob.glob(os.path.join(TEXT_PATH_DATA_DIR, "reference-*.svg")))
+    results = {}
+    for filename in filenames:
+        results[os.path.basename(filename)], count, time_compare, time_recognize = benchmark(filename, repeat)
+        print_flush("%s: %d caractères, comparaisons: %.3f s, reconnaissance de %d mots: %.3f s" % (
+            os.path.basename(filename), count, time_compare, NOMBRE_MOTS, time_recognize))
+    if output:
+        with open(output, "wb") as f:
+            pickle.dump(results, f)
+
+if __name__ == '__main__':
+    main(sys.argv)
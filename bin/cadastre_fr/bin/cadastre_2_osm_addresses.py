@@ -34,16 +34,18 @@ from cadastre_fr.tools    import write_string_to_file
 from cadastre_fr.website  import CadastreWebsite
 from cadastre_fr.website  import command_line_open_cadastre_website
 from cadastre_fr.address  import cadastre_2_osm_addresses
+from cadastre_fr.address  import PDF_PARSE_WORKERS
 
 HELP_MESSAGE = """Récupération des adresses depuis le cadaste
 USAGE:
-{0}  [-data] [-nd] [-nobis] CODE_DEPARTEMENT CODE_COMUNE
+{0}  [-data] [-nd] [-nobis] [-j N] CODE_DEPARTEMENT CODE_COMUNE
 OPTIONS:
     -data : n'extrait que les données brutes
     -nd : ne retélécharge pas, utilise les fichiers déja présents
     -nobis : ne transforme pas B,T,Q en bis, ter, quater et n'ajoute pas d'espace.
     -ne : ne pas utiliser de données externes (FANTOIR et OSM).
-    -nzip : ne pas découper le résultat par rue et en faire des zip.""".format(sys.argv[0])
+    -nzip : ne pas découper le résultat par rue et en faire des zip.
+    -j N : nombre de processus d'analyse des PDF (défaut: {1}).""".format(sys.argv[0], PDF_PARSE_WORKERS)
 
 
 def main(argv):
@@ -52,6 +54,7 @@ def main(argv):
   bis = True
   use_external_data = True
   split_result = True
+  parse_workers = PDF_PARSE_WORKERS
   i = 1
   while i < len(argv):
       if argv[i].startswith("-"):
@@ -72,6 +75,9 @@ def main(argv):
           elif argv[i] in ["-nzip"]:
               split_result = False
               del(argv[i:i+1])
+          elif argv[i] in ["-j", "-jobs", "--jobs"]:
+              parse_workers = int(argv[i+1])
+              del(argv[i:i+2])
           else:
               command_line_error("option invalide: " + argv[i], HELP_MESSAGE)
               return
@@ -105,7 +111,7 @@ def main(argv):
               code_departement = argv[1]
               code_commune = argv[2]
               nom_commune = "inconnu"
-      cadastre_2_osm_addresses(cadastreWebsite, code_departement, code_commune,  nom_commune, download, bis, merge_addresses, use_external_data, split_result)
+      cadastre_2_osm_addresses(cadastreWebsite, code_departement, code_commune,  nom_commune, download, bis, merge_addresses, use_external_data, split_result, parse_workers)
 
 
 if __name__ == '__main__':
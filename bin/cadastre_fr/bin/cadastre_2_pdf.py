@@ -46,6 +46,8 @@ from cadastre_fr.download_pdf import PDF_DOWNLOAD_SPLIT_MODE
 from cadastre_fr.download_pdf import PDF_DOWNLOAD_SPLIT_NB
 from cadastre_fr.download_pdf import PDF_DOWNLOAD_SPLIT_SIZE
 from cadastre_fr.download_pdf import PDF_DOWNALOD_WAIT_SECONDS
+from cadastre_fr.download_pdf import PDF_DOWNLOAD_WORKERS
+from cadastre_fr.download_pdf import PDF_DOWNLOAD_MAX_REQUESTS_PER_SECOND
 
 BBOX_OPTION_FORMAT = re.compile("^(-?[0-9]*(\\.[0-9]*)?,){3}-?[0-9]*(\\.[0-9]*)?$")
 
@@ -54,8 +56,12 @@ HELP_MESSAGE = """Téléchargement de PDF du cadastre
 OPTIONS:
     -nb <int>      : découpage par un nombre fixe
     -size <int>    : découpage par une taille fixe (en mètres)
+    -quadtree      : découpage adapté à la densité, les PDF plus grands
+                     que la taille -size n'étant gardés que s'ils sont vides
     -ratio <float> : Nombre de pixels / mètre des PDF exportés
     -wait <seconds>: attente en seconde entre chaque téléchargement
+    -j <int>       : nombre de téléchargements simultanés
+    -rate <float>  : nombre maximal de requêtes par seconde (avec -j)
     -bbox lon1,lat1,lon2,lat2: restreint la zone a extraire
 USAGE:
 {0}  DEPARTEMENT COMMUNE
@@ -74,6 +80,8 @@ def cadastre_2_pdfs(argv):
   nb=PDF_DOWNLOAD_SPLIT_NB
   size=PDF_DOWNLOAD_SPLIT_SIZE
   wait=PDF_DOWNALOD_WAIT_SECONDS
+  workers=PDF_DOWNLOAD_WORKERS
+  max_rate=PDF_DOWNLOAD_MAX_REQUESTS_PER_SECOND
   bbox=None
   while i < len(argv):
       if argv[i].startswith("-"):
@@ -84,8 +92,11 @@ def cadastre_2_pdfs(argv):
               del(argv[i:i+2])
           elif argv[i] in ["-s", "-size","--size"]:
               size = int(argv[i+1])
-              mode = "SIZE"
+              if mode != "QUADTREE": mode = "SIZE"
               del(argv[i:i+2])
+          elif argv[i] in ["-q", "-quadtree","--quadtree"]:
+              mode = "QUADTREE"
+              del(argv[i:i+1])
           elif argv[i] in ["-n", "-nb","--nb"]:
               nb = int(argv[i+1])
               mode = "NB"
@@ -93,6 +104,12 @@ def cadastre_2_pdfs(argv):
           elif argv[i] in ["-w", "-wait","--wait"]:
               wait = float(argv[i+1])
               del(argv[i:i+2])
+          elif argv[i] in ["-j", "-jobs","--jobs"]:
+              workers = int(argv[i+1])
+              del(argv[i:i+2])
+          elif argv[i] in ["-rate","--rate"]:
+              max_rate = float(argv[i+1])
+              del(argv[i:i+2])
           elif argv[i] in ["-b", "-bbox","--bbox"]:
               bbox = argv[i+1]
               if not BBOX_OPTION_FORMAT.match(bbox):
@@ -117,7 +134,7 @@ def cadastre_2_pdfs(argv):
           sys.stderr.flush()
           write_string_to_file("", code_commune + "-" + nom_commune + ".txt")
           result = []
-          for f in download_pdfs(cadastreWebsite, code_departement, code_commune,mode=mode,size=size,nb=nb,ratio=ratio,wait=wait,force_bbox=bbox):
+          for f in download_pdfs(cadastreWebsite, code_departement, code_commune,mode=mode,size=size,nb=nb,ratio=ratio,wait=wait,force_bbox=bbox,workers=workers,max_rate=max_rate):
               sys.stdout.write(f)
               sys.stdout.write("\n")
               sys.stdout.flush()
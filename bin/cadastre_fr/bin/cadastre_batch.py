@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Traitement par lot de toutes les communes de départements, avec une file
+persistante qui permet de reprendre le traitement après un arrêt.
+"""
+
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from cadastre_fr.tools import command_line_error
+from cadastre_fr.tools import print_flush
+from cadastre_fr.batch import JobQueue
+from cadastre_fr.batch import BatchRunner
+from cadastre_fr.batch import BATCH_JOB_SCRIPTS
+from cadastre_fr.batch import read_config
+from cadastre_fr.batch import get_communes
+
+CONFIG_FILENAME = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "..", "config")
+
+HELP_MESSAGE = """Traitement par lot des communes de départements
+OPTIONS:
+    -j <int>           : nombre de communes traitées simultanément (défaut: 2)
+    -type <bati|adresses|bati,adresses> : type de traitement (défaut: bati)
+    -queue <fichier>   : fichier de la file (défaut: work_dir/batch-queue.sqlite)
+    -retry             : remet en attente les communes en échec
+    -status            : affiche l'état de la file sans rien traiter
+USAGE:
+{0} [OPTIONS] [DEPARTEMENT ...]
+           ajoute les communes des départements donnés (ou de tous les
+           départements avec "all") à la file, puis traite la file.
+           Sans département, reprend le traitement de la file existante.
+           Une file ne doit être traitée que par un seul lancement à la fois.""".format(sys.argv[0])
+
+
+def cadastre_batch(argv):
+  workers = 2
+  types = ["bati"]
+  queue_filename = None
+  retry = False
+  status_only = False
+  i = 1
+  while i < len(argv):
+      if argv[i].startswith("-"):
+          if argv[i] in ["-h", "-help","--help"]:
+              command_line_error(None, HELP_MESSAGE)
+              return
+          elif argv[i] in ["-j", "-jobs","--jobs"]:
+              workers = int(argv[i+1])
+              del(argv[i:i+2])
+          elif argv[i] in ["-t", "-type","--type"]:
+              types = argv[i+1].split(",")
+              for job_type in types:
+                  if job_type not in BATCH_JOB_SCRIPTS:
+                      command_line_error("type invalide: " + job_type, HELP_MESSAGE)
+                      return
+              del(argv[i:i+2])
+          elif argv[i] in ["-q", "-queue","--queue"]:
+              queue_filename = argv[i+1]
+              del(argv[i:i+2])
+          elif argv[i] in ["-retry","--retry"]:
+              retry = True
+              del(argv[i:i+1])
+          elif argv[i] in ["-status","--status"]:
+              status_only = True
+              del(argv[i:i+1])
+          else:
+              command_line_error("option invalide: " + argv[i], HELP_MESSAGE)
+              return
+      else:
+          i = i + 1
+  config = read_config(CONFIG_FILENAME)
+  if queue_filename is None:
+      queue_filename = os.path.join(config["work_dir"], "batch-queue.sqlite")
+  queue = JobQueue(queue_filename)
+  departements = argv[1:]
+  if departements == ["all"]:
+      with open(os.path.join(config["data_dir"], "dep-liste.txt")) as f:
+          departements = sorted([line.split(" ", 1)[0] for line in f if line.strip()])
+  for code_departement in departements:
+      communes = get_communes(config["data_dir"], code_departement)
+      for job_type in types:
+          nb = queue.enqueue(communes, job_type)
+          print_flush("%s (%s): %d communes ajoutées à la file" % (code_departement, job_type, nb))
+  if retry:
+      print_flush("%d communes en échec remises en attente" % queue.retry_failed())
+  if status_only:
+      for status, count in sorted(queue.get_counts().items()):
+          print_flush("%s: %d" % (status, count))
+  else:
+      BatchRunner(queue, config, workers).run()
+
+if __name__ == '__main__':
+    cadastre_batch(sys.argv)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Import des pdf de plusieurs communes simultanément depuis le cadastre
+(https://cadastre.gouv.fr), avec le client asynchrone AsyncCadastreClient.
+
+ATTENTION: l'utilisation des données du cadastre n'est pas libre, et ce script doit
+donc être utilisé exclusivement pour contribuer à OpenStreetMap, voire
+http://wiki.openstreetmap.org/wiki/Cadastre_Fran%C3%A7ais/Conditions_d%27utilisation
+"""
+
+import sys
+import asyncio
+import os.path
+import traceback
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from cadastre_fr.tools import command_line_error
+from cadastre_fr.tile_cache import get_default_tile_cache
+from cadastre_fr.download_pdf import decoupage_bbox_cadastre_size
+from cadastre_fr.download_pdf import PDF_DOWNLOAD_PIXELS_RATIO
+from cadastre_fr.download_pdf import PDF_DOWNLOAD_SPLIT_SIZE
+from cadastre_fr.website_async import AsyncCadastreClient
+from cadastre_fr.website_async import download_commune_pdfs
+from cadastre_fr.website_async import ASYNC_CADASTRE_MAX_CONCURRENT_REQUESTS
+from cadastre_fr.website_async import ASYNC_CADASTRE_MAX_REQUESTS_PER_SECOND
+
+
+HELP_MESSAGE = """Téléchargement simultané des PDF du cadastre de plusieurs communes
+OPTIONS:
+    -size <int>    : découpage par une taille fixe (en mètres)
+    -ratio <float> : Nombre de pixels / mètre des PDF exportés
+    -j <int>       : nombre maximal de requêtes simultanées
+    -rate <float>  : nombre maximal de requêtes par seconde
+USAGE:
+{0}  DEPARTEMENT COMMUNE [DEPARTEMENT COMMUNE ...]
+           télécharge les export PDFs du cadastre des communes données
+           par leur code département (3 caractères) et leur code commune
+           (5 caractères), voir cadastre_2_pdf.py""".format(sys.argv[0])
+
+
+async def download_commune(client, code_departement, code_commune, size, ratio, tile_cache):
+    session = await client.open_session(code_departement, code_commune)
+    sys.stderr.write("Teléchargement des PDFs de la commune " + code_commune + " : " + session.nom_commune + "\n")
+    sys.stderr.flush()
+    liste = decoupage_bbox_cadastre_size(session.get_bbox(), size, ratio)
+    return await download_commune_pdfs(session, liste, tile_cache)
+
+async def download_communes(communes, size, ratio, max_concurrent, max_rate):
+    """Télécharge les pdf des communes simultanément et retourne la liste
+       de leurs noms de fichiers. L'échec d'une commune n'interrompt pas
+       les autres, il est signalé une fois qu'elles sont terminées."""
+    tile_cache = get_default_tile_cache()
+    async with AsyncCadastreClient(max_rate, max_concurrent) as client:
+        results = await asyncio.gather(*[
+            download_commune(client, code_departement, code_commune, size, ratio, tile_cache)
+            for code_departement, code_commune in communes], return_exceptions=True)
+    filenames = []
+    for (code_departement, code_commune), result in zip(communes, results):
+        if isinstance(result, Exception):
+            traceback.print_exception(type(result), result, result.__traceback__)
+            sys.stderr.write("ERREUR: échec du téléchargement de la commune " + code_commune + "\n")
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            filenames.extend(result)
+    sys.stderr.flush()
+    return filenames
+
+def cadastre_communes_2_pdfs(argv):
+  i = 1
+  ratio=PDF_DOWNLOAD_PIXELS_RATIO
+  size=PDF_DOWNLOAD_SPLIT_SIZE
+  max_concurrent=ASYNC_CADASTRE_MAX_CONCURRENT_REQUESTS
+  max_rate=ASYNC_CADASTRE_MAX_REQUESTS_PER_SECOND
+  while i < len(argv):
+      if argv[i].startswith("-"):
+          if argv[i] in ["-h", "-help","--help"]:
+              command_line_error(None, HELP_MESSAGE)
+          elif argv[i] in ["-r", "-ratio","--ratio"]:
+              ratio = float(argv[i+1])
+              del(argv[i:i+2])
+          elif argv[i] in ["-s", "-size","--size"]:
+              size = int(argv[i+1])
+              del(argv[i:i+2])
+          elif argv[i] in ["-j", "-jobs","--jobs"]:
+              max_concurrent = int(argv[i+1])
+              del(argv[i:i+2])
+          elif argv[i] in ["-rate","--rate"]:
+              max_rate = float(argv[i+1])
+              del(argv[i:i+2])
+          else:
+              command_line_error("option invalide: " + argv[i], HELP_MESSAGE)
+              return
+      else:
+          i = i + 1
+  args = argv[1:]
+  if len(args) == 0 or len(args) % 2 != 0:
+      command_line_error("nombre d'arguments invalide", HELP_MESSAGE)
+      return
+  communes = list(zip(args[0::2], args[1::2]))
+  result = asyncio.run(download_communes(communes, size, ratio, max_concurrent, max_rate))
+  for f in result:
+      sys.stdout.write(f)
+      sys.stdout.write("\n")
+  sys.stdout.flush()
+  return result
+
+if __name__ == '__main__':
+    cadastre_communes_2_pdfs(sys.argv)
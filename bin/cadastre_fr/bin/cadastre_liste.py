@@ -15,6 +15,10 @@
 """
 Liste les départements et les communes du cadastre
 (https://cadastre.gouv.fr)
+
+Met aussi à jour la base des métadonnées du cadastre si elle est activée
+(variable d'environnement CADASTRE_METADATA_DB), avec l'option -bbox pour
+y ajouter la projection et la bbox de toutes les communes.
 """
 
 import re
@@ -28,10 +32,30 @@ from cadastre_fr.tools import command_line_error
 from cadastre_fr.website import CadastreWebsite
 from cadastre_fr.download_pdf import PDF_DOWNALOD_WAIT_SECONDS
 
+HELP_MESSAGE = """Liste les départements et les communes du cadastre
+OPTIONS:
+    -bbox : met aussi à jour la projection et la bbox de toutes les communes
+            dans la base des métadonnées (une requête par commune)
+USAGE:
+{0} [-bbox]""".format(sys.argv[0])
+
 postal_code_suffix = re.compile(".* \([0-9A-Z]{5}\)$")
 
 def cadastre_liste_dep_com(argv):
-    cadastreWebsite = CadastreWebsite()
+    with_bbox = False
+    for arg in argv[1:]:
+        if arg in ["-h", "-help","--help"]:
+            command_line_error(None, HELP_MESSAGE)
+            return
+        elif arg in ["-bbox", "--bbox"]:
+            with_bbox = True
+        else:
+            command_line_error("argument invalide: " + arg, HELP_MESSAGE)
+            return
+    cadastreWebsite = CadastreWebsite(refresh_metadata=True)
+    if with_bbox and cadastreWebsite.metadata_store == None:
+        command_line_error("la base des métadonnées n'est pas activée (CADASTRE_METADATA_DB)", HELP_MESSAGE)
+        return
     departements = cadastreWebsite.get_departements()
     if len(departements) > 0:
         with open("dep-liste.txt","w") as dep_file:
@@ -54,6 +78,13 @@ def cadastre_liste_dep_com(argv):
                             com_name = com_name[:-8]
                         #print(dep_code, com_code, com_name)
                         com_file.write('{} {} "{}"\n'.format(dep_code, com_code, com_name))
+                if with_bbox:
+                    for com_code in sorted(communes.keys()):
+                        time.sleep(PDF_DOWNALOD_WAIT_SECONDS)
+                        try:
+                            cadastreWebsite.set_commune(com_code)
+                        except:
+                            print("ERREUR: projection et bbox introuvables pour la commune", com_code)
             else:
                 print("ERREUR: aucune commune trouvée pour le département", dep_code)
     else:
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Maintenance du cache partagé des exports PDF du cadastre, ou du cache des
+résultats de leur analyse.
+"""
+
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from cadastre_fr.tools      import command_line_error
+from cadastre_fr.tile_cache import TileCache
+from cadastre_fr.tile_cache import TILE_CACHE_DIR
+from cadastre_fr.parse_cache import ParseResultCache
+from cadastre_fr.parse_cache import PARSE_CACHE_DIR
+
+
+HELP_MESSAGE = """Maintenance du cache des PDF du cadastre
+USAGE:
+{0}  [-evict] [-parse] [REPERTOIRE_DU_CACHE]
+OPTIONS:
+    -evict : supprime les PDF trop vieux ou les moins récemment utilisés
+             si le cache est trop gros.
+    -parse : traite le cache des résultats d'analyse des PDF au lieu du
+             cache des PDF.
+Le répertoire par défaut est donné par la variable d'environnement
+CADASTRE_TILE_CACHE_DIR (CADASTRE_PARSE_CACHE_DIR avec -parse)""".format(sys.argv[0])
+
+
+def main(argv):
+    evict = False
+    parse = False
+    args = []
+    for arg in argv[1:]:
+        if arg in ["-h", "-help","--help"]:
+            command_line_error(None, HELP_MESSAGE)
+        elif arg in ["-evict", "--evict"]:
+            evict = True
+        elif arg in ["-parse", "--parse"]:
+            parse = True
+        elif arg.startswith("-"):
+            command_line_error("option invalide: " + arg, HELP_MESSAGE)
+        else:
+            args.append(arg)
+    if len(args) > 1:
+        command_line_error("trop d'arguments", HELP_MESSAGE)
+    directory = args[0] if args else (PARSE_CACHE_DIR if parse else TILE_CACHE_DIR)
+    if not directory:
+        command_line_error("répertoire du cache non défini", HELP_MESSAGE)
+    cache = ParseResultCache(directory) if parse else TileCache(directory)
+    if evict:
+        cache.evict()
+    stats = cache.get_stats()
+    print("%d %s, %.1f Mo (max %.1f Mo)" % (
+        stats["results"] if parse else stats["tiles"],
+        "résultats" if parse else "PDF",
+        stats["bytes"] / 1024.0 / 1024, stats["max_bytes"] / 1024.0 / 1024))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -25,9 +25,20 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 from cadastre_fr.osm       import OsmWriter
 from cadastre_fr.building  import pdf_2_osm_buildings_water_and_limit
+from cadastre_fr.manifest  import RunManifest
+from cadastre_fr.parser    import PDF_PARSE_WORKERS
 
 
 def main(argv):
+    # Option -j N : nombre de processus d'analyse des PDF
+    workers = PDF_PARSE_WORKERS
+    i = 1
+    while i < len(argv):
+        if argv[i] in ["-j", "-jobs", "--jobs"]:
+            workers = int(argv[i+1])
+            del(argv[i:i+2])
+        else:
+            i = i + 1
     if len(argv) == 2 and len(argv[1]) == 5:
         prefix = argv[1]
         pattern = prefix + "-[0-9]*-[0-9]*.pdf"
@@ -48,13 +59,21 @@ def main(argv):
         print("ERROR: too many .osm arguments")
         return -1
     else:
-        osm_buildings, osm_water, osm_limit = pdf_2_osm_buildings_water_and_limit(pdf_args)
+        pdf_args.sort()
+        inputs = pdf_args + [os.path.splitext(f)[0] + ".bbox" for f in pdf_args]
+        outputs = [prefix + "-houses.osm", prefix + "-water.osm", prefix + "-city-limit.osm"]
+        manifest = RunManifest(prefix + "-manifest.json")
+        if manifest.is_up_to_date("houses", inputs, outputs):
+            print("PDF inchangés, réutilise " + ", ".join(outputs))
+            return 0
+        osm_buildings, osm_water, osm_limit = pdf_2_osm_buildings_water_and_limit(pdf_args, workers)
         osm_buildings.update_bbox()
         osm_water.update_bbox()
         osm_limit.update_bbox()
-        OsmWriter(osm_buildings).write_to_file(prefix + "-houses.osm")
-        OsmWriter(osm_water).write_to_file(prefix + "-water.osm")
-        OsmWriter(osm_limit).write_to_file(prefix + "-city-limit.osm")
+        OsmWriter(osm_buildings).write_to_file(outputs[0])
+        OsmWriter(osm_water).write_to_file(outputs[1])
+        OsmWriter(osm_limit).write_to_file(outputs[2])
+        manifest.record("houses", inputs, outputs)
     return 0
 
 
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Extrait en une seule analyse des fichiers PDF du cadastre toutes les
+couches des exports de bâtiments et d'adresses: bâtiments, eau, limite
+de la commune, numéros et noms. Le résultat de l'analyse est aussi
+enregistré pour être réutilisé par cadastre_2_osm_addresses.py.
+"""
+
+
+import sys
+import os.path
+from glob import glob
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from cadastre_fr.osm       import OsmWriter
+from cadastre_fr.tools     import command_line_error
+from cadastre_fr.layers    import pdf_2_osm_layers
+from cadastre_fr.layers    import LAYERS
+from cadastre_fr.manifest  import RunManifest
+from cadastre_fr.parser    import PDF_PARSE_WORKERS
+
+
+HELP_MESSAGE = """Extraction de toutes les couches des PDF du cadastre d'une commune
+USAGE:
+{0} [-j N] CODE_COMMUNE
+           analyse les fichiers CODE_COMMUNE-*-*.pdf du répertoire courant
+           et écrit les fichiers CODE_COMMUNE-{1}.osm
+OPTIONS:
+    -j N : nombre de processus d'analyse des PDF (défaut: {2}).""".format(
+        sys.argv[0], "|".join(LAYERS), PDF_PARSE_WORKERS)
+
+
+def main(argv):
+    workers = PDF_PARSE_WORKERS
+    i = 1
+    while i < len(argv):
+        if argv[i].startswith("-"):
+            if argv[i] in ["-h", "-help","--help"]:
+                command_line_error(None, HELP_MESSAGE)
+                return 0
+            elif argv[i] in ["-j", "-jobs", "--jobs"]:
+                workers = int(argv[i+1])
+                del(argv[i:i+2])
+            else:
+                command_line_error("option invalide: " + argv[i], HELP_MESSAGE)
+                return -1
+        else:
+            i = i + 1
+    if len(argv) != 2 or len(argv[1]) != 5:
+        command_line_error("code commune attendu", HELP_MESSAGE)
+        return -1
+    code_commune = argv[1]
+    pdfs = sorted(glob(code_commune + "-[0-9]*-[0-9]*.pdf"))
+    if len(pdfs) == 0:
+        command_line_error("aucun fichier .pdf", HELP_MESSAGE)
+        return -1
+    inputs = pdfs + [os.path.splitext(f)[0] + ".bbox" for f in pdfs]
+    outputs = [code_commune + "-" + layer + ".osm" for layer in LAYERS]
+    manifest = RunManifest(code_commune + "-manifest.json")
+    if manifest.is_up_to_date("layers", inputs, outputs):
+        print("PDF inchangés, réutilise " + ", ".join(outputs))
+        return 0
+    layers = pdf_2_osm_layers(code_commune, pdfs, workers)
+    for layer, output in zip(LAYERS, outputs):
+        layers[layer].update_bbox()
+        OsmWriter(layers[layer]).write_to_file(output)
+    # Les trois premières couches sont celles de pdf_2_osm_houses.py, qui
+    # n'aura pas à les régénérer:
+    manifest.record("houses", inputs, outputs[:3])
+    manifest.record("layers", inputs, outputs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -30,6 +30,7 @@ import sys
 import math
 import time
 import glob
+import pickle
 import zipfile
 import os.path
 import operator
@@ -80,7 +81,13 @@ from .parcel        import iter_download_parcels_info_pdf
 from .parcel        import match_parcels_and_housenumbers
 from .parcel        import parse_addresses_of_parcels_info_pdfs
 from .parcel        import polygons_and_index_from_parcels_limits
-from .parser        import CadastreParser
+from .parser        import iter_parse_pdfs
+from .parser        import merge_pdfs_parse_results
+from .parser        import write_parse_report
+from .parser        import PARSE_STATS_NAME
+from .parser        import PDF_PARSE_WORKERS
+from .manifest      import RunManifest
+from .manifest      import file_hash
 from .fantoir       import cherche_fantoir_et_osm_highways
 from .fantoir       import get_osm_buildings_and_barrier_ways
 from .globals       import SOURCE_TAG
@@ -113,12 +120,18 @@ from .partitioning  import partition_osm_nodes_filename_map
 FIXME_JOINDRE_NOEUD_AU_WAY = "Joindre le nœud au bâtiment (J)"
 MAX_BUILDING_DISTANCE_METERS = 2
 NODE_INSIDE_BUILDING_DISTANCE_MARGIN = 0.1
+# Recognizers utilisés pour analyser les PDF (l'ordre est celui dans
+# lequel ils essaient de reconnaître chaque path):
+PDF_PARSE_RECOGNIZERS = (ParcelPathRecognizer, NamePathRecognizer, HousenumberPathRecognizer)
+PDF_PARSE_LABELS = [("parcels", "parcelles"), ("housenumbers", "numéros"), ("lieuxdits", "lieux-dits"),
+    ("street_names", "noms"), ("small_names", "petits noms")]
 
 
 
-def cadastre_2_osm_addresses(cadastreWebsite, code_departement, code_commune,  nom_commune, download, bis, merge_addresses, use_external_data, split_result):
+def cadastre_2_osm_addresses(cadastreWebsite, code_departement, code_commune,  nom_commune, download, bis, merge_addresses, use_external_data, split_result, parse_workers=PDF_PARSE_WORKERS):
     if download:
         print_flush("Teléchargement des adresses cadastrales de la commune " + code_commune + " : " + nom_commune)
+        # Les PDF sont analysés au fur et à mesure de leur téléchargement:
         pdfs = download_pdfs(cadastreWebsite, code_departement, code_commune)
     else:
         pdfs = glob.glob(code_commune + "-[0-9]*-[0-9]*.pdf")
@@ -127,7 +140,7 @@ def cadastre_2_osm_addresses(cadastreWebsite, code_departement, code_commune,  n
             command_line_error("Aucun PDF téléchargé")
             return
     projection, parcels_limits, housenumbers, lieuxdits_names, street_names, small_names = \
-            parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names(pdfs)
+            parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names_with_manifest(code_commune, pdfs, parse_workers)
     parcels_polygons, parcels_index = polygons_and_index_from_parcels_limits(parcels_limits)
 
     print_flush("Chargement des infos xml (id et position) d'environ %d parcelles:" % len(parcels_polygons))
@@ -230,23 +243,92 @@ def cadastre_2_osm_addresses(cadastreWebsite, code_departement, code_commune,  n
     except:
         traceback.print_exc()
 
-
-
-
-def parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names(pdfs):
-    nb = [0, 0, 0, 0, 0]
-    parcel_recognizer = ParcelPathRecognizer()
-    name_recognizer = NamePathRecognizer()
-    housenumber_recognizer = HousenumberPathRecognizer()
-    cadastre_parser = CadastreParser([parcel_recognizer.handle_path, name_recognizer.handle_path, housenumber_recognizer.handle_path])
+    if download:
+        stats = cadastreWebsite.get_connection_stats()
+        print_flush("Connexions au site du cadastre: %d connexions pour %d requêtes" % (
+            len(stats), sum([s["requests"] for s in stats])))
+
+
+
+
+def parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names_with_manifest(code_commune, pdfs, workers=1):
+    """Réutilise le résultat de l'analyse précédente des pdfs qui n'ont pas
+       changé, enregistré pdf par pdf dans un fichier .pickle.
+       Le rapport de l'analyse est écrit dans
+       CODE_COMMUNE-adresses-recognition.json (voir
+       parser.write_parse_report()), les pdfs dont le résultat est réutilisé
+       y ayant la source "previous_run"."""
+    results = {}
+    for filename, result in iter_parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names(
+            pdfs, workers, get_pdf_parse_cached_result(code_commune)):
+        results[filename] = result
+    save_pdf_parse_results(code_commune, results)
+    write_parse_report(code_commune + "-adresses-recognition.json", results)
+    return get_parcels_housenumbers_lieuxdits_street_names(
+        merge_pdfs_parse_results(list(results.values())))
+
+
+def get_pdf_parse_cached_result(code_commune):
+    """Retourne la fonction cached_result de parser.iter_parse_pdfs() qui
+       donne le résultat enregistré par save_pdf_parse_results() des pdfs
+       qui n'ont pas changé."""
+    manifest = RunManifest(code_commune + "-manifest.json")
+    output = code_commune + "-pdf-parse.pickle"
+    previous_hashes = manifest.get_input_hashes("pdf_parse")
+    previous_results = {}
+    if previous_hashes and os.path.exists(output):
+        try:
+            with open(output, "rb") as f:
+                previous_results = pickle.load(f)
+            if not isinstance(previous_results, dict):
+                previous_results = {}
+        except:
+            previous_results = {}
+    def cached_result(filename):
+        name = os.path.basename(filename)
+        bbox_filename = os.path.splitext(filename)[0] + ".bbox"
+        if (name in previous_results) \
+                and isinstance(previous_results[name], dict) \
+                and (previous_hashes.get(name) == file_hash(filename)) \
+                and (previous_hashes.get(os.path.basename(bbox_filename)) == file_hash(bbox_filename)):
+            return previous_results[name]
+        return None
+    return cached_result
+
+
+def save_pdf_parse_results(code_commune, results):
+    """Enregistre le résultat de l'analyse de chaque pdf (dictionnaire
+       nom du pdf -> résultat), restreint à ce qu'utilisent les adresses,
+       pour qu'il soit réutilisé tant que les pdfs ne changent pas.
+       Les résultats d'une analyse incomplète ne sont pas enregistrés."""
+    manifest = RunManifest(code_commune + "-manifest.json")
+    output = code_commune + "-pdf-parse.pickle"
+    names = ["projection"] + [name for name, label in PDF_PARSE_LABELS]
+    results = dict((filename, result) for filename, result in results.items()
+        if all(record.get("ok", False) for record in result.get(PARSE_STATS_NAME, [{"ok": True}])))
+    with open(output, "wb") as f:
+        pickle.dump({os.path.basename(filename): {name: result[name] for name in names if name in result}
+                     for filename, result in results.items()}, f, pickle.HIGHEST_PROTOCOL)
+    pdfs = sorted(results.keys())
+    inputs = pdfs + [os.path.splitext(f)[0] + ".bbox" for f in pdfs]
+    manifest.record("pdf_parse", inputs, [output])
+
+
+def parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names(pdfs, workers=1):
+    results = [result for filename, result in
+        iter_parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names(pdfs, workers)]
+    return get_parcels_housenumbers_lieuxdits_street_names(merge_pdfs_parse_results(results))
+
+
+def get_parcels_housenumbers_lieuxdits_street_names(result):
+    return result["projection"], result.get("parcels", []), result.get("housenumbers", []), \
+        result.get("lieuxdits", []), result.get("street_names", []), result.get("small_names", [])
+
+
+def iter_parse_pdfs_for_parcels_housenumbers_lieuxdits_street_names(pdfs, workers=1, cached_result=None):
+    """Voir parser.iter_parse_pdfs()."""
     print_flush("Parse les exports PDF du cadastre:")
-    for filename in pdfs:
-        cadastre_parser.parse(filename)
-        new_nb = [len(parcel_recognizer.parcels), len(housenumber_recognizer.housenumbers), len(name_recognizer.lieuxdits), len(name_recognizer.street_names), len(name_recognizer.small_names)]
-        diff = list(map(operator.sub, new_nb, nb))
-        print_flush(filename + ": " + ", ".join([str(val) + " " + name for name,val in zip(["parcelles", "numéros","lieux-dits", "noms", "petits noms"], diff)]))
-        nb = new_nb
-    return cadastre_parser.cadastre_projection, parcel_recognizer.parcels, housenumber_recognizer.housenumbers, name_recognizer.lieuxdits, name_recognizer.street_names, name_recognizer.small_names
+    return iter_parse_pdfs(pdfs, PDF_PARSE_RECOGNIZERS, workers, cached_result, PDF_PARSE_LABELS)
 
 
 
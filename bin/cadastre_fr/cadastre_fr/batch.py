@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Traitement par lot des communes de départements entiers.
+
+Les communes sont mises dans une file persistante (base SQLite), puis
+traitées par plusieurs workers qui lancent les scripts import-ville2.sh
+(type "bati") ou import-adresses.sh (type "adresses"), comme le fait
+l'interface web.
+L'état de chaque commune est enregistré dans la file, ce qui permet de
+reprendre le traitement après un arrêt ou un plantage.
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import threading
+import subprocess
+import contextlib
+
+from .tools import print_flush
+from .website import CadastreWebsite
+
+
+# Scripts lancés pour chaque type de traitement, avec leurs arguments après
+# département, commune et nom de la commune (mêmes valeurs par défaut que
+# l'interface web):
+BATCH_JOB_SCRIPTS = {
+    "bati": ("import-ville2.sh", []),
+    "adresses": ("import-adresses.sh", ["true", "false"]),
+}
+# Age au delà duquel un fichier de verrou de l'interface web est ignoré
+# (même valeur que dans web/index.php):
+BATCH_LOCK_MAX_AGE_SECONDS = 2*60*60
+# Intervalle entre deux affichages du débit:
+BATCH_REPORT_INTERVAL_SECONDS = 10*60
+# Code de retour d'un script interrompu par SIGINT (128 + 2):
+BATCH_INTERRUPTED_EXIT_CODE = 130
+
+LISTE_LINE_PATTERN = re.compile('^([0-9A-Z]{3}) ([0-9A-Z]{5}) "(.*)"$')
+POSTAL_CODE_SUFFIX_PATTERN = re.compile(" \\([0-9A-Z]{5}\\)$")
+
+
+def read_config(filename):
+    """Lit le fichier config généré par le Makefile (lignes clé=valeur)."""
+    config = {}
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if "=" in line and not line.startswith("#"):
+                key, value = line.split("=", 1)
+                config[key] = value
+    return config
+
+
+def read_communes_liste(filename):
+    """Lit un fichier DEP-liste.txt généré par cadastre_liste.py
+       et retourne une liste de tuples (departement, commune, nom)."""
+    result = []
+    with open(filename) as f:
+        for line in f:
+            match = LISTE_LINE_PATTERN.match(line.strip())
+            if match:
+                result.append(match.groups())
+    return result
+
+
+def get_communes(data_dir, code_departement):
+    """Retourne les communes du département, depuis son fichier
+       DEP-liste.txt s'il existe, sinon depuis le site du cadastre."""
+    filename = os.path.join(data_dir, code_departement, code_departement + "-liste.txt")
+    if os.path.exists(filename):
+        return read_communes_liste(filename)
+    cadastreWebsite = CadastreWebsite()
+    cadastreWebsite.set_departement(code_departement)
+    return [(code_departement, code_commune, POSTAL_CODE_SUFFIX_PATTERN.sub("", nom_commune))
+            for code_commune, nom_commune in sorted(cadastreWebsite.get_communes().items())]
+
+
+class Job(object):
+    __slots__ = ("id", "departement", "commune", "nom", "type", "attempts")
+    def __init__(self, id, departement, commune, nom, type, attempts):
+        self.id = id
+        self.departement = departement
+        self.commune = commune
+        self.nom = nom
+        self.type = type
+        self.attempts = attempts
+    def __str__(self):
+        return "%s %s %s (%s)" % (self.departement, self.commune, self.nom, self.type)
+
+
+class JobQueue(object):
+    """File persistante des communes à traiter.
+       Une commune passe par les états "pending", "running", puis "done"
+       ou "failed".
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with self.__connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                departement TEXT,
+                commune TEXT,
+                nom TEXT,
+                type TEXT,
+                status TEXT,
+                attempts INTEGER,
+                started REAL,
+                finished REAL,
+                UNIQUE (departement, commune, type))""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+
+    @contextlib.contextmanager
+    def __connect(self):
+        # Une connexion par opération, la file étant utilisée par plusieurs
+        # threads, voire plusieurs processus:
+        db = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+        finally:
+            db.close()
+
+    def enqueue(self, communes, job_type):
+        """Ajoute les (departement, commune, nom) à la file, sauf ceux qui y
+           sont déjà. Retourne le nombre de communes ajoutées."""
+        with self.__connect() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO jobs(departement, commune, nom, type, status, attempts) VALUES (?,?,?,?,'pending',0)",
+                [(departement, commune, nom, job_type) for departement, commune, nom in communes])
+            return db.total_changes - before
+
+    def resume(self):
+        """Remet en attente les communes dont le traitement a été
+           interrompu. Retourne leur nombre."""
+        with self.__connect() as db:
+            return db.execute("UPDATE jobs SET status='pending' WHERE status='running'").rowcount
+
+    def retry_failed(self):
+        """Remet en attente les communes en échec. Retourne leur nombre."""
+        with self.__connect() as db:
+            return db.execute("UPDATE jobs SET status='pending' WHERE status='failed'").rowcount
+
+    def take(self):
+        """Retourne la prochaine commune à traiter, marquée "running",
+           ou None si la file est vide."""
+        with self.__connect() as db:
+            row = db.execute("SELECT id, departement, commune, nom, type, attempts FROM jobs WHERE status='pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status='running', attempts=attempts+1, started=?, finished=NULL WHERE id=?",
+                (time.time(), row[0]))
+            job = Job(*row)
+            job.attempts = job.attempts + 1
+            return job
+
+    def finish(self, job, ok):
+        with self.__connect() as db:
+            db.execute("UPDATE jobs SET status=?, finished=? WHERE id=?",
+                ("done" if ok else "failed", time.time(), job.id))
+
+    def get_counts(self):
+        """Retourne le nombre de communes par état."""
+        with self.__connect() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def get_done_since(self, since):
+        with self.__connect() as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status='done' AND finished >= ?", (since,)).fetchone()[0]
+
+
+class BatchRunner(object):
+    """Traite les communes d'une JobQueue avec plusieurs workers."""
+
+    def __init__(self, queue, config, workers):
+        self.queue = queue
+        self.bin_dir = config["bin_dir"]
+        self.log_dir = config.get("log_dir")
+        self.lock_dir = config.get("lock_dir")
+        self.workers = workers
+        self.start_time = None
+        self.last_report_time = None
+        self.report_lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def run(self):
+        self.start_time = time.time()
+        self.last_report_time = self.start_time
+        nb = self.queue.resume()
+        if nb > 0:
+            print_flush("Reprise de %d communes interrompues" % nb)
+        # La fin de chaque worker est signalée par un Event plutôt qu'attendue
+        # avec Thread.join(), qui interrompu par Ctrl-C peut considérer le
+        # thread comme terminé alors qu'il ne l'est pas:
+        finished = [threading.Event() for i in range(self.workers)]
+        def worker(finished):
+            try:
+                self.worker()
+            finally:
+                finished.set()
+        threads = [threading.Thread(target=worker, args=(finished[i],), name="batch-%d" % i) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for event in finished:
+                while not event.wait(1):
+                    pass
+        except KeyboardInterrupt:
+            # Les imports en cours, lancés dans leur propre session, ne
+            # reçoivent pas le Ctrl-C; les communes qui seraient quand même
+            # interrompues seront reprises au prochain lancement:
+            print_flush("Arrêt demandé, attente de la fin des communes en cours...")
+            self.stop.set()
+            for event in finished:
+                event.wait()
+        self.report()
+
+    def worker(self):
+        while not self.stop.is_set():
+            job = self.queue.take()
+            if job is None:
+                break
+            start = time.time()
+            ok = self.run_job(job)
+            # Une commune interrompue reste "running", pour être reprise
+            # par resume() au prochain lancement:
+            if ok is not None and (not self.stop.is_set() or ok):
+                self.queue.finish(job, ok)
+            print_flush("%s %s: %s en %d s" % (time.strftime("%H:%M:%S"), job,
+                "interrompu" if ok is None else "ok" if ok else "ERREUR", time.time() - start))
+            with self.report_lock:
+                if time.time() > self.last_report_time + BATCH_REPORT_INTERVAL_SECONDS:
+                    self.last_report_time = time.time()
+                    self.report()
+
+    def run_job(self, job):
+        """Lance le script de la commune, et retourne True s'il a réussi,
+           False s'il a échoué, ou None s'il a été interrompu par un signal.
+           Le script est lancé dans sa propre session pour ne pas recevoir
+           le Ctrl-C destiné au batch, qui attend la fin des communes en
+           cours (voir run())."""
+        script, args = BATCH_JOB_SCRIPTS[job.type]
+        name = "%s-%s-%s-%s" % (job.departement, job.commune, job.nom, job.type)
+        lock_file = None
+        if self.lock_dir:
+            # Même verrou que l'interface web, pour ne pas traiter la
+            # commune deux fois en même temps:
+            lock_file = os.path.join(self.lock_dir, job.departement, name + ".lock")
+            if os.path.exists(lock_file) and (time.time() - os.path.getmtime(lock_file)) < BATCH_LOCK_MAX_AGE_SECONDS:
+                print_flush("%s: import déjà en cours" % job)
+                return False
+            os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+            open(lock_file, "a").close()
+        try:
+            log = subprocess.DEVNULL
+            if self.log_dir:
+                log_file = os.path.join(self.log_dir, job.departement, name + ".log")
+                os.makedirs(os.path.dirname(log_file), exist_ok=True)
+                log = open(log_file, "w")
+            try:
+                returncode = subprocess.call(
+                    [os.path.join(self.bin_dir, script), job.departement, job.commune, job.nom] + args,
+                    cwd=self.bin_dir, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                    start_new_session=True)
+                if returncode < 0 or returncode == BATCH_INTERRUPTED_EXIT_CODE:
+                    return None
+                return returncode == 0
+            finally:
+                if log != subprocess.DEVNULL:
+                    log.close()
+        finally:
+            if lock_file and os.path.exists(lock_file):
+                os.remove(lock_file)
+
+    def report(self):
+        counts = self.queue.get_counts()
+        elapsed = time.time() - self.start_time
+        done = self.queue.get_done_since(self.start_time)
+        rate = (done * 3600.0 / elapsed) if elapsed > 0 else 0
+        total = sum(counts.values())
+        line = "Débit: %.1f communes/heure (%d en %s) - %d/%d terminées, %d en échec, %d en attente" % (
+            rate, done, time.strftime("%H:%M:%S", time.gmtime(elapsed)),
+            counts.get("done", 0), total, counts.get("failed", 0), counts.get("pending", 0))
+        remaining = counts.get("pending", 0) + counts.get("running", 0)
+        if rate > 0 and remaining > 0:
+            line = line + ", fin estimée dans %.1f h" % (remaining / rate)
+        print_flush(line)
@@ -16,7 +16,6 @@
 
 import sys
 import copy
-import operator
 import rtree.index
 from shapely.geometry.polygon import Polygon
 from shapely.geometry.polygon import LineString
@@ -25,7 +24,8 @@ from shapely.geometry.polygon import LineString
 from .osm        import Osm, Node, Way, Relation, OsmParser, OsmWriter
 from .osm_tools  import osm_add_polygon_or_multipolygon
 from .osm_tools  import osm_add_line_way
-from .parser     import CadastreParser
+from .parser     import iter_parse_pdfs
+from .parser     import merge_pdfs_parse_results
 from .globals    import SOURCE_TAG
 from .geometry   import SimilarGeometryDetector
 from .transform  import CadastreToOSMTransform
@@ -33,9 +33,13 @@ from .recognizer import BuildingPathRecognizer
 from .recognizer import WaterPathRecognizer
 from .recognizer import StandardPathRecognizer
 
-def pdf_2_osm_buildings_water_and_limit(pdf_filename_list):
+# Libellés des résultats affichés pour chaque pdf:
+PDF_PARSE_LABELS = [("buildings", "buildings"), ("light_buildings", "light buildings"),
+    ("waters", "water"), ("riverbanks", "riverbank"), ("limit", "limit")]
+
+def pdf_2_osm_buildings_water_and_limit(pdf_filename_list, workers=1):
     projection, buildings, light_buildings, waters, riverbanks, limit  = \
-        pdf_2_buildings_water_and_limit(pdf_filename_list)
+        pdf_2_buildings_water_and_limit(pdf_filename_list, workers)
     cadastre_to_osm_transform = CadastreToOSMTransform(projection).transform_point
     osm_buildings = buildings_to_osm(buildings, light_buildings, cadastre_to_osm_transform)
     osm_water = water_to_osm(waters, riverbanks, cadastre_to_osm_transform)
@@ -103,23 +107,15 @@ def limit_to_osm(limit, transform):
         add_limit(linear_rings)
     return osm
 
-def pdf_2_buildings_water_and_limit(pdfs):
-    recognizer = StandardPathRecognizer()
-    cadastre_parser = CadastreParser([recognizer.handle_path])
+def pdf_2_buildings_water_and_limit(pdfs, workers=1):
+    """Analyse les pdfs, avec workers processus si workers > 1 (le
+       résultat est le même qu'avec un seul)."""
     sys.stdout.write("Parse les exports PDF du cadastre:\n")
     sys.stdout.flush()
-    nb = [0] * 5
-    for filename in pdfs:
-        cadastre_parser.parse(filename)
-        new_nb = [len(recognizer.buildings), len(recognizer.light_buildings), len(recognizer.waters), len(recognizer.riverbanks), len(recognizer.limit)]
-        diff = list(map(operator.sub, new_nb, nb))
-        sys.stdout.write(filename + ": " + ", ".join([
-              str(val) + " " + name
-              for name,val in zip(["buildings", "light buildings", "water", "riverbank", "limit"], diff)])
-            + "\n")
-        sys.stdout.flush()
-        nb = new_nb
-    return cadastre_parser.cadastre_projection, recognizer.buildings, recognizer.light_buildings, recognizer.waters, recognizer.riverbanks, recognizer.limit
+    result = merge_pdfs_parse_results([result for filename, result in
+        iter_parse_pdfs(pdfs, [StandardPathRecognizer], workers, labels=PDF_PARSE_LABELS)])
+    return result["projection"], result.get("buildings", []), result.get("light_buildings", []), \
+        result.get("waters", []), result.get("riverbanks", []), result.get("limit", [])
 
 
 
@@ -24,46 +24,89 @@ et du script import-bati.sh
 
 import re
 import sys
+import math
 import time
 import os.path
 import traceback
+import concurrent.futures
 from shapely.geometry.polygon import Polygon
 
 from .tools import write_string_to_file
 from .tools import write_stream_to_file
 from .tools import command_line_error
 from .tools import download_cached
-from .parser import CadastreParser
+from .tools import RateLimiter
+from .tile_cache import get_default_tile_cache
+from .tile_cache import link_or_copy
+from .parser import iter_pdfparser_paths
+from .parser import parse_pdf_with_recognizers
 from .website import CadastreWebsite
 from .website import command_line_open_cadastre_website
 from .geometry import BoundingBox
 from .transform import OSMToCadastreTransform
 from .recognizer import LimitPathRecognizer
+from .recognizer import ParcelPathRecognizer
+from .recognizer import StandardPathRecognizer
 
 
 PDF_DOWNALOD_WAIT_SECONDS = 2
 # Nombre de pixels / unite projection cadastre des PDF exportés
 PDF_DOWNLOAD_PIXELS_RATIO = 4.5
-# Mode de découpage des pdf: "NB": pour nombre fixe, "SIZE": pour taille fixe:
+# Mode de découpage des pdf: "NB": pour nombre fixe, "SIZE": pour taille fixe,
+# "QUADTREE": pour une taille adaptée à la densité du contenu:
 PDF_DOWNLOAD_SPLIT_MODE = "SIZE"
-# Si MODE="SIZE", Taille dans la projection cadastrale (~ mètres) des PDF exportés:
+# Si MODE="SIZE", Taille dans la projection cadastrale (~ mètres) des PDF exportés.
+# Si MODE="QUADTREE", taille au delà de laquelle un PDF n'est gardé que s'il
+# est vide, les plus grands ne servant sinon qu'à mesurer la densité:
 PDF_DOWNLOAD_SPLIT_SIZE = 200
+# Si MODE="QUADTREE", taille des PDF de départ et taille minimale des PDF
+# après découpage en 4 successifs:
+PDF_DOWNLOAD_QUADTREE_MAX_SIZE = 800
+PDF_DOWNLOAD_QUADTREE_MIN_SIZE = 50
+# Si MODE="QUADTREE", un PDF est découpé en 4 s'il dépasse l'un de ces seuils:
+PDF_DOWNLOAD_QUADTREE_MAX_PATHS = 4000
+PDF_DOWNLOAD_QUADTREE_MAX_BYTES = 2 * 1024 * 1024
+# Si MODE="QUADTREE", nombre maximal de paths utiles d'un PDF plus grand que
+# PDF_DOWNLOAD_SPLIT_SIZE pour qu'il soit gardé (0: seulement s'il n'a
+# aucune géométrie utile):
+PDF_DOWNLOAD_QUADTREE_SPARSE_PATHS = 0
+# Si MODE="QUADTREE", recognizers dont les paths sont comptés pour mesurer
+# la densité d'un PDF (ceux des lignes, les plus nombreux, sans les textes
+# dont les recognizers sont longs à initialiser):
+PDF_DOWNLOAD_QUADTREE_RECOGNIZERS = (StandardPathRecognizer, ParcelPathRecognizer)
 # Si MODE="NB", nombre par lequelle la taille du pdf sera découpée (en
 # largeur et en hauteur):
 PDF_DOWNLOAD_SPLIT_NB = 2
+# Taille maximale en pixels de l'export de toute la commune, téléchargé
+# avant les autres pour connaitre ses limites:
+PDF_DOWNLOAD_OVERVIEW_MAX_PIXELS = 2000
+# Marge (~ mètres) autour des limites de la commune obtenues depuis cet
+# export, pour compenser sa faible résolution:
+PDF_DOWNLOAD_OVERVIEW_LIMIT_MARGIN = 50
+# Nombre de téléchargements simultanés (1 pour télécharger séquentiellement):
+PDF_DOWNLOAD_WORKERS = 1
+# Nombre maximal de requêtes par seconde, tous téléchargements simultanés
+# confondus (None pour le déduire du temps d'attente entre deux téléchargements):
+PDF_DOWNLOAD_MAX_REQUESTS_PER_SECOND = None
 
 
-def download_pdfs(cadastreWebsite, code_departement, code_commune, ratio=PDF_DOWNLOAD_PIXELS_RATIO, mode=PDF_DOWNLOAD_SPLIT_MODE, nb=PDF_DOWNLOAD_SPLIT_NB, size=PDF_DOWNLOAD_SPLIT_SIZE, wait=PDF_DOWNALOD_WAIT_SECONDS,force_bbox=None):
+def download_pdfs(cadastreWebsite, code_departement, code_commune, ratio=PDF_DOWNLOAD_PIXELS_RATIO, mode=PDF_DOWNLOAD_SPLIT_MODE, nb=PDF_DOWNLOAD_SPLIT_NB, size=PDF_DOWNLOAD_SPLIT_SIZE, wait=PDF_DOWNALOD_WAIT_SECONDS,force_bbox=None, workers=PDF_DOWNLOAD_WORKERS, max_rate=PDF_DOWNLOAD_MAX_REQUESTS_PER_SECOND):
     """Download the pdfs from the cadastreWebsite and yield the filenames.
        Try to restrict the results to pdf representing bbox within city limit.
     """
     limitBboxFilterFunc = LimitBboxFilterFunc()
-    for pdf_filename in download_pdfs_filter(cadastreWebsite, code_departement, code_commune, ratio, mode, nb, size, wait, force_bbox, limitBboxFilterFunc):
+    for pdf_filename in download_pdfs_filter(cadastreWebsite, code_departement, code_commune, ratio, mode, nb, size, wait, force_bbox, limitBboxFilterFunc, workers, max_rate, overview=True):
         limitBboxFilterFunc.feed_pdf(pdf_filename)
         yield pdf_filename
 
-def download_pdfs_filter(cadastreWebsite, code_departement, code_commune, ratio, mode, nb, size, wait,force_bbox, bboxFilterFunc):
-    """Download the pdfs from the cadastreWebsite and yield the filenames."""
+def download_pdfs_filter(cadastreWebsite, code_departement, code_commune, ratio, mode, nb, size, wait,force_bbox, bboxFilterFunc, workers=1, max_rate=None, overview=False):
+    """Download the pdfs from the cadastreWebsite and yield the filenames.
+       With workers > 1, the pdfs are downloaded concurrently and the
+       filenames are yielded as soon as each download is finished.
+       With overview=True, a low resolution pdf of the whole commune (or of
+       force_bbox if given) is first downloaded and given to bboxFilterFunc.feed_overview_pdf()
+       so that the filter can be initialized before any other download.
+    """
     cadastreWebsite.set_departement(code_departement)
     cadastreWebsite.set_commune(code_commune)
     projection = cadastreWebsite.get_projection()
@@ -72,10 +115,46 @@ def download_pdfs_filter(cadastreWebsite, code_departement, code_commune, ratio,
     if force_bbox:
         bbox = OSMToCadastreTransform(projection).transform_bbox(
             BoundingBox(*force_bbox))
+    tile_cache = get_default_tile_cache()
+    if overview:
+        overview_filename = download_overview_pdf(cadastreWebsite, code_commune, projection, bbox, tile_cache)
+        if overview_filename:
+            bboxFilterFunc.feed_overview_pdf(overview_filename)
+    if mode=="QUADTREE":
+        for pdf_filename in download_pdfs_quadtree(cadastreWebsite, code_commune, projection, bbox, ratio, size, wait, bboxFilterFunc, workers, max_rate, tile_cache):
+            yield pdf_filename
+        return
     if mode=="SIZE":
         liste = decoupage_bbox_cadastre_size(bbox, size, ratio)
     else:
         liste = decoupage_bbox_cadastre_nb(bbox, nb, ratio)
+    tiles = iter_pdf_tiles(cadastreWebsite, code_commune, projection, liste, bboxFilterFunc)
+    for pdf_filename in download_tiles(cadastreWebsite, tiles, wait, workers, max_rate, tile_cache):
+        yield pdf_filename
+
+def download_tiles(cadastreWebsite, tiles, wait, workers, max_rate, tile_cache):
+    """Télécharge les (pdf_filename, open_function, tile) de tiles,
+       séquentiellement ou avec workers téléchargements simultanés,
+       et génère les noms de fichiers.
+    """
+    if workers > 1:
+        if not max_rate:
+            max_rate = (1.0 / wait) if wait > 0 else None
+        for pdf_filename in download_tiles_concurrently(cadastreWebsite, tiles, workers, max_rate, tile_cache):
+            yield pdf_filename
+    else:
+        for pdf_filename, open_function, tile in tiles:
+            if download_tile(tile_cache, open_function, pdf_filename, tile):
+                time.sleep(wait)
+            yield pdf_filename
+
+def iter_pdf_tiles(cadastreWebsite, code_commune, projection, liste, bboxFilterFunc):
+    """Génère pour chaque sous bbox du découpage liste non exclue par
+       bboxFilterFunc un tuple (pdf_filename, open_function, tile), où tile
+       identifie le pdf pour le cache partagé.
+       Le filtre est appliqué au dernier moment pour qu'il puisse tenir
+       compte des pdf déjà téléchargés.
+    """
     for ((i,j), sous_bbox, (largeur,hauteur)) in liste:
         if (bboxFilterFunc != None) and (not bboxFilterFunc(sous_bbox)):
             continue
@@ -83,10 +162,175 @@ def download_pdfs_filter(cadastreWebsite, code_departement, code_commune, ratio,
         bbox_filename = code_commune + ("-%d-%d" % (i,j)) + ".bbox"
         sous_bbox_str = projection + (":%f,%f,%f,%f" % sous_bbox)
         write_string_to_file(sous_bbox_str,  bbox_filename)
-        open_function = lambda: cadastreWebsite.open_pdf(sous_bbox, largeur, hauteur)
-        if download_cached(open_function, pdf_filename):
-            time.sleep(wait)
-        yield pdf_filename
+        open_function = lambda sous_bbox=sous_bbox, largeur=largeur, hauteur=hauteur: \
+            cadastreWebsite.open_pdf(sous_bbox, largeur, hauteur)
+        yield pdf_filename, open_function, (code_commune, projection, sous_bbox, largeur, hauteur)
+
+def get_overview_tile(bbox):
+    """Retourne la bbox et la taille en pixels (bbox, largeur, hauteur) de
+       l'export basse résolution de toute la bbox de la commune."""
+    xmin,ymin,xmax,ymax = bbox
+    xmin = xmin - 10
+    xmax = xmax + 10
+    ymin = ymin - 10
+    ymax = ymax + 10
+    ratio = min(PDF_DOWNLOAD_PIXELS_RATIO, float(PDF_DOWNLOAD_OVERVIEW_MAX_PIXELS) / max(xmax - xmin, ymax - ymin))
+    largeur = int((xmax - xmin) * ratio)
+    hauteur = int((ymax - ymin) * ratio)
+    return (xmin,ymin,xmax,ymax), largeur, hauteur
+
+def download_overview_pdf(cadastreWebsite, code_commune, projection, bbox, tile_cache=None):
+    """Télécharge un export basse résolution de toute la bbox donnée (celle
+       de la commune ou celle forcée par l'utilisateur), et retourne son nom
+       de fichier (ou None en cas d'erreur)."""
+    (xmin,ymin,xmax,ymax), largeur, hauteur = get_overview_tile(bbox)
+    pdf_filename = code_commune + "-overview.pdf"
+    write_string_to_file(projection + (":%f,%f,%f,%f" % (xmin,ymin,xmax,ymax)), code_commune + "-overview.bbox")
+    open_function = lambda: cadastreWebsite.open_pdf((xmin,ymin,xmax,ymax), largeur, hauteur)
+    try:
+        download_tile(tile_cache, open_function, pdf_filename,
+            (code_commune, projection, (xmin,ymin,xmax,ymax), largeur, hauteur))
+        return pdf_filename
+    except:
+        traceback.print_exc()
+        sys.stderr.write("ATTENTION: problème lors du téléchargement de la vue d'ensemble de la commune\n")
+        return None
+
+def download_tile(tile_cache, open_function, pdf_filename, tile):
+    """Télécharge le pdf si nécessaire, en passant par le cache partagé s'il
+       est activé. Retourne True si le pdf a été réellement téléchargé."""
+    if tile_cache != None:
+        return tile_cache.download_cached(open_function, pdf_filename, *tile)
+    else:
+        return download_cached(open_function, pdf_filename)
+
+def download_tiles_concurrently(cadastreWebsite, tiles, workers, max_rate, tile_cache=None):
+    """Télécharge les (pdf_filename, open_function, tile) de tiles avec un pool
+       de workers threads, en limitant le nombre de requêtes par seconde
+       à max_rate (pour l'ensemble des threads) et le nombre de requêtes
+       simultanées par session du cadastre.
+       Génère les noms de fichiers dans l'ordre de fin des téléchargements.
+    """
+    rate_limiter = RateLimiter(max_rate)
+    def download(pdf_filename, open_function, tile):
+        def rate_limited_open_function():
+            rate_limiter.wait()
+            return open_function()
+        with cadastreWebsite.session_semaphore:
+            download_tile(tile_cache, rate_limited_open_function, pdf_filename, tile)
+        return pdf_filename
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for pdf_filename, open_function, tile in tiles:
+            pending.add(executor.submit(download, pdf_filename, open_function, tile))
+            if len(pending) >= workers:
+                done, pending = concurrent.futures.wait(pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+def download_pdfs_quadtree(cadastreWebsite, code_commune, projection, bbox, ratio, max_leaf_size, wait, bboxFilterFunc, workers, max_rate, tile_cache):
+    """Découpage adaptatif de la bbox: on part de PDF de taille
+       PDF_DOWNLOAD_QUADTREE_MAX_SIZE, que l'on découpe en 4 tant que leur
+       contenu est trop dense (voir quadtree_pdf_is_too_dense()), jusqu'à
+       la taille PDF_DOWNLOAD_QUADTREE_MIN_SIZE.
+       Le nombre de pixels par mètre reste constant, et les PDF gardés
+       sont nommés code_commune-i-j.pdf, où (i,j) est leur position dans
+       la grille la plus fine.
+       Génère les noms de fichiers des PDF gardés, niveau par niveau.
+    """
+    min_size = PDF_DOWNLOAD_QUADTREE_MIN_SIZE
+    xmin,ymin,xmax,ymax = bbox
+    assert(xmin < xmax)
+    assert(ymin < ymax)
+    xmin = xmin - 10
+    xmax = xmax + 10
+    ymin = ymin - 10
+    ymax = ymax + 10
+    # Nombre de cases de la grille la plus fine par côté des PDF de départ:
+    n = 2 ** max(0, int(math.ceil(math.log(float(PDF_DOWNLOAD_QUADTREE_MAX_SIZE) / min_size, 2))))
+    nb_x = int((xmax - xmin - 1) / (n * min_size)) + 1
+    nb_y = int((ymax - ymin - 1) / (n * min_size)) + 1
+    nodes = [(i*n, j*n, n) for i in range(nb_x) for j in range(nb_y)]
+    nb_downloads = 0
+    nb_pdfs = 0
+    while nodes:
+        sys.stderr.write("Découpage adaptatif: %d pdfs de %d m\n" % (len(nodes), nodes[0][2] * min_size))
+        sys.stderr.flush()
+        node_of_pdf = {}
+        def iter_nodes():
+            for node in nodes:
+                i, j, m = node
+                x1 = xmin + i * min_size
+                y1 = ymin + j * min_size
+                sous_bbox = (x1, y1, min(x1 + m * min_size, xmax), min(y1 + m * min_size, ymax))
+                largeur = int((sous_bbox[2] - sous_bbox[0]) * ratio)
+                hauteur = int((sous_bbox[3] - sous_bbox[1]) * ratio)
+                if (bboxFilterFunc != None) and (not bboxFilterFunc(sous_bbox)):
+                    continue
+                name = code_commune + ("-quadtree-%d-%d-%d" % node)
+                write_string_to_file(projection + (":%f,%f,%f,%f" % sous_bbox), name + ".bbox")
+                open_function = lambda sous_bbox=sous_bbox, largeur=largeur, hauteur=hauteur: \
+                    cadastreWebsite.open_pdf(sous_bbox, largeur, hauteur)
+                node_of_pdf[name + ".pdf"] = node
+                yield name + ".pdf", open_function, (code_commune, projection, sous_bbox, largeur, hauteur)
+        subdivided = []
+        for probe_filename in download_tiles(cadastreWebsite, iter_nodes(), wait, workers, max_rate, tile_cache):
+            nb_downloads = nb_downloads + 1
+            i, j, m = node_of_pdf[probe_filename]
+            if m > 1 and quadtree_pdf_is_too_dense(probe_filename, m * min_size, max_leaf_size):
+                m = m // 2
+                for (ci, cj) in [(i, j), (i+m, j), (i, j+m), (i+m, j+m)]:
+                    if (xmin + ci * min_size < xmax) and (ymin + cj * min_size < ymax):
+                        subdivided.append((ci, cj, m))
+            else:
+                # Le PDF de découpage est gardé tel quel, sous le nom
+                # attendu par la suite des traitements:
+                name = code_commune + ("-%d-%d" % (i,j))
+                link_or_copy(probe_filename, name + ".pdf")
+                link_or_copy(probe_filename[:-4] + ".bbox", name + ".bbox")
+                open(name + ".pdf.ok", 'a').close()
+                nb_pdfs = nb_pdfs + 1
+                yield name + ".pdf"
+        nodes = subdivided
+    sys.stderr.write("Découpage adaptatif: %d pdfs gardés pour %d téléchargés\n" % (nb_pdfs, nb_downloads))
+    sys.stderr.flush()
+
+def quadtree_pdf_is_too_dense(pdf_filename, size, max_leaf_size):
+    """Indique si le PDF, de taille size (~ mètres), doit être découpé en 4."""
+    if os.path.getsize(pdf_filename) > PDF_DOWNLOAD_QUADTREE_MAX_BYTES:
+        return True
+    nb_paths = count_pdf_paths(pdf_filename)
+    if size > max_leaf_size:
+        # Au delà de la taille du découpage fixe, on ne garde que les PDF
+        # sans géométrie utile:
+        return nb_paths > PDF_DOWNLOAD_QUADTREE_SPARSE_PATHS
+    return nb_paths > PDF_DOWNLOAD_QUADTREE_MAX_PATHS
+
+_quadtree_path_filter = None
+
+def get_quadtree_path_filter():
+    """Retourne le filtre de pdfparser ne gardant que les paths que les
+       PDF_DOWNLOAD_QUADTREE_RECOGNIZERS peuvent reconnaître."""
+    global _quadtree_path_filter
+    if _quadtree_path_filter is None:
+        rules = []
+        for recognizer_class in PDF_DOWNLOAD_QUADTREE_RECOGNIZERS:
+            for rule in recognizer_class().get_path_filter():
+                if not rule in rules:
+                    rules.append(rule)
+        _quadtree_path_filter = "|".join(rules)
+    return _quadtree_path_filter
+
+def count_pdf_paths(pdf_filename):
+    """Retourne le nombre de paths utiles du PDF, filtrés dès pdfparser
+       sans être analysés par les recognizers."""
+    count = 0
+    for path in iter_pdfparser_paths(pdf_filename, get_quadtree_path_filter()):
+        count = count + 1
+    return count
 
 def decoupage_bbox_cadastre_forced(bbox, nb_x, x_bbox_size, x_pixels_ratio, nb_y, y_bbox_size, y_pixels_ratio):
   sys.stderr.write("Découpe la bbox en %d * %d [%d pdfs]\n" % (nb_x,nb_y,nb_x*nb_y))
@@ -156,8 +400,6 @@ class LimitBboxFilterFunc():
     """
     def __init__(self):
         self.limit = None
-        self.recognizer = LimitPathRecognizer()
-        self.cadastre_parser = CadastreParser([self.recognizer.handle_path])
 
     def __call__(self, bbox):
         keepBbox = True
@@ -172,14 +414,38 @@ class LimitBboxFilterFunc():
         return keepBbox
 
 
+    def feed_overview_pdf(self, pdf_filename):
+        """Initialise the city limits from a low resolution pdf of the whole
+           city bbox, so that the bbox can be filtered before their download.
+           The limits are enlarged by PDF_DOWNLOAD_OVERVIEW_LIMIT_MARGIN to
+           compensate for the low resolution.
+           If no limit is found, the filter will still be fed by feed_pdf().
+        """
+        try:
+            limit = None
+            for linear_rings in parse_pdf_with_recognizers([LimitPathRecognizer], pdf_filename)["limit"]:
+                for ring in linear_rings:
+                    polygon = Polygon(ring)
+                    if limit == None:
+                        limit = polygon
+                    else:
+                        limit = limit.union(polygon)
+            if limit != None:
+                self.limit = limit.buffer(PDF_DOWNLOAD_OVERVIEW_LIMIT_MARGIN)
+                sys.stderr.write("Limites de la commune obtenues depuis sa vue d'ensemble\n")
+                sys.stderr.flush()
+        except:
+            traceback.print_exc()
+            sys.stderr.write("ATTENTION: problème lors de la détection des limites sur la vue d'ensemble\n")
+
     def feed_pdf(self, pdf_filename):
         if self.limit != None:
             pass # Consider only the first PDF with limit data
         else:
             try:
-                self.cadastre_parser.parse(pdf_filename)
-                if len(self.recognizer.limit) > 0:
-                    for linear_rings in self.recognizer.limit:
+                limit = parse_pdf_with_recognizers([LimitPathRecognizer], pdf_filename)["limit"]
+                if len(limit) > 0:
+                    for linear_rings in limit:
                         for ring in linear_rings:
                             polygon = Polygon(ring)
                             if self.limit == None:
@@ -13,9 +13,13 @@
 # along with it. If not, see <http://www.gnu.org/licenses/>.
 
 
+import re
 import sys
 import math
+import operator
+import numpy as np
 import rtree.index
+from array import array
 from .tools import peek
 
 try:
@@ -27,6 +31,12 @@ except:
     sys.exit(-1)
 
 
+# Path au format SVG n'utilisant que les commandes absolues M, L, C et Z,
+# comme ceux générés par pdfparser:
+SVG_ABSOLUTE_PATH_RE = re.compile("^[\\s,]*(?:[MLCZ][-.0-9e\\s,]*)*$")
+SVG_COMMAND_RE = re.compile("([MLCZ])([^MLCZ]*)")
+
+
 def orthoprojection_on_segment_ab_of_point_c(a,b,c):
     """ Retourne la projection orthogonale du point c sur le segment [a,b],
         ou None si c n'est pas en face."""
@@ -153,6 +163,10 @@ class Point(object):
       return 0.5 * abs(p1.x * p2.y - p2.x * p1.y)
 
 def maxdiff(points1, points2):
+    if isinstance(points1, np.ndarray) and isinstance(points2, np.ndarray):
+        return float(np.abs(points1 - points2).max())
+    if isinstance(points1, PointArray) and isinstance(points2, PointArray):
+        return points1.maxdiff(points2)
     return max(
         [ max((abs(points1[i][0] - points2[i][0]),
                abs(points1[i][1] - points2[i][1])))
@@ -227,7 +241,75 @@ class BoundingBox(object):
 
 
 
-
+class PointArray(object):
+    """Suite de points dont les coordonnées (x1, y1, x2, y2, ...) sont
+       stockées dans un seul array('d'), éventuellement partagé: une
+       tranche [i:j] est une vue sur les mêmes coordonnées et non une
+       copie. Les éléments sont des Point créés à la demande."""
+    __slots__ = ("coords", "start", "stop")
+    def __init__(self, coords, start=0, stop=None):
+        self.coords = coords
+        self.start = start
+        self.stop = (len(coords) // 2) if stop is None else stop
+    @staticmethod
+    def from_points(points):
+        coords = array('d')
+        for x, y in points:
+            coords.append(x)
+            coords.append(y)
+        return PointArray(coords)
+    def __len__(self):
+        return self.stop - self.start
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return PointArray(self.coords, self.start + start, self.start + max(start, stop))
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError()
+        i = 2 * (self.start + key)
+        return Point(self.coords[i], self.coords[i+1])
+    def __iter__(self):
+        coords = self.coords
+        for i in range(2 * self.start, 2 * self.stop, 2):
+            yield Point(coords[i], coords[i+1])
+    def distance(self, i, j):
+        """Distance entre les points i et j, sans créer de Point."""
+        n = len(self)
+        if i < 0: i += n
+        if j < 0: j += n
+        if not (0 <= i < n and 0 <= j < n):
+            raise IndexError()
+        coords = self.coords
+        i = 2 * (self.start + i)
+        j = 2 * (self.start + j)
+        dx = coords[j] - coords[i]
+        dy = coords[j+1] - coords[i+1]
+        return math.sqrt(dx*dx + dy*dy)
+    def to_numpy(self):
+        """Retourne les points sous forme d'un tableau numpy de n lignes
+           (x, y), qui partage les coordonnées de ce PointArray."""
+        return np.frombuffer(self.coords, dtype=np.float64)[2 * self.start:2 * self.stop].reshape(-1, 2)
+    def to_array(self):
+        """Retourne une copie des coordonnées des points."""
+        return self.coords[2 * self.start:2 * self.stop]
+    def xs(self):
+        return self.coords[2 * self.start:2 * self.stop:2]
+    def ys(self):
+        return self.coords[2 * self.start + 1:2 * self.stop:2]
+    def bbox(self):
+        xs = self.xs()
+        ys = self.ys()
+        return BoundingBox(min(xs), min(ys), max(xs), max(ys))
+    def maxdiff(self, other):
+        """Equivalent de maxdiff(self, other), sans créer de Point."""
+        n = 2 * len(self)
+        return max(map(abs, map(operator.sub,
+            self.coords[2 * self.start:2 * self.start + n],
+            other.coords[2 * other.start:2 * other.start + n])))
 
 
 class Path(object):
@@ -235,7 +317,8 @@ class Path(object):
     La représentation est destinée a faciliter la reconnaisance.
     Nous représentons avec deux champs:
      - une chaîne représentant une liste de commandes
-     - une liste de points (x,y) (positions absolues)
+     - une liste de points (x,y) (positions absolues), stockée dans un
+       PointArray
     Les commandes peuvent être:
          M : move (1 argument)
          L : line (1 argument)
@@ -247,9 +330,13 @@ class Path(object):
     commands_argument_count = { 'M': 1, 'L':1, 'C':3, 'Q':2,'Z':0}
     def __init__(self, commands, points, style="", d=None):
         self.commands = commands
+        if not isinstance(points, PointArray):
+            points = PointArray.from_points(points)
         self.points = points
         self.most_distant_point_index = None
-        self.angle_and_points_for_path_recognition = {}
+        # Créé à la première utilisation, la plupart des paths n'étant pas
+        # des textes:
+        self.angle_and_points_for_path_recognition = None
         self.style = style
         self.d = d
     def __str__(self):
@@ -266,14 +353,13 @@ class Path(object):
     def bbox(self, i=None):
         # aproximation
         if i == None:
-            return BoundingBox.of_points(self.points)
+            return self.points.bbox()
         else:
-            return BoundingBox.of_points(self.points[:i])
+            return self.points[:i].bbox()
     def p0_distance(self, i=None):
         if i == None: i = self.get_p0_most_distant_point_index()
-        (x1, y1), (x2, y2) =  self.points[0], self.points[i]
-        return math.sqrt((x2-x1)*(x2-x1) + (y2-y1)*(y2-y1))
-    def get_angle_and_points_for_path_recognition(self, i):
+        return self.points.distance(0, i)
+    def get_angle_and_points_for_path_recognition(self, i, n=None):
         """
             Move, rotate and scale the list of points in order to facilitate
             recognition.
@@ -283,25 +369,38 @@ class Path(object):
             i.e. we move everypoints by (-x1,-y1)
             - Then we rotate and scale the points so that the i commes
               at position (1,0)
+
+            Only the n first points are needed (all if n is None), the
+            others may be missing from the result.
+
+            The points are returned as a numpy array of rows (x, y),
+            computed with the same floating point operations as the
+            point by point version, so that the results are identical.
         """
-        if i not in self.angle_and_points_for_path_recognition:
+        if self.angle_and_points_for_path_recognition is None:
+            self.angle_and_points_for_path_recognition = {}
+        n = len(self.points) if n is None else min(n, len(self.points))
+        if i not in self.angle_and_points_for_path_recognition or \
+                len(self.angle_and_points_for_path_recognition[i][1]) < n:
             x1,y1 = self.points[0] # le premier point
             x2, y2 = self.points[i] # le second point
             # le rayon =
             r = math.sqrt((x2-x1)*(x2-x1) + (y2-y1)*(y2-y1))
             if (r == 0.0):
-                self.points_for_path_recognition[i] = 0, self.points
+                self.angle_and_points_for_path_recognition[i] = 0, self.points.to_numpy().copy()
             else:
                 # l'angle:
                 t = math.atan2( (y2-y1), (x2-x1))
                 cosTbyR = math.cos(-t) / r
                 sinTbyR = math.sin(-t) / r
-                self.angle_and_points_for_path_recognition[i] = t, [
-                    Point(
-                        # move rotate and scale the coordinates:
-                        cosTbyR * (x-x1) - sinTbyR * (y-y1),
-                        sinTbyR * (x-x1) + cosTbyR * (y-y1))
-                    for x,y in self.points ]
+                points = self.points[:n].to_numpy()
+                dx = points[:,0] - x1
+                dy = points[:,1] - y1
+                # move rotate and scale the coordinates:
+                normalized = np.empty((len(dx), 2))
+                normalized[:,0] = cosTbyR * dx - sinTbyR * dy
+                normalized[:,1] = sinTbyR * dx + cosTbyR * dy
+                self.angle_and_points_for_path_recognition[i] = t, normalized
         return self.angle_and_points_for_path_recognition[i]
 
     def get_p0_most_distant_point_index(self):
@@ -310,8 +409,10 @@ class Path(object):
             max_squaredist = 0
             max_i = 0
             x0,y0 = self.points[0]
+            xs = self.points.xs()
+            ys = self.points.ys()
             for i in range(1,len(self.points)):
-                xi, yi =  self.points[i]
+                xi, yi = xs[i], ys[i]
                 squaredist = (xi-x0)*(xi-x0) + (yi-y0)*(yi-y0)
                 if squaredist > max_squaredist:
                     max_squaredist = squaredist
@@ -333,7 +434,7 @@ class Path(object):
             scale_factor = self.p0_distance(i) / other.p0_distance(i)
             if scale_factor >= min_scale and scale_factor <= max_scale:
               other_angle, other_points = other.get_angle_and_points_for_path_recognition(i)
-              self_angle, self_points = self.get_angle_and_points_for_path_recognition(i)
+              self_angle, self_points = self.get_angle_and_points_for_path_recognition(i, len(other.points))
               if maxdiff(self_points[:len(other.points)], other_points) < tolerance:
                   result = self_angle - other_angle
                   if result <= -math.pi:
@@ -349,6 +450,44 @@ class Path(object):
     @staticmethod
     def from_svg(d):
         """ Create a Path from a svg d string"""
+        path = Path.from_absolute_svg(d)
+        if path is None:
+            path = Path.from_any_svg(d)
+        return path
+
+    @staticmethod
+    def from_absolute_svg(d):
+        """ Version rapide de from_svg() pour les path n'utilisant que les
+            commandes absolues M, L, C et Z: les commandes sont découpées
+            avec une seule expression régulière, et toutes les coordonnées
+            converties d'un coup.
+            Retourne None si le path utilise d'autres commandes."""
+        if not SVG_ABSOLUTE_PATH_RE.match(d):
+            return None
+        commands = []
+        values = []
+        for command, args in SVG_COMMAND_RE.findall(d):
+            args = args.replace(",", " ").split()
+            if command == 'Z':
+                if args:
+                    return None
+                commands.append('Z')
+                continue
+            arity = 6 if command == 'C' else 2
+            count = len(args) // arity
+            if (count == 0) or (len(args) != count * arity):
+                return None
+            if command == 'M':
+                # M subsequent values becomes L
+                commands.append('M' + 'L' * (count - 1))
+            else:
+                commands.append(command * count)
+            values.extend(args)
+        return Path("".join(commands), PointArray(array('d', map(float, values))), d=d)
+
+    @staticmethod
+    def from_any_svg(d):
+        """ Create a Path from a svg d string, using any svg path command"""
         commands = []
         points = []
         tokens = [ t for t in Path.__svg_path_tokenizer(d)]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Handler urllib qui conserve les connexions HTTP(S) ouvertes (keep-alive)
+pour les réutiliser d'une requête à l'autre, au lieu de payer une nouvelle
+connexion TCP et une nouvelle négociation TLS à chaque requête.
+
+Les connexions sont regroupées par serveur dans un ConnectionPool, qui
+tient à jour des statistiques pour chacune d'elles.
+"""
+
+import ssl
+import time
+import threading
+import http.client
+import urllib.error
+import urllib.request
+
+
+# Durée au delà de laquelle on ne réutilise pas une connexion inutilisée,
+# le serveur l'ayant probablement déjà fermée:
+KEEPALIVE_IDLE_TIMEOUT_SECONDS = 30
+
+# Erreurs indiquant que le serveur a fermé une connexion réutilisée:
+CLOSED_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError)
+# Parmi celles-ci, erreurs indiquant que la requête n'a pas pu être envoyée,
+# elle peut alors être renvoyée quelle que soit sa méthode:
+UNSENT_REQUEST_ERRORS = (
+    http.client.CannotSendRequest,
+    BrokenPipeError)
+# Méthodes qui peuvent être renvoyées sans risque si la connexion a été
+# fermée après l'envoi de la requête (RFC 7231, section 4.2.2):
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE")
+
+
+class ConnectionStats(object):
+    __slots__ = ("scheme", "host", "created", "last_used", "requests", "reconnections", "errors")
+    def __init__(self, scheme, host):
+        self.scheme = scheme
+        self.host = host
+        self.created = time.time()
+        self.last_used = self.created
+        self.requests = 0
+        self.reconnections = 0
+        self.errors = 0
+    def as_dict(self):
+        return {name: getattr(self, name) for name in ConnectionStats.__slots__}
+
+
+class PooledConnection(object):
+    """Une connexion http.client et son état dans le pool."""
+    def __init__(self, scheme, host, timeout, context):
+        if scheme == "https":
+            self.connection = http.client.HTTPSConnection(host, timeout=timeout, context=context)
+        else:
+            self.connection = http.client.HTTPConnection(host, timeout=timeout)
+        self.stats = ConnectionStats(scheme, host)
+        self.busy = False
+        self.response = None
+    def is_available(self):
+        return (not self.busy) and (self.response is None or self.response.isclosed())
+    def is_expired(self):
+        return time.time() > self.stats.last_used + KEEPALIVE_IDLE_TIMEOUT_SECONDS
+    def close(self):
+        self.connection.close()
+
+
+class ConnectionPool(object):
+    """Ensemble des connexions ouvertes, par (scheme, host)."""
+    def __init__(self, context=None):
+        self.context = context if context else ssl.create_default_context()
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.closed_stats = []
+    def acquire(self, scheme, host, timeout):
+        with self.lock:
+            connections = self.connections.setdefault((scheme, host), [])
+            for conn in list(connections):
+                if conn.is_available():
+                    if conn.is_expired():
+                        self.__discard(connections, conn)
+                    else:
+                        conn.busy = True
+                        return conn
+            conn = PooledConnection(scheme, host, timeout, self.context)
+            conn.busy = True
+            connections.append(conn)
+            return conn
+    def release(self, conn, response):
+        with self.lock:
+            conn.response = response
+            conn.busy = False
+            conn.stats.last_used = time.time()
+    def discard(self, conn):
+        with self.lock:
+            connections = self.connections.get((conn.stats.scheme, conn.stats.host), [])
+            if conn in connections:
+                self.__discard(connections, conn)
+    def __discard(self, connections, conn):
+        connections.remove(conn)
+        conn.close()
+        self.closed_stats.append(conn.stats)
+    def close(self):
+        with self.lock:
+            for connections in list(self.connections.values()):
+                for conn in list(connections):
+                    self.__discard(connections, conn)
+    def get_stats(self):
+        """Retourne les statistiques de toutes les connexions, ouvertes ou fermées."""
+        with self.lock:
+            stats = list(self.closed_stats)
+            for connections in self.connections.values():
+                stats.extend([conn.stats for conn in connections])
+            return [s.as_dict() for s in stats]
+
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """Remplace les handler http et https par défaut de urllib, en
+       réutilisant les connexions d'un ConnectionPool.
+    """
+    def __init__(self, pool=None):
+        urllib.request.HTTPHandler.__init__(self)
+        self.pool = pool if pool else ConnectionPool()
+
+    def http_open(self, req):
+        return self.do_keepalive_open("http", req)
+
+    def https_open(self, req):
+        return self.do_keepalive_open("https", req)
+
+    def do_keepalive_open(self, scheme, req):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError("no host given")
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): val for name, val in headers.items()}
+        headers["Connection"] = "keep-alive"
+        method = req.get_method()
+        while True:
+            conn = self.pool.acquire(scheme, host, req.timeout)
+            reused = conn.stats.requests > 0
+            if reused and conn.connection.sock is None:
+                conn.stats.reconnections += 1
+            try:
+                conn.stats.requests += 1
+                conn.connection.request(method, req.selector, req.data, headers)
+                response = conn.connection.getresponse()
+            except CLOSED_CONNECTION_ERRORS as error:
+                conn.stats.errors += 1
+                self.pool.discard(conn)
+                if reused and (isinstance(error, UNSENT_REQUEST_ERRORS) or method in IDEMPOTENT_METHODS):
+                    # Le serveur a fermé la connexion pendant qu'elle était
+                    # inutilisée, on recommence avec une nouvelle connexion.
+                    # Une requête POST qui a pu être reçue n'est pas renvoyée,
+                    # pour ne pas être traitée deux fois:
+                    continue
+                raise urllib.error.URLError(error)
+            except OSError as error:
+                conn.stats.errors += 1
+                self.pool.discard(conn)
+                raise urllib.error.URLError(error)
+            break
+        self.pool.release(conn, response)
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
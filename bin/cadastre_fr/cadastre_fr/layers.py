@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Extraction en une seule analyse des PDF de toutes les couches utilisées
+par les exports de bâtiments (building.py) et d'adresses (address.py):
+tous les recognizers sont enregistrés sur le même CadastreParser, au lieu
+d'analyser les mêmes PDF une fois pour chaque export.
+
+Le résultat utilisé par les adresses est enregistré comme le fait
+address.py, pour que cadastre_2_osm_addresses.py le réutilise tant que
+les PDF ne changent pas.
+"""
+
+from .tools       import print_flush
+from .parser      import iter_parse_pdfs
+from .parser      import merge_pdfs_parse_results
+from .parser      import write_parse_report
+from .address     import save_pdf_parse_results
+from .address     import PDF_PARSE_LABELS as ADDRESS_PDF_PARSE_LABELS
+from .address     import PDF_PARSE_RECOGNIZERS as ADDRESS_PDF_PARSE_RECOGNIZERS
+from .building    import buildings_to_osm
+from .building    import water_to_osm
+from .building    import limit_to_osm
+from .building    import PDF_PARSE_LABELS as BUILDING_PDF_PARSE_LABELS
+from .name        import generate_osm_names
+from .transform   import CadastreToOSMTransform
+from .recognizer  import StandardPathRecognizer
+from .housenumber import generate_osm_housenumbers
+
+
+# Recognizers utilisés pour analyser les PDF, en deux groupes indépendants
+# (voir parser.CadastreParser): chaque path est transmis à la fois à ceux
+# des bâtiments et à ceux des adresses, qui reconnaissent donc exactement
+# ce qu'ils reconnaissent quand ils sont utilisés séparément (un path
+# rempli de la couleur des bâtiments peut aussi être un caractère):
+PDF_PARSE_RECOGNIZERS = ((StandardPathRecognizer,), tuple(ADDRESS_PDF_PARSE_RECOGNIZERS))
+PDF_PARSE_LABELS = BUILDING_PDF_PARSE_LABELS + ADDRESS_PDF_PARSE_LABELS
+# Couches générées, dans l'ordre des fichiers écrits par pdf_2_osm_layers.py
+# (les trois premières sont celles de pdf_2_osm_houses.py):
+LAYERS = ["houses", "water", "city-limit", "housenumbers", "mots"]
+
+
+def pdf_2_osm_layers(code_commune, pdfs, workers=1):
+    """Analyse une seule fois les pdfs (avec workers processus si
+       workers > 1) et retourne le dictionnaire couche -> Osm de toutes
+       les couches de LAYERS.
+       Le résultat de l'analyse utilisé par les adresses est enregistré
+       pour la commune (voir address.save_pdf_parse_results()), et son
+       rapport écrit dans CODE_COMMUNE-houses-recognition.json (voir
+       parser.write_parse_report())."""
+    print_flush("Parse les exports PDF du cadastre:")
+    results = {}
+    for filename, result in iter_parse_pdfs(pdfs, PDF_PARSE_RECOGNIZERS, workers, labels=PDF_PARSE_LABELS):
+        results[filename] = result
+    save_pdf_parse_results(code_commune, results)
+    write_parse_report(code_commune + "-houses-recognition.json", results)
+    result = merge_pdfs_parse_results(list(results.values()))
+    transform = CadastreToOSMTransform(result["projection"]).transform_point
+    return {
+        "houses": buildings_to_osm(result.get("buildings", []), result.get("light_buildings", []), transform),
+        "water": water_to_osm(result.get("waters", []), result.get("riverbanks", []), transform),
+        "city-limit": limit_to_osm(result.get("limit", []), transform),
+        "housenumbers": generate_osm_housenumbers(result.get("housenumbers", []), transform),
+        "mots": generate_osm_names(result.get("lieuxdits", []), result.get("street_names", []),
+            result.get("small_names", []), transform),
+    }
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Manifeste des étapes d'un traitement, pour permettre une régénération
+incrémentale: pour chaque étape on enregistre l'empreinte de ses fichiers
+d'entrée, la version du programme et l'empreinte de ses fichiers de sortie.
+Lors d'une nouvelle exécution, une étape dont les entrées et la version
+n'ont pas changé et dont les sorties sont toujours présentes peut être
+sautée.
+"""
+
+import re
+import os
+import json
+import hashlib
+
+from .tools import get_git_describe
+
+
+# Les PDF du cadastre contiennent des dates de création et un identifiant
+# qui changent à chaque téléchargement, on les ignore pour calculer
+# l'empreinte de leur contenu:
+PDF_VOLATILE_ENTRIES_RE = re.compile(b"/(CreationDate|ModDate)\\s*\\([^)]*\\)|/ID\\s*\\[[^\\]]*\\]")
+
+
+def get_version():
+    try:
+        return get_git_describe()
+    except:
+        return None
+
+
+def file_hash(filename):
+    """Retourne l'empreinte du contenu d'un fichier."""
+    with open(filename, "rb") as f:
+        data = f.read()
+    if filename.endswith(".pdf"):
+        data = PDF_VOLATILE_ENTRIES_RE.sub(b"", data)
+    return hashlib.sha1(data).hexdigest()
+
+
+class RunManifest(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.version = get_version()
+        self.stages = self.__load()
+
+    def __load(self):
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    return json.load(f).get("stages", {})
+            except ValueError:
+                pass
+        return {}
+
+    def is_up_to_date(self, stage, inputs, outputs, params=None):
+        """Indique si l'étape a déjà été exécutée avec les mêmes entrées,
+           la même version et les mêmes paramètres, et si ses sorties
+           sont toujours là."""
+        entry = self.stages.get(stage)
+        if (entry is None) or (self.version is None) \
+                or (entry.get("version") != self.version) \
+                or (entry.get("params") != params) \
+                or (sorted(entry.get("outputs", {}).keys()) != sorted(map(os.path.basename, outputs))):
+            return False
+        try:
+            return entry.get("inputs") == self.__hashes(inputs) and \
+                    entry.get("outputs") == self.__hashes(outputs)
+        except (IOError, OSError):
+            return False
+
+    def get_input_hashes(self, stage, params=None):
+        """Retourne les empreintes des entrées (par nom de fichier) de la
+           dernière exécution de l'étape, si elle a été faite avec la même
+           version et les mêmes paramètres, sinon un dictionnaire vide.
+           Permet de ne refaire qu'une partie d'une étape."""
+        entry = self.stages.get(stage)
+        if (entry is None) or (self.version is None) \
+                or (entry.get("version") != self.version) \
+                or (entry.get("params") != params):
+            return {}
+        return entry.get("inputs", {})
+
+    def record(self, stage, inputs, outputs, params=None):
+        """Enregistre l'exécution de l'étape."""
+        # Relit le manifeste, qui peut être partagé avec un autre traitement
+        # de la même commune (bâtiments et adresses):
+        self.stages = self.__load()
+        self.stages[stage] = {
+            "version": self.version,
+            "params": params,
+            "inputs": self.__hashes(inputs),
+            "outputs": self.__hashes(outputs),
+        }
+        self.save()
+
+    def save(self):
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump({"stages": self.stages}, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self.filename)
+
+    @staticmethod
+    def __hashes(filenames):
+        return {os.path.basename(filename): file_hash(filename) for filename in filenames}
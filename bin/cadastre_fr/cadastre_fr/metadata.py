@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Base locale (SQLite) des métadonnées du site du cadastre: liste des
+départements, liste des communes de chaque département, projection et
+bbox de chaque commune.
+
+CadastreWebsite la consulte avant d'interroger le site, ce qui permet aux
+commandes qui n'ont besoin que de ces informations (cadastre_center.py
+par exemple) de ne faire aucune requête. Elle est remise à jour par
+cadastre_liste.py.
+
+La base est activée en définissant la variable d'environnement
+CADASTRE_METADATA_DB.
+"""
+
+import os
+import time
+import sqlite3
+import contextlib
+
+
+METADATA_DB = os.environ.get("CADASTRE_METADATA_DB")
+# Age maximal des informations de la base (elle est normalement remise à
+# jour tous les mois par maj-dep-massif.sh):
+METADATA_MAX_AGE_SECONDS = 45 * 24 * 3600
+
+
+class MetadataStore(object):
+    def __init__(self, filename, max_age=METADATA_MAX_AGE_SECONDS):
+        self.filename = filename
+        self.max_age = max_age
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self.__connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS departements (
+                code TEXT PRIMARY KEY,
+                nom TEXT,
+                updated REAL)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS communes (
+                departement TEXT,
+                code TEXT,
+                nom TEXT,
+                updated REAL,
+                projection TEXT,
+                xmin REAL,
+                ymin REAL,
+                xmax REAL,
+                ymax REAL,
+                bbox_updated REAL,
+                PRIMARY KEY (departement, code))""")
+
+    @contextlib.contextmanager
+    def __connect(self):
+        db = sqlite3.connect(self.filename, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def __min_time(self):
+        return time.time() - self.max_age
+
+    def get_departements(self):
+        """retourne le dictionnaire code -> nom des départements, vide
+           s'il n'est pas connu"""
+        with self.__connect() as db:
+            return dict(db.execute("SELECT code, nom FROM departements WHERE updated >= ?",
+                (self.__min_time(),)).fetchall())
+
+    def set_departements(self, departements):
+        now = time.time()
+        with self.__connect() as db:
+            db.execute("DELETE FROM departements")
+            db.executemany("INSERT INTO departements VALUES (?,?,?)",
+                [(code, nom, now) for code, nom in departements.items()])
+
+    def get_communes(self, code_departement):
+        """retourne le dictionnaire code -> nom des communes du département,
+           vide s'il n'est pas connu"""
+        with self.__connect() as db:
+            return dict(db.execute("SELECT code, nom FROM communes WHERE departement=? AND updated >= ?",
+                (code_departement, self.__min_time())).fetchall())
+
+    def set_communes(self, code_departement, communes):
+        """enregistre la liste des communes du département, en gardant la
+           projection et la bbox déjà connues des communes inchangées"""
+        now = time.time()
+        with self.__connect() as db:
+            db.execute("DELETE FROM communes WHERE departement=? AND code NOT IN (%s)" % ",".join("?" * len(communes)),
+                [code_departement] + list(communes.keys()))
+            for code, nom in communes.items():
+                db.execute("UPDATE communes SET nom=?, updated=? WHERE departement=? AND code=?",
+                    (nom, now, code_departement, code))
+                db.execute("INSERT OR IGNORE INTO communes(departement, code, nom, updated) VALUES (?,?,?,?)",
+                    (code_departement, code, nom, now))
+
+    def get_commune_projection_and_bbox(self, code_departement, code_commune):
+        """retourne (projection, bbox) de la commune, ou None si elle n'est
+           pas connue"""
+        with self.__connect() as db:
+            row = db.execute("SELECT projection, xmin, ymin, xmax, ymax FROM communes WHERE departement=? AND code=? AND bbox_updated >= ?",
+                (code_departement, code_commune, self.__min_time())).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row[0], tuple(row[1:])
+
+    def set_commune_projection_and_bbox(self, code_departement, code_commune, projection, bbox):
+        with self.__connect() as db:
+            db.execute("UPDATE communes SET projection=?, xmin=?, ymin=?, xmax=?, ymax=?, bbox_updated=? WHERE departement=? AND code=?",
+                (projection,) + tuple(bbox) + (time.time(), code_departement, code_commune))
+
+
+def get_default_metadata_store():
+    """Retourne la base définie par la variable d'environnement
+       CADASTRE_METADATA_DB, ou None si elle n'est pas activée."""
+    if METADATA_DB:
+        return MetadataStore(METADATA_DB)
+    else:
+        return None
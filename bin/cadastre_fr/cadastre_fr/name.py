@@ -22,7 +22,8 @@ from .osm_tools  import osm_add_point
 from .osm_tools  import osm_add_way_direction
 from .tools      import command_line_error
 from .tools      import iteritems
-from .parser     import CadastreParser
+from .parser     import parse_pdf_with_recognizers
+from .parser     import merge_pdfs_parse_results
 from .transform  import CadastreToOSMTransform
 from .recognizer import TextPathRecognizer
 from .recognizer import NamePathRecognizer
@@ -31,11 +32,10 @@ from .globals    import SOURCE_TAG
 
 
 def pdf_2_names(pdf_filename_list):
-    names_recognizer = NamePathRecognizer()
-    cadastre_parser = CadastreParser([names_recognizer.handle_path])
-    for pdf_filename in pdf_filename_list:
-        cadastre_parser.parse(pdf_filename)
-    return cadastre_parser.cadastre_projection, names_recognizer.lieuxdits, names_recognizer.street_names, names_recognizer.small_names
+    result = merge_pdfs_parse_results([
+        parse_pdf_with_recognizers([NamePathRecognizer], pdf_filename)
+        for pdf_filename in pdf_filename_list])
+    return result["projection"], result.get("lieuxdits", []), result.get("street_names", []), result.get("small_names", [])
 
 def pdf_2_osm_names(pdf_filename_list, osm_output):
     projection, lieuxdits_names, street_names, small_names = pdf_2_names(pdf_filename_list)
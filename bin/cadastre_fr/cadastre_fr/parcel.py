@@ -29,7 +29,8 @@ from .osm         import Osm, Node, Way, OsmWriter
 from .osm_tools   import osm_add_polygon
 from .transform   import CadastreToOSMTransform
 from .recognizer  import ParcelPathRecognizer
-from .parser      import CadastreParser
+from .parser      import parse_pdf_with_recognizers
+from .parser      import merge_pdfs_parse_results
 from .tools       import print_flush
 from .tools       import download_cached
 from .tools       import named_chunks
@@ -93,13 +94,12 @@ def polygons_and_index_from_parcels_limits(parcels_limits):
 
 
 def pdf_2_parcels_limits(pdf_filename_list):
-    parcel_path_recognizer = ParcelPathRecognizer()
-    cadastre_parser = CadastreParser([parcel_path_recognizer.handle_path])
-    for pdf_filename in pdf_filename_list:
-        cadastre_parser.parse(pdf_filename)
-    parcels = parcel_path_recognizer.parcels
+    result = merge_pdfs_parse_results([
+        parse_pdf_with_recognizers([ParcelPathRecognizer], pdf_filename)
+        for pdf_filename in pdf_filename_list])
+    parcels = result.get("parcels", [])
     print_flush(str(len(parcels)) +  " limites de parcelles")
-    return cadastre_parser.cadastre_projection, parcels
+    return result["projection"], parcels
 
 
 def pdf_2_osm_parcels_limits(pdf_filename_list, osm_output):
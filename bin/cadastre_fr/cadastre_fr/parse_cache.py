@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache disque partagé des résultats de l'analyse des PDF du cadastre.
+
+Le résultat de parse_pdf_with_recognizers() pour un PDF est enregistré
+sous une clé calculée à partir de l'empreinte du contenu du PDF et de
+son fichier .bbox, et de la version des recognizers utilisés (voir
+PathRecognizer.version et PathRecognizer.reference_files). Un même PDF
+analysé à nouveau, pour une autre commande ou après un nouveau
+téléchargement identique, n'a ainsi plus besoin de pdfparser ni des
+recognizers.
+
+Les résultats sont enregistrés dans un format binaire compact
+(coordonnées en tableaux de doubles, compressés avec zlib). Comme pour
+le cache des PDF (voir tile_cache.py), un manifeste (base SQLite) liste
+les résultats présents, ceux qui sont trop vieux sont ignorés puis
+supprimés, et les moins récemment utilisés sont supprimés lorsque la
+taille totale du cache dépasse la limite.
+
+Le cache est activé en définissant la variable d'environnement
+CADASTRE_PARSE_CACHE_DIR.
+"""
+
+import os
+import sys
+import zlib
+import time
+import pickle
+import struct
+import sqlite3
+import hashlib
+import contextlib
+from array import array
+
+from .geometry   import Point
+from .manifest   import file_hash
+from .tile_cache import count_insertion
+from .tile_cache import temporary_filename
+
+
+PARSE_CACHE_DIR = os.environ.get("CADASTRE_PARSE_CACHE_DIR")
+# Taille maximale totale des résultats du cache:
+PARSE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Age maximal des résultats du cache (même valeur que pour les PDF):
+PARSE_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600
+# Lors d'une éviction par taille, on descend sous cette fraction du maximum:
+PARSE_CACHE_EVICTION_RATIO = 0.9
+# Nombre d'ajouts au cache entre deux évictions (même principe que pour les PDF):
+PARSE_CACHE_EVICTION_INTERVAL = 100
+# Format des fichiers de résultats, à changer si l'encodage change:
+PARSE_CACHE_MAGIC = b"CPRC0001"
+PARSE_CACHE_COUNT = struct.Struct("<I")
+
+# Types des résultats encodés:
+# chaîne de caractères (la projection):
+KIND_STRING = b"S"
+# liste de listes de rings (résultats des LinesPathRecognizer):
+KIND_RINGS = b"R"
+# liste de tuples (texte, position, angle) (résultats des recognizers de textes):
+KIND_TEXTS = b"T"
+# autre type, enregistré avec pickle:
+KIND_PICKLE = b"P"
+
+
+class ParseResultCache(object):
+    def __init__(self, directory, max_bytes=PARSE_CACHE_MAX_BYTES, max_age=PARSE_CACHE_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.manifest_filename = os.path.join(directory, "manifest.sqlite")
+        with self.__connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                recognizers TEXT,
+                size INTEGER,
+                created REAL,
+                last_access REAL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results(last_access)")
+
+    @staticmethod
+    def key(pdf_filename, recognizer_classes):
+        """Retourne la clé du résultat de l'analyse du pdf par des
+           recognizers des classes données."""
+        bbox_filename = os.path.splitext(pdf_filename)[0] + ".bbox"
+        description = "%s|%s|%s" % (file_hash(pdf_filename), file_hash(bbox_filename),
+            recognizers_version(recognizer_classes))
+        return hashlib.sha1(description.encode("utf8")).hexdigest()
+
+    @contextlib.contextmanager
+    def __connect(self):
+        # Une connexion par opération, car le cache est utilisé par
+        # plusieurs threads et plusieurs processus à la fois:
+        db = sqlite3.connect(self.manifest_filename, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def __result_filename(self, key):
+        return os.path.join(self.directory, key[:2], key + ".bin")
+
+    def get(self, key):
+        """Retourne le résultat de clé key s'il est présent dans le cache
+           et pas trop vieux, sinon None."""
+        now = time.time()
+        with self.__connect() as db:
+            row = db.execute("SELECT created FROM results WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            result_filename = self.__result_filename(key)
+            if (row[0] < now - self.max_age) or not os.path.exists(result_filename):
+                self.__remove(db, key)
+                return None
+            db.execute("UPDATE results SET last_access=? WHERE key=?", (now, key))
+        try:
+            with open(result_filename, "rb") as f:
+                return decode_parse_result(f.read())
+        except Exception:
+            # Fichier corrompu ou d'un ancien format, il sera remplacé:
+            return None
+
+    def put(self, key, result, recognizers=""):
+        """Ajoute le résultat au cache avec la clé key."""
+        result_filename = self.__result_filename(key)
+        result_dir = os.path.dirname(result_filename)
+        if not os.path.exists(result_dir):
+            os.makedirs(result_dir, exist_ok=True)
+        tmp_filename = temporary_filename(result_filename)
+        try:
+            with open(tmp_filename, "wb") as f:
+                f.write(encode_parse_result(result))
+            os.replace(tmp_filename, result_filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+        now = time.time()
+        with self.__connect() as db:
+            db.execute("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?)", (
+                key, recognizers, os.path.getsize(result_filename), now, now))
+        if count_insertion(self.directory, PARSE_CACHE_EVICTION_INTERVAL):
+            self.evict()
+
+    def evict(self):
+        """Supprime les résultats trop vieux, puis les moins récemment
+           utilisés si la taille totale dépasse la limite."""
+        with self.__connect() as db:
+            for (key,) in db.execute("SELECT key FROM results WHERE created < ?",
+                    (time.time() - self.max_age,)).fetchall():
+                self.__remove(db, key)
+            total = db.execute("SELECT COALESCE(SUM(size),0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                target = self.max_bytes * PARSE_CACHE_EVICTION_RATIO
+                for key, size in db.execute("SELECT key, size FROM results ORDER BY last_access").fetchall():
+                    if total <= target:
+                        break
+                    self.__remove(db, key)
+                    total -= size
+
+    def __remove(self, db, key):
+        db.execute("DELETE FROM results WHERE key=?", (key,))
+        result_filename = self.__result_filename(key)
+        if os.path.exists(result_filename):
+            os.remove(result_filename)
+
+    def get_stats(self):
+        with self.__connect() as db:
+            count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM results").fetchone()
+        return {"results": count, "bytes": total, "max_bytes": self.max_bytes, "max_age": self.max_age}
+
+
+# Empreinte des fichiers de référence des recognizers, par nom de fichier:
+_reference_files_hashes = {}
+
+def recognizers_version(recognizer_classes):
+    """Retourne une chaîne qui change dès que la version d'une des classes
+       de recognizers ou un de leurs fichiers de référence change, ou que
+       leur répartition en groupes (voir parser.get_recognizer_groups())
+       change."""
+    if all(isinstance(c, tuple) for c in recognizer_classes):
+        return "|".join(recognizers_version(group) for group in recognizer_classes)
+    versions = []
+    for recognizer_class in recognizer_classes:
+        version = "%s.%s:%s" % (recognizer_class.__module__, recognizer_class.__name__,
+            getattr(recognizer_class, "version", 0))
+        for filename in getattr(recognizer_class, "reference_files", []):
+            if not filename in _reference_files_hashes:
+                _reference_files_hashes[filename] = file_hash(filename)
+            version = version + ":" + _reference_files_hashes[filename]
+        versions.append(version)
+    return ",".join(versions)
+
+
+def array_to_bytes(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def array_from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def write_blob(output, data):
+    output.append(PARSE_CACHE_COUNT.pack(len(data)))
+    output.append(data)
+
+def read_blob(data, offset):
+    length = PARSE_CACHE_COUNT.unpack_from(data, offset)[0]
+    offset = offset + PARSE_CACHE_COUNT.size
+    return data[offset:offset+length], offset+length
+
+
+def is_text_list(values):
+    return all(isinstance(value, tuple) and len(value) == 3
+               and isinstance(value[0], str) and isinstance(value[1], Point)
+               for value in values)
+
+def is_rings_list(values):
+    return all(isinstance(rings, list) and all(
+                   isinstance(ring, list) and all(isinstance(point, Point) for point in ring)
+                   for ring in rings)
+               for rings in values)
+
+def encode_value(output, value):
+    if isinstance(value, str):
+        output.append(KIND_STRING)
+        write_blob(output, value.encode("utf8"))
+    elif isinstance(value, list) and is_text_list(value):
+        output.append(KIND_TEXTS)
+        write_blob(output, "\0".join([text for text, position, angle in value]).encode("utf8"))
+        numbers = array("d")
+        for text, position, angle in value:
+            numbers.extend((position.x, position.y, angle))
+        write_blob(output, array_to_bytes(numbers))
+    elif isinstance(value, list) and is_rings_list(value):
+        output.append(KIND_RINGS)
+        rings_counts = array("I", [len(rings) for rings in value])
+        points_counts = array("I", [len(ring) for rings in value for ring in rings])
+        coordinates = array("d")
+        for rings in value:
+            for ring in rings:
+                for point in ring:
+                    coordinates.append(point.x)
+                    coordinates.append(point.y)
+        write_blob(output, array_to_bytes(rings_counts))
+        write_blob(output, array_to_bytes(points_counts))
+        write_blob(output, array_to_bytes(coordinates))
+    else:
+        output.append(KIND_PICKLE)
+        write_blob(output, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+def decode_value(data, offset):
+    kind = data[offset:offset+1]
+    offset = offset + 1
+    if kind == KIND_STRING:
+        blob, offset = read_blob(data, offset)
+        return blob.decode("utf8"), offset
+    elif kind == KIND_TEXTS:
+        blob, offset = read_blob(data, offset)
+        texts = blob.decode("utf8").split("\0")
+        blob, offset = read_blob(data, offset)
+        numbers = array_from_bytes("d", blob)
+        if len(numbers) == 0:
+            return [], offset
+        return [(text, Point(numbers[i*3], numbers[i*3+1]), numbers[i*3+2])
+                for i, text in enumerate(texts)], offset
+    elif kind == KIND_RINGS:
+        blob, offset = read_blob(data, offset)
+        rings_counts = array_from_bytes("I", blob)
+        blob, offset = read_blob(data, offset)
+        points_counts = iter(array_from_bytes("I", blob))
+        blob, offset = read_blob(data, offset)
+        coordinates = array_from_bytes("d", blob)
+        value = []
+        i = 0
+        for rings_count in rings_counts:
+            rings = []
+            for r in range(rings_count):
+                end = i + 2 * next(points_counts)
+                rings.append([Point(coordinates[j], coordinates[j+1]) for j in range(i, end, 2)])
+                i = end
+            value.append(rings)
+        return value, offset
+    elif kind == KIND_PICKLE:
+        blob, offset = read_blob(data, offset)
+        return pickle.loads(blob), offset
+    else:
+        raise Exception("type de résultat inconnu: " + repr(kind))
+
+def encode_parse_result(result):
+    """Encode le dictionnaire retourné par parse_pdf_with_recognizers()."""
+    output = [PARSE_CACHE_COUNT.pack(len(result))]
+    for name, value in sorted(result.items()):
+        write_blob(output, name.encode("utf8"))
+        encode_value(output, value)
+    return PARSE_CACHE_MAGIC + zlib.compress(b"".join(output))
+
+def decode_parse_result(data):
+    if not data.startswith(PARSE_CACHE_MAGIC):
+        raise Exception("format de résultat inconnu")
+    data = zlib.decompress(data[len(PARSE_CACHE_MAGIC):])
+    count = PARSE_CACHE_COUNT.unpack_from(data, 0)[0]
+    offset = PARSE_CACHE_COUNT.size
+    result = {}
+    for i in range(count):
+        name, offset = read_blob(data, offset)
+        result[name.decode("utf8")], offset = decode_value(data, offset)
+    return result
+
+
+def get_default_parse_cache():
+    """Retourne le cache défini par la variable d'environnement
+       CADASTRE_PARSE_CACHE_DIR, ou None s'il n'est pas activé."""
+    if PARSE_CACHE_DIR:
+        return ParseResultCache(PARSE_CACHE_DIR)
+    else:
+        return None
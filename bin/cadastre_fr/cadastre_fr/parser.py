@@ -15,16 +15,54 @@
 
 """Parser for PDF files from the cadastre."""
 
+import os
 import sys
+import json
+import time
+import queue
+import atexit
+import struct
 import os.path
+import threading
+import traceback
 import subprocess
+import multiprocessing
+import xml.parsers.expat
+from array import array
 
 from .geometry  import Path
+from .geometry  import PointArray
 from .geometry  import BoundingBox
 from .transform import PDFToCadastreTransform
+from .recognizer import PathRecognizer
+from .recognizer import path_signature
+from .parse_cache import get_default_parse_cache
+from .tools     import print_flush
 
 THIS_DIR = os.path.dirname(__file__)
 PDFPARSER = os.path.join(THIS_DIR, "..", "pdfparser", "pdfparser")
+# Format de la sortie binaire de pdfparser (option -b), voir pdfparser.cpp:
+PDFPARSER_BINARY_MAGIC = b"PDFPB001"
+PDFPARSER_RECORD_HEADER = struct.Struct("<cI")
+PDFPARSER_STYLE_HEADER = struct.Struct("<I")
+PDFPARSER_PATH_HEADER = struct.Struct("<II")
+PDFPARSER_END_RECORD = struct.Struct("<IIII")
+# Règle du filtre de pdfparser acceptant le rectangle blanc qui donne la
+# bbox du pdf, voir CadastreParser.handle_path():
+PDF_BBOX_PATH_FILTER = "@=MLLLLZ fill:#ffffff"
+# Nombre de processus qui analysent les PDF:
+PDF_PARSE_WORKERS = min(4, multiprocessing.cpu_count())
+# Nombre maximal de PDF téléchargés en attente d'analyse:
+PDF_PARSE_MAX_PENDING = 16
+# Nom du résultat de parse_pdf_with_recognizers() qui contient la liste
+# des statistiques de l'analyse (une par pdf une fois les résultats
+# fusionnés), voir write_parse_report():
+PARSE_STATS_NAME = "parse_stats"
+# Nombre de pdfs les plus longs à analyser listés dans le rapport:
+PARSE_REPORT_SLOWEST = 10
+# Nombre d'entrées de la table de dispatch les plus utilisées listées dans
+# le rapport:
+PARSE_REPORT_DISPATCH_ENTRIES = 20
 
 
 if not os.path.exists(PDFPARSER):
@@ -33,6 +71,275 @@ if not os.path.exists(PDFPARSER):
   sys.stderr.write("    make\n".encode("utf-8"))
   sys.exit(-1)
 
+# Passe à False si le programme pdfparser n'a pas été recompilé
+# et ne supporte pas encore l'option -b:
+pdfparser_binary_supported = True
+# Passe à False si le programme pdfparser ne supporte pas encore le mode
+# serveur (option -s):
+pdfparser_server_supported = True
+
+
+class PdfParserError(Exception):
+    """Échec de l'analyse d'un fichier pdf par pdfparser: erreur signalée
+       par pdfparser, sortie tronquée ou processus arrêté."""
+    pass
+
+
+def read_pdfparser_record(stream):
+    """Lit un enregistrement de la sortie binaire de pdfparser.
+       Retourne le tuple (type, données), ou None à la fin du flux."""
+    header = stream.read(PDFPARSER_RECORD_HEADER.size)
+    if not header:
+        return None
+    if len(header) != PDFPARSER_RECORD_HEADER.size:
+        raise PdfParserError("sortie de pdfparser tronquée")
+    record_type, length = PDFPARSER_RECORD_HEADER.unpack(header)
+    data = stream.read(length)
+    if len(data) != length:
+        raise PdfParserError("sortie de pdfparser tronquée")
+    return record_type, data
+
+
+def decode_pdfparser_path(data, styles):
+    """Construit le Path d'un enregistrement de type 'P'."""
+    style_id, nb_commands = PDFPARSER_PATH_HEADER.unpack_from(data)
+    start = PDFPARSER_PATH_HEADER.size
+    commands = data[start:start + nb_commands].decode("ascii")
+    coords = array("d")
+    coords.frombytes(memoryview(data)[start + nb_commands:])
+    if sys.byteorder != "little":
+        coords.byteswap()
+    return Path(commands, PointArray(coords), styles[style_id])
+
+
+def decode_pdfparser_style(data, styles):
+    """Enregistre le style défini par un enregistrement de type 'S'."""
+    style_id, = PDFPARSER_STYLE_HEADER.unpack_from(data)
+    styles[style_id] = sys.intern(data[PDFPARSER_STYLE_HEADER.size:].decode("utf8"))
+
+
+def decode_pdfparser_end(data, stats):
+    """Enregistre dans le dictionnaire stats le nombre de paths filtrés
+       par pdfparser, donné par un enregistrement de type 'E', et retourne
+       l'indicateur de succès de l'analyse du fichier."""
+    if len(data) < PDFPARSER_END_RECORD.size:
+        raise PdfParserError("enregistrement de fin de fichier de pdfparser invalide")
+    file_id, ok, kept, dropped = PDFPARSER_END_RECORD.unpack_from(data)
+    if stats is not None:
+        stats["dropped"] = dropped
+    return ok == 1
+
+
+def read_pdfparser_binary_paths(stream, stats=None):
+    """Générateur des Path lus depuis la sortie binaire de pdfparser,
+       sans passer par le format texte SVG.
+       Lève PdfParserError si la sortie se termine sans enregistrement de
+       fin de fichier, ou si celui-ci indique un échec de l'analyse."""
+    styles = {}
+    while True:
+        record = read_pdfparser_record(stream)
+        if record is None:
+            raise PdfParserError("sortie de pdfparser tronquée (pas de fin de fichier)")
+        record_type, data = record
+        if record_type == b"P":
+            yield decode_pdfparser_path(data, styles)
+        elif record_type == b"S":
+            decode_pdfparser_style(data, styles)
+        elif record_type == b"E":
+            if not decode_pdfparser_end(data, stats):
+                raise PdfParserError("pdfparser n'a pas pu analyser le fichier")
+            return
+        # Les autres types d'enregistrement sont ignorés.
+
+
+def read_pdfparser_text_paths(stream):
+    """Générateur des Path lus depuis la sortie texte de pdfparser."""
+    while True:
+        line = stream.readline().decode("utf8")
+        if not line:
+            break
+        path = Path.from_svg(line.rstrip())
+        path.style = sys.intern(stream.readline().decode("utf8").rstrip())
+        yield path
+
+
+class PdfParserServer(object):
+    """Programme pdfparser lancé en mode serveur (option -s), qui traite
+       successivement plusieurs fichiers pdf, ce qui évite de relancer un
+       processus (et d'initialiser Qt) pour chaque fichier."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.process = subprocess.Popen([PDFPARSER, "-s"],
+                bufsize=128*1024, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.styles = {}
+        self.next_file_id = 0
+        self.path_filter = None
+        self.supported = (self.process.stdout.read(len(PDFPARSER_BINARY_MAGIC))
+                == PDFPARSER_BINARY_MAGIC)
+        if not self.supported:
+            self.close()
+
+    def is_alive(self):
+        return self.process is not None
+
+    def iter_paths(self, filename, path_filter=None, stats=None):
+        """Générateur des Path du fichier pdf acceptés par le filtre
+           path_filter (voir pdfparser.cpp).
+           Lève PdfParserError si le serveur s'arrête (il sera relancé pour
+           le fichier suivant) ou s'il signale une erreur d'analyse du
+           fichier (il reste alors utilisable)."""
+        file_id = self.next_file_id
+        self.next_file_id = self.next_file_id + 1
+        file_stats = {}
+        try:
+            if path_filter != self.path_filter:
+                self.process.stdin.write((("-f" if path_filter is None else ("-f " + path_filter)) + "\n").encode("utf8"))
+                self.path_filter = path_filter
+            self.process.stdin.write((os.path.abspath(filename) + "\n").encode("utf8"))
+            self.process.stdin.flush()
+            record = read_pdfparser_record(self.process.stdout)
+            if (record is None) or (record[0] != b"F") or (PDFPARSER_STYLE_HEADER.unpack_from(record[1])[0] != file_id):
+                raise Exception("réponse invalide du serveur pdfparser pour " + filename)
+            while True:
+                path = self.__read_next_path(file_stats)
+                if path is None:
+                    break
+                yield path
+        except GeneratorExit:
+            # Lecture abandonnée, on passe le reste du fichier:
+            try:
+                while self.__read_next_path(file_stats) is not None:
+                    pass
+            except:
+                self.close()
+            raise
+        except:
+            self.close()
+            raise
+        finally:
+            if stats is not None:
+                stats.update(file_stats)
+        if not file_stats.get("ok"):
+            raise PdfParserError("pdfparser n'a pas pu analyser le fichier " + filename)
+
+    def __read_next_path(self, stats):
+        """Lit les enregistrements jusqu'au prochain path, et le retourne,
+           ou jusqu'à la fin du fichier (retourne None)."""
+        while True:
+            record = read_pdfparser_record(self.process.stdout)
+            if record is None:
+                raise PdfParserError("le serveur pdfparser s'est arrêté")
+            record_type, data = record
+            if record_type == b"P":
+                return decode_pdfparser_path(data, self.styles)
+            elif record_type == b"S":
+                decode_pdfparser_style(data, self.styles)
+            elif record_type == b"E":
+                ok = decode_pdfparser_end(data, stats)
+                if (stats is not None) and ok:
+                    stats["ok"] = True
+                return None
+
+    def close(self):
+        if self.process is not None:
+            process = self.process
+            self.process = None
+            process.stdin.close()
+            process.stdout.close()
+            process.wait()
+
+
+# Serveur pdfparser de chaque thread (et de chaque processus, les objets
+# hérités lors d'un fork n'étant pas réutilisés):
+_pdfparser_servers = threading.local()
+_pdfparser_servers_to_close = []
+_pdfparser_servers_lock = threading.Lock()
+
+
+def get_pdfparser_server():
+    """Retourne le serveur pdfparser du thread courant, en le lançant si
+       nécessaire, ou None si le mode serveur n'est pas supporté."""
+    global pdfparser_server_supported
+    server = getattr(_pdfparser_servers, "server", None)
+    if (server is None) or (server.pid != os.getpid()) or not server.is_alive():
+        server = PdfParserServer()
+        if not server.supported:
+            pdfparser_server_supported = False
+            return None
+        _pdfparser_servers.server = server
+        with _pdfparser_servers_lock:
+            _pdfparser_servers_to_close.append(server)
+    return server
+
+
+@atexit.register
+def close_pdfparser_servers():
+    with _pdfparser_servers_lock:
+        for server in _pdfparser_servers_to_close:
+            if server.pid == os.getpid():
+                server.close()
+        del _pdfparser_servers_to_close[:]
+
+
+def iter_pdfparser_paths(filename, path_filter=None, stats=None, use_server=True):
+    """Générateur des Path du fichier pdf, extraits par le programme
+       pdfparser.
+       Si path_filter est donné, pdfparser ne retourne que les paths
+       acceptés par ce filtre (voir pdfparser.cpp), et le nombre de paths
+       filtrés est mis dans stats["dropped"].
+       stats["ok"] n'est mis à True qu'une fois tout le fichier lu, si
+       pdfparser a indiqué la fin de son analyse sans erreur (et s'est
+       terminé normalement, pour un processus lancé pour ce fichier), sinon
+       PdfParserError est levée.
+       Avec use_server=False, le fichier est analysé par un processus
+       pdfparser lancé pour lui seul, et non par le serveur pdfparser."""
+    server = get_pdfparser_server() if (use_server and pdfparser_server_supported) else None
+    if server is not None:
+        return server.iter_paths(filename, path_filter, stats)
+    else:
+        return iter_pdfparser_process_paths(filename, path_filter, stats)
+
+
+def iter_pdfparser_process_paths(filename, path_filter=None, stats=None):
+    """Générateur des Path du fichier pdf, extraits par un processus
+       pdfparser lancé pour ce seul fichier."""
+    global pdfparser_binary_supported
+    if pdfparser_binary_supported:
+        options = ["-b"] if path_filter is None else ["-b", "-f", path_filter]
+        process = subprocess.Popen([PDFPARSER] + options + [filename],
+                bufsize=128*1024, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            magic = process.stdout.read(len(PDFPARSER_BINARY_MAGIC))
+            if magic == PDFPARSER_BINARY_MAGIC:
+                for path in read_pdfparser_binary_paths(process.stdout, stats):
+                    yield path
+                check_pdfparser_process(process, filename, stats)
+                return
+        finally:
+            process.stdout.close()
+            process.wait()
+        pdfparser_binary_supported = False
+        sys.stderr.write("ATTENTION: le programme pdfparser ne supporte pas le format binaire,\n")
+        sys.stderr.write("           veuillez le recompiler avec la commande make\n")
+    process = subprocess.Popen([PDFPARSER, filename],
+            bufsize=128*1024, stdout=subprocess.PIPE)
+    try:
+        for path in read_pdfparser_text_paths(process.stdout):
+            yield path
+        check_pdfparser_process(process, filename, stats)
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def check_pdfparser_process(process, filename, stats):
+    """Vérifie que le processus pdfparser qui a analysé filename s'est
+       terminé normalement, et met alors stats["ok"] à True."""
+    if process.wait() != 0:
+        raise PdfParserError("pdfparser s'est terminé avec le code %d pour %s" % (process.returncode, filename))
+    if stats is not None:
+        stats["ok"] = True
 
 
 class CadastreParser(object):
@@ -41,33 +348,128 @@ class CadastreParser(object):
         Les path qui nous intéressent sont tous dans le même groupe <g>,
         donc on ignore completement les transformations de
         coordonées (pdf transform).
+        Les paths qu'aucun handler ne peut reconnaître sont filtrés dès
+        pdfparser (voir get_path_filter()), après chaque parse() les
+        attributs kept_paths et dropped_paths donnent le nombre de paths
+        transmis aux handlers et le nombre de paths filtrés.
+        Chaque path n'est transmis qu'aux handlers qui peuvent le
+        reconnaître d'après son style et la signature de ses commandes
+        (voir PathRecognizer.accepts()), donnés par une table de dispatch
+        calculée une seule fois pour chaque couple (style, signature).
+        Pour chaque handler sont comptés pendant parse() le nombre de
+        paths transmis, le nombre de paths reconnus et le temps passé
+        (voir get_handler_stats()).
+        Les handlers peuvent être répartis en groupes indépendants
+        (path_handler_groups): chaque path est transmis à chaque groupe,
+        jusqu'au premier handler du groupe qui le reconnaît, comme s'il
+        était analysé séparément par chacun des groupes.
     """
-    def __init__(self, path_handlers = None):
-        self.path_handlers = path_handlers if path_handlers else []
+    def __init__(self, path_handlers = None, path_handler_groups = None):
+        if path_handler_groups:
+            self.path_handler_groups = [list(group) for group in path_handler_groups]
+            self.path_handlers = [h for group in self.path_handler_groups for h in group]
+        else:
+            self.path_handlers = path_handlers if path_handlers else []
+            self.path_handler_groups = [self.path_handlers]
+        self.kept_paths = 0
+        self.dropped_paths = 0
+        # Table de dispatch: (style, signature) -> [handlers de chaque groupe,
+        # nombre de paths de la dernière analyse]
+        self.dispatch_table = {}
+        # handler -> [appels, paths reconnus, temps en secondes]
+        self.handler_stats = {}
     def add_path_handler(self, path_handler):
-        self.path_handlers.append(handler)
-    def parse(self, filename):
+        if not self.path_handler_groups[-1] is self.path_handlers:
+            self.path_handler_groups[-1].append(path_handler)
+        self.path_handlers.append(path_handler)
+        self.dispatch_table = {}
+    def get_dispatch_handlers(self, style, signature):
+        """Retourne pour chaque groupe la liste de ses handlers qui peuvent
+           reconnaître un path de ce style et de cette signature (les
+           groupes sans aucun de ces handlers étant omis)."""
+        groups = []
+        for group in self.path_handler_groups:
+            handlers = []
+            for path_handler in group:
+                recognizer = getattr(path_handler, "__self__", None)
+                if not (isinstance(recognizer, PathRecognizer) and path_handler.__name__ == "handle_path") \
+                        or recognizer.accepts(style, signature):
+                    handlers.append(path_handler)
+            if handlers:
+                groups.append(handlers)
+        return groups
+    def get_dispatch_stats(self):
+        """Retourne pour chaque entrée de la table de dispatch utilisée par
+           la dernière analyse le tuple (nombre de paths, style, signature,
+           noms des handlers), par nombre de paths décroissant."""
+        stats = []
+        for (style, signature), (groups, hits) in self.dispatch_table.items():
+            if hits == 0:
+                continue
+            names = [get_handler_name(h) for handlers in groups for h in handlers]
+            stats.append((hits, style, signature, names))
+        stats.sort(key=lambda entry: -entry[0])
+        return stats
+    def get_handler_stats(self):
+        """Retourne le dictionnaire nom du handler (nom de la classe pour
+           un recognizer) -> statistiques de la dernière analyse: nombre
+           d'appels (calls), de paths reconnus (accepted) et temps passé
+           (time)."""
+        stats = {}
+        for path_handler, (calls, accepted, elapsed) in self.handler_stats.items():
+            name = get_handler_name(path_handler)
+            entry = stats.setdefault(name, {"calls": 0, "accepted": 0, "time": 0.0})
+            entry["calls"] += calls
+            entry["accepted"] += accepted
+            entry["time"] += elapsed
+        return stats
+    def get_path_filter(self):
+        """Retourne le filtre de pdfparser correspondant à l'union de ce
+           que les handlers peuvent reconnaître, ou None si un des handlers
+           n'est pas la méthode handle_path d'un PathRecognizer qui fournit
+           un filtre."""
+        rules = [PDF_BBOX_PATH_FILTER]
+        for path_handler in self.path_handlers:
+            recognizer = getattr(path_handler, "__self__", None)
+            if not (isinstance(recognizer, PathRecognizer) and path_handler.__name__ == "handle_path"):
+                return None
+            recognizer_rules = recognizer.get_path_filter()
+            if recognizer_rules is None:
+                return None
+            for rule in recognizer_rules:
+                if not rule in rules:
+                    rules.append(rule)
+        return "|".join(rules)
+    def parse(self, filename, use_server=True):
         bbox_filename = os.path.splitext(filename)[0]  + ".bbox"
         self.cadastre_projection, cadastre_bbox = open(bbox_filename).read().split(":")
         self.cadastre_bbox = BoundingBox(*[float(v) for v in cadastre_bbox.split(",")])
         self.pdf_bbox = None
+        self.kept_paths = 0
+        self.dropped_paths = 0
+        self.handler_stats = {}
+        # La table de dispatch est gardée d'un fichier à l'autre, seuls ses
+        # compteurs sont remis à zéro:
+        for entry in self.dispatch_table.values():
+            entry[1] = 0
+        # Passe à True si tout le fichier a été analysé sans erreur:
+        self.parse_ok = False
 
         ext = os.path.splitext(filename)[1]
 
         if ext == ".svg":
             parser = xml.parsers.expat.ParserCreate()
             parser.StartElementHandler = self.handle_start_element
-            parser.ParseFile(open(filename))
+            with open(filename, "rb") as f:
+                parser.ParseFile(f)
+            self.parse_ok = True
         elif ext == ".pdf":
-            pipe = subprocess.Popen([PDFPARSER, filename],
-                    bufsize=128*1024, stdout=subprocess.PIPE).stdout
-            while True:
-                line = pipe.readline().decode("utf8")
-                if not line:
-                    break
-                path = Path.from_svg(line.rstrip())
-                path.style = pipe.readline().decode("utf8").rstrip()
+            stats = {}
+            for path in iter_pdfparser_paths(filename, self.get_path_filter(), stats, use_server):
+                self.kept_paths = self.kept_paths + 1
                 self.handle_path(path)
+            self.dropped_paths = stats.get("dropped", 0)
+            self.parse_ok = stats.get("ok", False)
         else:
             raise Exception("not a pdf or svg filename: " + filename)
 
@@ -88,9 +490,285 @@ class CadastreParser(object):
                 self.pdf_to_cadastre_transform = PDFToCadastreTransform(self.pdf_bbox, self.cadastre_bbox).transform_point
                 #sys.stdout.write("pdf bbox:" + str(self.bbox) + "\n")
         else:
-            for path_handler in self.path_handlers:
-                if path_handler(path, self.pdf_to_cadastre_transform):
-                    break
+            key = (path.style, path_signature(path.commands))
+            entry = self.dispatch_table.get(key)
+            if entry is None:
+                entry = [self.get_dispatch_handlers(*key), 0]
+                self.dispatch_table[key] = entry
+            entry[1] = entry[1] + 1
+            for handlers in entry[0]:
+                for path_handler in handlers:
+                    stats = self.handler_stats.get(path_handler)
+                    if stats is None:
+                        stats = self.handler_stats[path_handler] = [0, 0, 0.0]
+                    start = time.perf_counter()
+                    accepted = path_handler(path, self.pdf_to_cadastre_transform)
+                    stats[0] += 1
+                    stats[2] += time.perf_counter() - start
+                    if accepted:
+                        stats[1] += 1
+                        break
+
+
+def get_handler_name(path_handler):
+    return type(path_handler.__self__).__name__ if hasattr(path_handler, "__self__") else path_handler.__name__
+
+
+def get_recognizer_groups(recognizer_classes):
+    """Retourne la liste des groupes (tuples de classes) de recognizers:
+       recognizer_classes est soit un tuple de classes (un seul groupe),
+       soit un tuple de groupes indépendants (voir CadastreParser)."""
+    if all(isinstance(c, tuple) for c in recognizer_classes):
+        return list(recognizer_classes)
+    return [tuple(recognizer_classes)]
+
+def flatten_recognizer_classes(recognizer_classes):
+    """Retourne la liste des classes de recognizers de tous les groupes."""
+    return [c for group in get_recognizer_groups(recognizer_classes) for c in group]
 
+# Parser et recognizers de chaque processus (et thread) d'analyse des pdf,
+# par tuple de classes de recognizers: le chargement des bases de
+# caractères étant long, ils ne sont créés qu'une seule fois:
+_pdf_parse_workers_state = threading.local()
 
+def init_pdf_parse_worker(recognizer_classes):
+    groups = [[recognizer_class() for recognizer_class in group]
+        for group in get_recognizer_groups(recognizer_classes)]
+    recognizers = [recognizer for group in groups for recognizer in group]
+    cadastre_parser = CadastreParser(path_handler_groups=[
+        [recognizer.handle_path for recognizer in group] for group in groups])
+    if not hasattr(_pdf_parse_workers_state, "parsers"):
+        _pdf_parse_workers_state.parsers = {}
+    _pdf_parse_workers_state.parsers[recognizer_classes] = cadastre_parser, recognizers
 
+def parse_pdf_with_recognizers(recognizer_classes, filename):
+    """Analyse le pdf avec des recognizers des classes données (ou des
+       groupes de classes, voir get_recognizer_groups()), et retourne
+       le dictionnaire de leurs résultats (voir PathRecognizer.get_results()),
+       avec en plus la projection du pdf, et les statistiques de l'analyse
+       (liste d'un seul élément) sous le nom PARSE_STATS_NAME.
+       Le résultat est lu dans le cache des résultats d'analyse s'il y est
+       déjà (voir parse_cache.py)."""
+    recognizer_classes = tuple(recognizer_classes)
+    parse_cache = get_default_parse_cache()
+    if parse_cache is not None:
+        key = parse_cache.key(filename, recognizer_classes)
+        result = parse_cache.get(key)
+        if result is not None:
+            result[PARSE_STATS_NAME] = [{"pdf": os.path.basename(filename), "source": "parse_cache", "ok": True}]
+            return result
+    if not recognizer_classes in getattr(_pdf_parse_workers_state, "parsers", {}):
+        init_pdf_parse_worker(recognizer_classes)
+    cadastre_parser, recognizers = _pdf_parse_workers_state.parsers[recognizer_classes]
+    counters = []
+    for recognizer in recognizers:
+        recognizer.reset_results()
+        counters.append(recognizer.get_counters())
+    start = time.perf_counter()
+    try:
+        cadastre_parser.parse(filename)
+    except PdfParserError as ex:
+        # Que le serveur pdfparser se soit arrêté ou qu'il ait signalé une
+        # erreur, le pdf est analysé à nouveau par un processus pdfparser
+        # lancé pour lui seul; si cela échoue aussi l'exception est
+        # transmise, le résultat partiel n'étant jamais utilisé:
+        print_flush("ATTENTION: %s: %s, nouvelle analyse par un processus pdfparser dédié" % (filename, ex))
+        for recognizer in recognizers:
+            recognizer.reset_results()
+        try:
+            cadastre_parser.parse(filename, use_server=False)
+        except PdfParserError as ex:
+            raise PdfParserError("%s: %s" % (filename, ex))
+    elapsed = time.perf_counter() - start
+    result = {"projection": cadastre_parser.cadastre_projection}
+    for recognizer in recognizers:
+        result.update(recognizer.get_results())
+    if not cadastre_parser.parse_ok:
+        raise PdfParserError("%s: analyse incomplète" % filename)
+    # Seul le résultat d'une analyse complète est mis en cache:
+    if parse_cache is not None:
+        parse_cache.put(key, result, ",".join([c.__name__ for c in flatten_recognizer_classes(recognizer_classes)]))
+    handler_stats = cadastre_parser.get_handler_stats()
+    recognizers_stats = {}
+    for recognizer, previous_counters in zip(recognizers, counters):
+        name = type(recognizer).__name__
+        stats = handler_stats.get(name, {"calls": 0, "accepted": 0, "time": 0.0})
+        stats["results"] = recognizer.get_results_count()
+        stats["partial"] = recognizer.get_partial_count()
+        # Les compteurs des recognizers sont cumulés depuis leur création:
+        stats["counters"] = dict((counter, value - previous_counters.get(counter, 0))
+            for counter, value in recognizer.get_counters().items())
+        recognizers_stats[name] = stats
+    result[PARSE_STATS_NAME] = [{
+        "pdf": os.path.basename(filename),
+        "source": "parse",
+        "ok": cadastre_parser.parse_ok,
+        "time": elapsed,
+        "kept_paths": cadastre_parser.kept_paths,
+        "dropped_paths": cadastre_parser.dropped_paths,
+        "recognizers": recognizers_stats,
+        "dispatch": [[hits, style, list(signature), names]
+            for hits, style, signature, names in cadastre_parser.get_dispatch_stats()],
+    }]
+    return result
+
+def merge_pdfs_parse_results(results):
+    """Fusionne les résultats de parse_pdf_with_recognizers() de plusieurs
+       pdfs, dans leur ordre."""
+    merged = {"projection": None}
+    for result in results:
+        for name, values in result.items():
+            if name == "projection":
+                merged[name] = values
+            else:
+                merged.setdefault(name, []).extend(values)
+    return merged
+
+def write_parse_report(filename, results):
+    """Écrit dans filename le rapport JSON de l'analyse des pdfs, à partir
+       du dictionnaire pdf -> résultat de parse_pdf_with_recognizers():
+       les statistiques de chaque pdf (source "parse" s'il a été analysé,
+       "parse_cache" s'il a été lu dans le cache des résultats d'analyse et
+       "previous_run" si le résultat d'une exécution précédente a été
+       réutilisé), leurs totaux par recognizer, les entrées de la table de
+       dispatch (voir CadastreParser.get_dispatch_stats()) qui ont reçu
+       le plus de paths, et les pdfs les plus longs à analyser."""
+    tiles = []
+    for pdf in sorted(results):
+        records = results[pdf].get(PARSE_STATS_NAME)
+        tiles.extend(records if records else [{"pdf": os.path.basename(pdf), "source": "previous_run"}])
+    recognizers = {}
+    for tile in tiles:
+        for name, stats in tile.get("recognizers", {}).items():
+            total = recognizers.setdefault(name, {"tiles": 0, "calls": 0, "accepted": 0, "time": 0.0,
+                "results": 0, "partial": 0, "counters": {}})
+            total["tiles"] += 1
+            for key in ["calls", "accepted", "time", "results", "partial"]:
+                total[key] += stats[key]
+            for counter, value in stats["counters"].items():
+                total["counters"][counter] = total["counters"].get(counter, 0) + value
+    for total in recognizers.values():
+        total["time_per_call"] = total["time"] / total["calls"] if total["calls"] else 0.0
+        total["partial_ratio"] = float(total["partial"]) / total["results"] if total["results"] else 0.0
+        counters = total["counters"]
+        if "memo_hits" in counters:
+            memo_total = counters["memo_hits"] + counters["memo_misses"]
+            counters["memo_hit_rate"] = float(counters["memo_hits"]) / memo_total if memo_total else 0.0
+    dispatch = {}
+    for tile in tiles:
+        for hits, style, signature, names in tile.get("dispatch", []):
+            key = (style, tuple(signature))
+            if key in dispatch:
+                dispatch[key][0] += hits
+            else:
+                dispatch[key] = [hits, style, signature, names]
+    parsed = [tile for tile in tiles if tile["source"] == "parse"]
+    report = {
+        "tiles": tiles,
+        "parse_time": sum(tile["time"] for tile in parsed),
+        "recognizers": recognizers,
+        "dispatch": sorted(dispatch.values(), key=lambda entry: -entry[0])[:PARSE_REPORT_DISPATCH_ENTRIES],
+        "slowest_tiles": [tile["pdf"] for tile in
+            sorted(parsed, key=lambda tile: -tile["time"])[:PARSE_REPORT_SLOWEST]],
+    }
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+
+def iter_parse_pdfs(pdfs, recognizer_classes, workers=1, cached_result=None, labels=None):
+    """Analyse les pdfs avec parse_pdf_with_recognizers() et génère pour
+       chacun un tuple (filename, résultat).
+       pdfs peut être un générateur qui les télécharge: avec workers > 1,
+       le téléchargement se fait dans un thread pendant que workers
+       processus analysent les pdfs déjà téléchargés, chacun avec ses
+       propres recognizers.
+       Les résultats sont générés dans l'ordre des pdfs, quel que soit le
+       nombre de workers, le résultat d'un pdf pour lequel
+       cached_result(filename) ne retourne pas None n'étant pas recalculé.
+       labels est la liste des couples (nom du résultat, libellé) affichés
+       pour chaque pdf.
+       Si l'analyse d'un pdf échoue ou si le générateur est fermé avant la
+       fin, le téléchargement est arrêté et pdfs est fermé.
+    """
+    recognizer_classes = tuple(recognizer_classes)
+    def print_result(filename, result, suffix=""):
+        if labels:
+            print_flush(filename + ": " + ", ".join([str(len(result[name])) + " " + label for name, label in labels]) + suffix)
+    def get_cached_result(filename):
+        return cached_result(filename) if cached_result else None
+    if workers <= 1:
+        for filename in pdfs:
+            result = get_cached_result(filename)
+            if result is not None:
+                print_result(filename, result, " (inchangé)")
+            else:
+                result = parse_pdf_with_recognizers(recognizer_classes, filename)
+                print_result(filename, result)
+            yield filename, result
+        return
+    downloaded = queue.Queue()
+    # Limite le nombre de pdf téléchargés et pas encore analysés:
+    slots = threading.Semaphore(PDF_PARSE_MAX_PENDING)
+    # Demande l'arrêt du téléchargement quand les résultats ne sont plus
+    # attendus:
+    stop = threading.Event()
+    def download():
+        try:
+            for filename in pdfs:
+                slots.acquire()
+                if stop.is_set():
+                    break
+                downloaded.put(filename)
+        except BaseException as ex:
+            traceback.print_exc()
+            downloaded.put(ex)
+        finally:
+            if hasattr(pdfs, "close"):
+                pdfs.close()
+            downloaded.put(None)
+    # Les processus d'analyse sont créés avant de démarrer le thread de
+    # téléchargement:
+    pool = multiprocessing.Pool(workers, initializer=init_pdf_parse_worker, initargs=(recognizer_classes,))
+    download_thread = threading.Thread(target=download, name="pdf-download")
+    download_thread.daemon = True
+    download_thread.start()
+    try:
+        pending = []
+        def release_slot(ignored):
+            slots.release()
+        def get_pending_result(filename, async_result, result):
+            if async_result is None:
+                print_result(filename, result, " (inchangé)")
+            else:
+                result = async_result.get()
+                print_result(filename, result)
+            return filename, result
+        while True:
+            filename = downloaded.get()
+            if filename is None:
+                break
+            elif isinstance(filename, BaseException):
+                raise filename
+            # Les résultats sont générés dans l'ordre des pdfs, y compris
+            # ceux qui sont réutilisés:
+            result = get_cached_result(filename)
+            if result is not None:
+                slots.release()
+                pending.append((filename, None, result))
+            else:
+                pending.append((filename, pool.apply_async(
+                    parse_pdf_with_recognizers, (recognizer_classes, filename),
+                    callback=release_slot, error_callback=release_slot), None))
+            while pending and (pending[0][1] is None or pending[0][1].ready()):
+                yield get_pending_result(*pending.pop(0))
+        for entry in pending:
+            yield get_pending_result(*entry)
+        pool.close()
+    finally:
+        # Débloque le thread de téléchargement s'il attend une place:
+        stop.set()
+        for i in range(PDF_PARSE_MAX_PENDING):
+            slots.release()
+        download_thread.join()
+        pool.terminate()
+        pool.join()
@@ -22,21 +22,53 @@ Reconnaisseur de Path extrait des PDF du cadastre, pour pouvoir identifier:
 """
 
 import re
+import os
 import sys
 import math
+import pickle
+import hashlib
 import os.path
+import collections
+import numpy as np
 import xml.etree.ElementTree as ET
 
 from .geometry import Path
+from .geometry import PointArray
 from .tools    import print_flush
 from .tools    import toposort
 from .tools    import iteritems, itervalues, iterkeys
+from .manifest import file_hash
+from .tile_cache import temporary_filename
 
 
 TEXT_PATH_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "text_path_recognizer")
 REFERENCE_STREET_NAME = os.path.join(TEXT_PATH_DATA_DIR , "reference-noms_de_rue.svg")
 REFERENCE_LIEUXDITS = os.path.join(TEXT_PATH_DATA_DIR , "reference-noms_de_lieux-dits.svg")
 REFERENCE_HOUSENUMBERS = os.path.join(TEXT_PATH_DATA_DIR , "reference-housenumbers.svg")
+# Répertoire des bases de caractères compilées par TextPathRecognizer.load_from_svg():
+TEXT_PATH_CACHE_DIR = os.path.join(os.path.dirname(TEXT_PATH_DATA_DIR), "text_path_recognizer_cache")
+# Version du format des bases compilées, à changer si le format ou la
+# façon de compiler change:
+TEXT_PATH_CACHE_VERSION = 1
+# Index des points dont la distance au premier point sert de signature
+# aux paths de la database de TextPathRecognizer (voir glyph_signature()):
+GLYPH_SIGNATURE_INDEXES = (1, 2, 3, 4, 6, 8, 11, 16, 23, 32)
+# Les points comparés par Path.startswith() sont écartés de moins de
+# tolerance en x et en y, leurs distances au premier point (une fois mis à
+# l'échelle) diffèrent donc de moins de tolerance * sqrt(2), on ajoute une
+# marge pour les erreurs d'arrondi:
+GLYPH_SIGNATURE_TOLERANCE_FACTOR = math.sqrt(2)
+GLYPH_SIGNATURE_MARGIN = 1e-9
+# Nombre de paths dont TextPathRecognizer garde le résultat de la
+# reconnaissance, pour ne pas reconnaître à nouveau les mêmes mots et
+# numéros répétés sur une même commune:
+TEXT_PATH_MEMO_SIZE = 10000
+# Précision (dans les unités du PDF) des coordonnées des points utilisées
+# pour identifier les paths identiques: assez grossière pour que les
+# arrondis des coordonnées d'un même mot placé ailleurs donnent souvent le
+# même identifiant, mais petite devant l'écart toléré pour reconnaître un
+# caractère (au moins 0.17 pour les plus petits):
+TEXT_PATH_FINGERPRINT_PRECISION = 0.02
 
 
 # distance max en mètres pour considérer qu'un polygon est fermé:
@@ -44,67 +76,147 @@ TOLERANFCE_FERMETURE_POLYGON_METRES = 0.5
 
 
 class PathRecognizer(object):
+    # Noms des attributs (des listes) où sont enregistrés les résultats:
+    result_names = []
+    # Version des résultats, à incrémenter lorsque ce que reconnait la classe
+    # change, pour invalider le cache des résultats (voir parse_cache.py):
+    version = 1
+    # Fichiers de référence utilisés, dont le contenu fait aussi partie de
+    # la version:
+    reference_files = []
     def handle_path(self, path, transform):
         return False
+    def reset_results(self):
+        """Vide les résultats, pour analyser un nouveau pdf."""
+        for name in self.result_names:
+            setattr(self, name, [])
+    def get_results(self):
+        """Retourne le dictionnaire nom -> liste des résultats."""
+        return dict((name, getattr(self, name)) for name in self.result_names)
+    def get_results_count(self):
+        return sum(len(getattr(self, name)) for name in self.result_names)
+    def get_partial_count(self):
+        """Retourne le nombre de résultats qui sont des textes reconnus
+           seulement en partie (contenant "???")."""
+        count = 0
+        for name in self.result_names:
+            for result in getattr(self, name):
+                if isinstance(result, tuple) and result and isinstance(result[0], str) and "???" in result[0]:
+                    count = count + 1
+        return count
+    def get_counters(self):
+        """Retourne le dictionnaire des compteurs propres à la classe
+           (cumulés depuis sa création), pour le rapport d'analyse des pdf
+           (voir parser.write_parse_report())."""
+        return {}
+    def get_path_filter(self):
+        """Retourne la liste des règles du filtre de pdfparser (voir
+           pdfparser.cpp) acceptant au moins tous les paths que handle_path()
+           peut reconnaître, ou None s'ils ne peuvent pas être filtrés."""
+        return None
+    def accepts(self, style, signature):
+        """Indique si handle_path() peut reconnaître un path de ce style et
+           de cette signature (voir path_signature()). Le résultat ne doit
+           dépendre que de ces deux valeurs, CadastreParser ne l'évalue
+           qu'une fois pour chaque couple."""
+        return True
+
+
+class StyleTest(object):
+    """Test du style d'un path (donné sous forme de dictionnaire):
+       equals donne la valeur attendue de certaines propriétés, ranges
+       donne pour certaines propriétés numériques la liste des intervalles
+       (ouverts) de valeurs acceptés.
+    """
+    def __init__(self, equals={}, ranges={}):
+        self.equals = equals
+        self.ranges = ranges
+    def __call__(self, style):
+        for key, value in iteritems(self.equals):
+            if style.get(key) != value:
+                return False
+        for key, intervals in iteritems(self.ranges):
+            if not key in style:
+                return False
+            value = float(style[key])
+            if not any((value > vmin) and (value < vmax) for vmin, vmax in intervals):
+                return False
+        return True
+    def get_path_filter_conditions(self):
+        """Retourne les conditions correspondantes du filtre de pdfparser."""
+        conditions = [key + ":" + value for key, value in sorted(iteritems(self.equals))]
+        for key, intervals in sorted(iteritems(self.ranges)):
+            conditions.append(key + "~" + ",".join(
+                "%r..%r" % (vmin, vmax) for vmin, vmax in intervals))
+        return conditions
+
 
 class LinesPathRecognizer(PathRecognizer):
     commands_re = re.compile("^(MLLLL*Z)+$")
     def __init__(self, name_closed_styletest_list):
         self.name_closed_styletest_list = name_closed_styletest_list
-        for name, foo, bar in name_closed_styletest_list:
-            setattr(self, name, [])
+        self.result_names = [name for name, closed, styletest in name_closed_styletest_list]
+        # Eléments de name_closed_styletest_list dont le test accepte
+        # chaque style déjà rencontré:
+        self.style_matches = {}
+        self.reset_results()
+    def get_style_matches(self, style):
+        """Retourne la liste des (name, closed) dont le test accepte le
+           style, calculée une seule fois par style."""
+        matches = self.style_matches.get(style)
+        if matches is None:
+            matches = []
+            if style:
+                style_dict = dict([v.split(':') for v in style.split(';')])
+                for name, closed, styletest in self.name_closed_styletest_list:
+                    if styletest(style_dict):
+                        matches.append((name, closed))
+            self.style_matches[style] = matches
+        return matches
+    def accepts(self, style, signature):
+        return signature[1] and len(self.get_style_matches(style)) > 0
     def handle_path(self, path, transform):
-        if LinesPathRecognizer.commands_re.match(path.commands) and path.style:
-            style = dict([v.split(':') for v in path.style.split(';')])
-            for name, closed, styletest in self.name_closed_styletest_list:
-                if styletest(style):
-                    points = list(map(transform, path.points))
-                    linear_rings = []
-                    for commands_ring in path.commands[:-1].split('Z'):
-                        first = points[0]
-                        last = points[len(commands_ring)-1]
-                        if closed and (first.distance(last) > TOLERANFCE_FERMETURE_POLYGON_METRES):
-                            # Ce n'est pas un polygone fermé mais une ligne brisée.
-                            break
-                        linear_rings.append(points[:len(commands_ring)])
-                        points = points[len(commands_ring):]
-                    if len(linear_rings) > 0:
-                        getattr(self, name).append(linear_rings)
-                        return True
+        if LinesPathRecognizer.commands_re.match(path.commands):
+            for name, closed in self.get_style_matches(path.style):
+                points = list(map(transform, path.points))
+                linear_rings = []
+                for commands_ring in path.commands[:-1].split('Z'):
+                    first = points[0]
+                    last = points[len(commands_ring)-1]
+                    if closed and (first.distance(last) > TOLERANFCE_FERMETURE_POLYGON_METRES):
+                        # Ce n'est pas un polygone fermé mais une ligne brisée.
+                        break
+                    linear_rings.append(points[:len(commands_ring)])
+                    points = points[len(commands_ring):]
+                if len(linear_rings) > 0:
+                    getattr(self, name).append(linear_rings)
+                    return True
         return False
+    def get_path_filter(self):
+        return [" ".join(["@lines"] + styletest.get_path_filter_conditions())
+            for name, closed, styletest in self.name_closed_styletest_list]
 
 
 PARCEL_LINE_PATH_RECOGNIZER = [
-        ['parcels', True, lambda style:
-            'stroke-width' in style and
-            (float(style["stroke-width"]) > 0.7) and
-            (float(style["stroke-width"]) < 0.8) and
-            (style.get('fill') == "none") and
-            (style.get('stroke') == "#000000") and
-            (style.get('stroke-opacity') == "1") and
-            (style.get('stroke-dasharray') == "none")
+        ['parcels', True, StyleTest(
+            equals={'fill': "none", 'stroke': "#000000", 'stroke-opacity': "1", 'stroke-dasharray': "none"},
+            ranges={'stroke-width': [(0.7, 0.8)]})
         ]
     ]
 BUILDING_LINE_PATH_RECOGNIZER = [
-        ['buildings',       True, lambda style: style.get('fill') == "#ffcc33"],
-        ['light_buildings', True, lambda style: style.get('fill') == "#ffe599"]
+        ['buildings',       True, StyleTest(equals={'fill': "#ffcc33"})],
+        ['light_buildings', True, StyleTest(equals={'fill': "#ffe599"})]
     ]
 
 WATER_LINE_PATH_RECOGNIZER = [
-        ['waters',     True, lambda style: style.get('fill') == "#98c3d9"],
-        ['riverbanks', True, lambda style: style.get('fill') == "#1979ac"]
+        ['waters',     True, StyleTest(equals={'fill': "#98c3d9"})],
+        ['riverbanks', True, StyleTest(equals={'fill': "#1979ac"})]
     ]
 
 LIMIT_LINE_PATH_RECOGNIZER = [
-        ['limit', False, lambda style:
-            (style.get('fill') == "none") and
-            (style.get('stroke') == "#ffffff") and
-            (style.get('stroke-opacity') == "1") and
-            (style.get('stroke-dasharray') == "none") and
-            'stroke-width' in style and
-            (((float(style["stroke-width"]) > 17.8) and (float(style["stroke-width"]) < 17.9))
-             or
-             ((float(style["stroke-width"]) > 8.4) and (float(style["stroke-width"]) < 8.6)))
+        ['limit', False, StyleTest(
+            equals={'fill': "none", 'stroke': "#ffffff", 'stroke-opacity': "1", 'stroke-dasharray': "none"},
+            ranges={'stroke-width': [(17.8, 17.9), (8.4, 8.6)]})
         ]
     ]
 
@@ -130,6 +242,8 @@ class StandardPathRecognizer(LinesPathRecognizer):
                 BUILDING_LINE_PATH_RECOGNIZER + LIMIT_LINE_PATH_RECOGNIZER + WATER_LINE_PATH_RECOGNIZER)
 
 class NamePathRecognizer(PathRecognizer):
+    result_names = ["lieuxdits", "street_names", "small_names"]
+    reference_files = [REFERENCE_STREET_NAME, REFERENCE_LIEUXDITS]
     def __init__(self):
         self.street_name_recognizer = TextPathRecognizer(tolerance=0.05, min_scale=0.9, max_scale=1.1)
         self.street_name_recognizer.load_from_svg(REFERENCE_STREET_NAME)
@@ -157,12 +271,37 @@ class NamePathRecognizer(PathRecognizer):
                     if text.find("???") == -1:
                         return True
         return False
+    def accepts(self, style, signature):
+        return any(recognizer.accepts(style, signature) for recognizer in
+            [self.lieuxdits_recognizer, self.small_name_recognizer, self.street_name_recognizer])
+    def get_counters(self):
+        counters = {}
+        for recognizer in [self.lieuxdits_recognizer, self.small_name_recognizer, self.street_name_recognizer]:
+            for name, value in iteritems(recognizer.get_counters()):
+                counters[name] = counters.get(name, 0) + value
+        return counters
+    def get_path_filter(self):
+        rules = []
+        for recognizer in [self.lieuxdits_recognizer, self.small_name_recognizer, self.street_name_recognizer]:
+            for rule in recognizer.get_path_filter():
+                if not rule in rules:
+                    rules.append(rule)
+        return rules
 
 
 class TextPathRecognizer(PathRecognizer):
-    __slots__ = ('database', 'tolerance', 'min_scale', 'max_scale', 'styles', 'force_horizontal', 'angle_tolerance_deg', 'space_width')
-    def __init__(self, tolerance, min_scale, max_scale, styles=[], force_horizontal = False, angle_tolerance_deg = 5):
+    __slots__ = ('database', 'trie', 'memo', 'memo_size', 'stats', 'tolerance', 'min_scale', 'max_scale', 'styles', 'force_horizontal', 'angle_tolerance_deg', 'space_width')
+    def __init__(self, tolerance, min_scale, max_scale, styles=[], force_horizontal = False, angle_tolerance_deg = 5, memo_size=TEXT_PATH_MEMO_SIZE):
         self.database = {}
+        # Arbre des commandes des paths de la database, créé à la première
+        # utilisation par get_trie():
+        self.trie = None
+        # Résultats des derniers paths reconnus (du moins récemment utilisé
+        # au plus récent), voir recognize():
+        self.memo = collections.OrderedDict()
+        self.memo_size = memo_size
+        self.stats = {"glyphs": 0, "candidates": 0, "commands_pruned": 0, "hash_probes": 0, "hash_pruned": 0,
+            "signature_pruned": 0, "compared": 0, "memo_hits": 0, "memo_misses": 0}
         self.tolerance = tolerance
         self.min_scale = min_scale
         self.max_scale = max_scale
@@ -177,6 +316,110 @@ class TextPathRecognizer(PathRecognizer):
         if not idx in self.database:
             self.database[idx] = []
         self.database[idx].append((value, path, alternatives))
+        self.trie = None
+    def get_hash_cell_size(self):
+        # Avec des cellules de largeur 2 * tolerance, les valeurs à moins
+        # de tolerance d'une valeur sont dans au plus deux cellules:
+        return 2 * (self.tolerance + GLYPH_SIGNATURE_MARGIN)
+    def get_trie(self):
+        """Retourne l'arbre (dictionnaires imbriqués) des commandes des
+           paths de la database: le noeud atteint en suivant les commandes
+           d'un path contient à la clé "" la table de hachage géométrique
+           des éléments (rang, valeur, path, alternatives, signature) de
+           ce path, le rang étant sa position dans la liste de la database.
+           Cette table associe à l'index i du point le plus éloigné du
+           premier point du path le nombre d'éléments et le dictionnaire
+           cellule -> éléments, un
+           élément étant rangé dans toutes les cellules à moins de
+           tolerance de son descripteur glyph_descriptor(path, i): il
+           suffit alors de consulter la cellule du descripteur du path à
+           reconnaître. Les éléments sans descripteur sont rangés à
+           l'index None."""
+        if self.trie is None:
+            # La database peut être partagée avec un autre recognizer
+            # (voir NamePathRecognizer), on ne la modifie donc pas:
+            trie = {}
+            cell_size = self.get_hash_cell_size()
+            tolerance = self.tolerance + GLYPH_SIGNATURE_MARGIN
+            for elems in itervalues(self.database):
+                for rank, (value, path, alternatives) in enumerate(elems):
+                    node = trie
+                    for c in path.commands:
+                        node = node.setdefault(c, {})
+                    signature = glyph_signature(path)
+                    elem = (rank, value, path, alternatives, signature)
+                    i = signature[0]
+                    descriptor = glyph_descriptor(path, i)
+                    table = node.setdefault("", {})
+                    if descriptor is None:
+                        table.setdefault(None, []).append(elem)
+                    else:
+                        x, y = descriptor
+                        entry = table.setdefault(i, [0, {}])
+                        entry[0] += 1
+                        cells = entry[1]
+                        for cx in range(int(math.floor((x - tolerance) / cell_size)), int(math.floor((x + tolerance) / cell_size)) + 1):
+                            for cy in range(int(math.floor((y - tolerance) / cell_size)), int(math.floor((y + tolerance) / cell_size)) + 1):
+                                cells.setdefault((cx, cy), []).append(elem)
+            self.trie = trie
+        return self.trie
+    def get_candidates(self, path):
+        """Retourne dans l'ordre de la database les éléments dont les
+           commandes sont un début de celles du path, et dont le
+           descripteur est à moins de tolerance de celui du path, les
+           seuls pour lesquels Path.startswith() peut réussir.
+           Retourne aussi le nombre d'éléments écartés par le descripteur."""
+        cell_size = self.get_hash_cell_size()
+        candidates = []
+        hash_pruned = 0
+        node = self.get_trie()
+        for c in path.commands:
+            node = node.get(c)
+            if node is None:
+                break
+            table = node.get("")
+            if table is not None:
+                for i, entry in iteritems(table):
+                    if i is None:
+                        candidates.extend(entry)
+                        continue
+                    count, cells = entry
+                    descriptor = glyph_descriptor(path, i)
+                    elems = None
+                    if descriptor is not None:
+                        self.stats["hash_probes"] += 1
+                        elems = cells.get((int(math.floor(descriptor[0] / cell_size)), int(math.floor(descriptor[1] / cell_size))))
+                    if elems:
+                        candidates.extend(elems)
+                    hash_pruned += count - (len(elems) if elems else 0)
+        candidates.sort(key=lambda candidate: candidate[0])
+        return candidates, hash_pruned
+    def get_stats(self):
+        """Retourne les compteurs de recognize(): nombre de caractères
+           cherchés, de paths de la database qui auraient été comparés
+           sans l'arbre des commandes, la table de hachage géométrique et
+           les signatures, de ceux écartés par chacun d'eux (et du nombre
+           de cellules de la table consultées), et de ceux vraiment
+           comparés, ainsi que le nombre de paths dont le résultat a été
+           retrouvé dans le cache de recognize() ou non."""
+        stats = dict(self.stats)
+        memo_total = stats["memo_hits"] + stats["memo_misses"]
+        stats["memo_hit_rate"] = float(stats["memo_hits"]) / memo_total if memo_total else 0.0
+        stats["avoided"] = stats["candidates"] - stats["compared"]
+        stats["avoided_per_glyph"] = float(stats["avoided"]) / stats["glyphs"] if stats["glyphs"] else 0.0
+        return stats
+    def get_counters(self):
+        return dict(self.stats)
+    def get_path_filter(self):
+        # recognize() ne reconnaît rien si le début du path n'est pas un
+        # index de la database:
+        return [" ".join(["@glyph=" + ",".join(sorted(self.database))] + list(self.styles))]
+    def accepts(self, style, signature):
+        # Mêmes conditions que le début de recognize():
+        if not signature[0] in self.database:
+            return False
+        path_styles = (style or "").split(';')
+        return all(s in path_styles for s in self.styles)
     def save_to_svg(self, filename):
         f = open(filename,"w")
         f.write("""<?xml version="1.0"?>\n<svg
@@ -200,7 +443,13 @@ class TextPathRecognizer(PathRecognizer):
         f.close()
     def load_from_svg(self, filename):
         """Charge les paths de référence pour la reconnaissance depuis un fichier SVG.
-           La valeur associée à reconnaître est stockée dans le titre des paths."""
+           La valeur associée à reconnaître est stockée dans le titre des paths.
+           La base compilée (ordre des paths, alternatives et largeur des
+           espaces) est enregistrée dans TEXT_PATH_CACHE_DIR, pour ne pas
+           refaire à chaque lancement les comparaisons entre tous les paths."""
+        compiled_filename = self.get_compiled_filename(filename)
+        if self.load_compiled(compiled_filename):
+            return
         root = ET.parse(filename).getroot()
         elems = []
         #print_flush((u"#Charge les path: " + os.path.basename(filename) + "\n"))
@@ -259,21 +508,127 @@ class TextPathRecognizer(PathRecognizer):
                 elif j_startswith_i:
                     #print_flush(value_j + " commence par " + value_i + "\n")
                     deps[i].add(j)
-        for i in toposort(deps):
-            val, path = elems[i]
-            alters = [elems[j] for j in alternatives[i]]
-            self.add(val, path, alters)
+        order = list(toposort(deps))
+        alternatives = [list(alters) for alters in alternatives]
         # Calcule la distance d'un espace comme la moité de la largeur moyenne des caractères:
         # en considérant que les caractères sont horizontal (angle = 0)
         largeur_moyenne = sum([largeur_path(0, path) for value,path in elems]) / len(elems)
-        self.space_width = largeur_moyenne / 2
+        space_width = largeur_moyenne / 2
         #print "Largeur espaces = " + str(self.space_width)
+        self.set_compiled(elems, order, alternatives, space_width)
+        self.save_compiled(compiled_filename, elems, order, alternatives, space_width)
+
+    def set_compiled(self, elems, order, alternatives, space_width):
+        """Remplit la database avec les paths elems (liste de couples
+           (valeur, path)), dans l'ordre donné par la liste de leurs
+           index order, alternatives donnant pour chacun la liste des
+           index de ses alternatives."""
+        for i in order:
+            val, path = elems[i]
+            alters = [elems[j] for j in alternatives[i]]
+            self.add(val, path, alters)
+        self.space_width = space_width
+
+    def get_compiled_filename(self, filename):
+        """Retourne le fichier de la base compilée depuis le fichier SVG
+           avec les paramètres de ce recognizer."""
+        key = "%d|%s|%r|%r|%r|%r" % (TEXT_PATH_CACHE_VERSION, file_hash(filename),
+            self.tolerance, self.min_scale, self.max_scale, self.angle_tolerance_deg)
+        return os.path.join(TEXT_PATH_CACHE_DIR, os.path.splitext(os.path.basename(filename))[0]
+            + "-" + hashlib.sha1(key.encode("utf8")).hexdigest() + ".pickle")
+
+    def load_compiled(self, compiled_filename):
+        """Charge la base compilée si elle existe, retourne True dans ce cas."""
+        if not os.path.exists(compiled_filename):
+            return False
+        try:
+            with open(compiled_filename, "rb") as f:
+                compiled = pickle.load(f)
+            if compiled["version"] != TEXT_PATH_CACHE_VERSION:
+                return False
+            elems = [(value, Path(commands, PointArray(coords), d=d))
+                     for value, commands, coords, d in compiled["elems"]]
+        except Exception:
+            # Fichier corrompu ou d'un autre format, il sera recalculé:
+            return False
+        self.set_compiled(elems, compiled["order"], compiled["alternatives"], compiled["space_width"])
+        return True
+
+    def save_compiled(self, compiled_filename, elems, order, alternatives, space_width):
+        compiled = {
+            "version": TEXT_PATH_CACHE_VERSION,
+            "elems": [(value, path.commands, path.points.to_array(), path.d) for value, path in elems],
+            "order": order,
+            "alternatives": alternatives,
+            "space_width": space_width,
+        }
+        try:
+            if not os.path.exists(TEXT_PATH_CACHE_DIR):
+                os.makedirs(TEXT_PATH_CACHE_DIR, exist_ok=True)
+            tmp_filename = temporary_filename(compiled_filename)
+            try:
+                with open(tmp_filename, "wb") as f:
+                    pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+                # mkstemp() crée un fichier lisible seulement par son
+                # propriétaire, la base est partagée par tous les utilisateurs:
+                os.chmod(tmp_filename, 0o664)
+                os.replace(tmp_filename, compiled_filename)
+            finally:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+            # Supprime les bases compilées depuis une ancienne version du
+            # fichier SVG:
+            prefix = os.path.splitext(os.path.basename(compiled_filename))[0].rsplit("-", 1)[0] + "-"
+            for name in os.listdir(TEXT_PATH_CACHE_DIR):
+                if name.startswith(prefix) and name.endswith(".pickle") \
+                        and name != os.path.basename(compiled_filename):
+                    os.remove(os.path.join(TEXT_PATH_CACHE_DIR, name))
+        except (IOError, OSError):
+            # Le répertoire peut ne pas être accessible en écriture, la
+            # base sera alors recompilée à chaque fois:
+            pass
 
     def recognize(self, path):
+        """Retourne le tuple (texte, position, angle) reconnu dans le path,
+           ou None.
+           Le résultat est gardé dans un cache LRU, indexé par la forme du
+           path indépendamment de sa position (et de son angle sauf avec
+           force_horizontal): le même path à un autre endroit de la
+           commune est reconnu sans être analysé à nouveau, son angle étant
+           celui du path trouvé dans le cache, décalé de la différence
+           d'orientation des deux paths."""
         if self.styles:
             path_styles = path.style.split(';')
             for s in self.styles:
                 if not s in path_styles: return None
+        if self.memo_size <= 0:
+            return self.recognize_path(path)
+        key, path_angle = text_path_fingerprint(path, rotate=not self.force_horizontal)
+        memo = self.memo
+        if key in memo:
+            self.stats["memo_hits"] += 1
+            memo.move_to_end(key)
+            found = memo[key]
+            if found is None:
+                return None
+            text, angle, memo_path_angle = found
+            if path_angle != memo_path_angle:
+                angle = normalize_angle(angle + path_angle - memo_path_angle)
+            return text, path.bbox().center(), angle
+        self.stats["memo_misses"] += 1
+        found = self.recognize_path(path)
+        if found is None:
+            memo[key] = None
+        else:
+            text, position, angle = found
+            memo[key] = text, angle, path_angle
+        if len(memo) > self.memo_size:
+            memo.popitem(last=False)
+        return found
+
+    def recognize_path(self, path):
+        """Reconnaît le texte du path, sans utiliser le cache de recognize()
+           ni tester son style."""
         original_path = path
         result = ""
         if self.force_horizontal:
@@ -281,11 +636,43 @@ class TextPathRecognizer(PathRecognizer):
         else:
             original_angle = None
         previous_position = None
+        stats = self.stats
+        signature_tolerance = self.tolerance * GLYPH_SIGNATURE_TOLERANCE_FACTOR + GLYPH_SIGNATURE_MARGIN
         while len(path.points):
             found = False
             idx = path.commands[:path.commands.find('Z')]
             if idx in self.database:
-                for value, compare_path, alternatives in self.database[idx]:
+                stats["glyphs"] += 1
+                stats["candidates"] += len(self.database[idx])
+                candidates, hash_pruned = self.get_candidates(path)
+                stats["hash_pruned"] += hash_pruned
+                stats["commands_pruned"] += len(self.database[idx]) - len(candidates) - hash_pruned
+                # Distances des points du path à son premier point:
+                distances = {}
+                for rank, value, compare_path, alternatives, signature in candidates:
+                    i, compare_distance, compare_ratios = signature
+                    if compare_ratios is not None:
+                        # Tests de Path.startswith() qui ne dépendent ni
+                        # de l'angle ni de l'échelle, faits sans calculer
+                        # les points normalisés:
+                        if i not in distances:
+                            distances[i] = path.p0_distance(i)
+                        distance = distances[i]
+                        scale_factor = distance / compare_distance
+                        if scale_factor < self.min_scale or scale_factor > self.max_scale:
+                            stats["signature_pruned"] += 1
+                            continue
+                        pruned = False
+                        for k, ratio in compare_ratios:
+                            if k not in distances:
+                                distances[k] = path.p0_distance(k)
+                            if abs(distances[k] / distance - ratio) > signature_tolerance:
+                                pruned = True
+                                break
+                        if pruned:
+                            stats["signature_pruned"] += 1
+                            continue
+                    stats["compared"] += 1
                     startswith = path.startswith(compare_path, tolerance=self.tolerance, min_scale=self.min_scale, max_scale=self.max_scale)
                     if startswith:
                         angle = startswith
@@ -356,6 +743,8 @@ class TextPathRecognizer(PathRecognizer):
             return None
 
 class HousenumberPathRecognizer(TextPathRecognizer):
+    result_names = ["housenumbers"]
+    reference_files = [REFERENCE_HOUSENUMBERS]
     def __init__(self):
         TextPathRecognizer.__init__(self, tolerance=0.05, min_scale=0.8, max_scale=1.2, styles=["fill:#000000"])
         self.load_from_svg(REFERENCE_HOUSENUMBERS)
@@ -370,13 +759,96 @@ class HousenumberPathRecognizer(TextPathRecognizer):
         return False
 
 
+def path_signature(commands):
+    """Retourne la signature des commandes d'un path utilisée par la table
+       de dispatch de CadastreParser: le début des commandes jusqu'au
+       premier Z (l'index de la database de TextPathRecognizer), et si le
+       path n'est fait que de polygones (voir LinesPathRecognizer)."""
+    return commands[:commands.find('Z')], LinesPathRecognizer.commands_re.match(commands) is not None
+
+
+def text_path_fingerprint(path, rotate=True):
+    """Retourne l'identifiant d'un path utilisé par le cache de
+       TextPathRecognizer.recognize(), et l'angle du path pris en compte
+       dans cet identifiant.
+       L'identifiant est formé des commandes du path et des coordonnées de
+       ses points relatives au premier, arrondies à
+       TEXT_PATH_FINGERPRINT_PRECISION, après une rotation qui amène le
+       point le plus éloigné du premier sur l'axe des x si rotate est
+       vrai (l'angle est alors celui de ce point, sinon il est nul)."""
+    points = path.points.to_numpy()
+    relative = points - points[0]
+    angle = 0.0
+    if rotate and len(relative) > 1:
+        squaredists = (relative * relative).sum(axis=1)
+        i = int(np.argmax(squaredists))
+        if squaredists[i] > 0:
+            angle = math.atan2(relative[i,1], relative[i,0])
+            cosa = math.cos(-angle)
+            sina = math.sin(-angle)
+            relative = np.column_stack((
+                cosa * relative[:,0] - sina * relative[:,1],
+                sina * relative[:,0] + cosa * relative[:,1]))
+    quantized = np.round(relative / TEXT_PATH_FINGERPRINT_PRECISION).astype(np.int64)
+    return (path.commands, quantized.tobytes()), angle
+
+
+def normalize_angle(angle):
+    """Ramène l'angle (en radians) dans l'intervalle ]-pi, pi]."""
+    while angle <= -math.pi:
+        angle += 2*math.pi
+    while angle > math.pi:
+        angle -= 2*math.pi
+    return angle
+
+
+def glyph_signature(path):
+    """Retourne la signature d'un path de la database de TextPathRecognizer,
+       indépendante de son angle: l'index i de son point le plus éloigné
+       du premier, cette distance, et la liste des couples (k, rapport)
+       des rapports entre la distance au premier point des points k de
+       GLYPH_SIGNATURE_INDEXES et celle du point i (None si elle est nulle)."""
+    i = path.get_p0_most_distant_point_index()
+    distance = path.p0_distance(i)
+    if distance == 0:
+        return i, distance, None
+    return i, distance, [(k, path.p0_distance(k) / distance)
+        for k in GLYPH_SIGNATURE_INDEXES if k < len(path.points)]
+
+
+def glyph_descriptor(path, i):
+    """Retourne le descripteur d'un path utilisé par la table de hachage
+       géométrique de TextPathRecognizer: les coordonnées de son second
+       point dans le repère dont l'origine est son premier point et dont
+       le point i est en (1, 0), comme le fait
+       Path.get_angle_and_points_for_path_recognition(i), c'est à dire
+       indépendamment de son angle et de son échelle. Retourne None si le
+       path n'a pas de second point ou si ses points 0 et i sont confondus."""
+    points = path.points
+    if len(points) < 2 or i >= len(points):
+        return None
+    coords = points.coords
+    j = 2 * points.start
+    x1 = coords[j]
+    y1 = coords[j+1]
+    dx = coords[j+2] - x1
+    dy = coords[j+3] - y1
+    j = 2 * (points.start + i)
+    ux = coords[j] - x1
+    uy = coords[j+1] - y1
+    r2 = ux*ux + uy*uy
+    if r2 == 0.0:
+        return None
+    return (ux*dx + uy*dy) / r2, (ux*dy - uy*dx) / r2
+
+
 def projection_point(angle, point):
     return math.cos(angle) * point[0] + math.sin(angle) * point[1]
 
 def projections_points(angle, points):
     cosa = math.cos(angle)
     sina = math.sin(angle)
-    return [cosa*p[0] + sina * p[1] for p in points]
+    return [cosa*x + sina * y for x, y in zip(points.xs(), points.ys())]
 
 def largeur_path(angle, path):
     positions = projections_points(angle, path.points)
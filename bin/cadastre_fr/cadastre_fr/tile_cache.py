@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache disque partagé des exports PDF du cadastre.
+
+Les PDF sont identifiés par une clé calculée à partir de
+(commune, projection, bbox, taille en pixels), de sorte que les
+imports de bâtiments, d'adresses ou les extraits d'une même commune
+réutilisent les mêmes fichiers au lieu de les re-télécharger.
+
+Un manifeste (base SQLite) liste les PDF présents avec leur taille,
+leur date de téléchargement et leur date de dernier accès. Les PDF trop
+vieux sont ignorés puis supprimés, et les moins récemment utilisés sont
+supprimés lorsque la taille totale du cache dépasse la limite.
+
+Le cache est activé en définissant la variable d'environnement
+CADASTRE_TILE_CACHE_DIR.
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import contextlib
+
+from .tools import temporary_filename
+from .tools import write_stream_to_file
+
+
+TILE_CACHE_DIR = os.environ.get("CADASTRE_TILE_CACHE_DIR")
+# Taille maximale totale des PDF du cache:
+TILE_CACHE_MAX_BYTES = 20 * 1024 * 1024 * 1024
+# Age maximal des PDF du cache, pour suivre les mises à jour du cadastre:
+TILE_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600
+# Lors d'une éviction par taille, on descend sous cette fraction du maximum:
+TILE_CACHE_EVICTION_RATIO = 0.9
+# Nombre d'ajouts au cache entre deux évictions (la première a lieu au
+# premier ajout de chaque processus):
+TILE_CACHE_EVICTION_INTERVAL = 100
+
+
+class TileCache(object):
+    def __init__(self, directory, max_bytes=TILE_CACHE_MAX_BYTES, max_age=TILE_CACHE_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.manifest_filename = os.path.join(directory, "manifest.sqlite")
+        with self.__connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS tiles (
+                key TEXT PRIMARY KEY,
+                commune TEXT,
+                projection TEXT,
+                bbox TEXT,
+                width INTEGER,
+                height INTEGER,
+                size INTEGER,
+                created REAL,
+                last_access REAL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles(last_access)")
+
+    @staticmethod
+    def key(code_commune, projection, bbox, width, height):
+        description = "%s|%s|%f,%f,%f,%f|%dx%d" % ((code_commune, projection) + tuple(bbox) + (width, height))
+        return hashlib.sha1(description.encode("utf8")).hexdigest()
+
+    @contextlib.contextmanager
+    def __connect(self):
+        # Une connexion par opération, car le cache est utilisé par
+        # plusieurs threads et plusieurs processus à la fois:
+        db = sqlite3.connect(self.manifest_filename, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def __tile_filename(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pdf")
+
+    def get(self, key, filename):
+        """Copie le PDF de clé key dans filename s'il est présent dans le
+           cache et pas trop vieux. Retourne True dans ce cas."""
+        now = time.time()
+        with self.__connect() as db:
+            row = db.execute("SELECT created FROM tiles WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return False
+            tile_filename = self.__tile_filename(key)
+            if (row[0] < now - self.max_age) or not os.path.exists(tile_filename):
+                self.__remove(db, key)
+                return False
+            db.execute("UPDATE tiles SET last_access=? WHERE key=?", (now, key))
+        link_or_copy(tile_filename, filename)
+        return True
+
+    def put(self, key, filename, code_commune, projection, bbox, width, height):
+        """Ajoute le fichier PDF filename au cache avec la clé key."""
+        tile_filename = self.__tile_filename(key)
+        tile_dir = os.path.dirname(tile_filename)
+        if not os.path.exists(tile_dir):
+            os.makedirs(tile_dir, exist_ok=True)
+        link_or_copy(filename, tile_filename)
+        now = time.time()
+        with self.__connect() as db:
+            db.execute("INSERT OR REPLACE INTO tiles VALUES (?,?,?,?,?,?,?,?,?)", (
+                key, code_commune, projection, "%f,%f,%f,%f" % tuple(bbox),
+                width, height, os.path.getsize(tile_filename), now, now))
+        if count_insertion(self.directory, TILE_CACHE_EVICTION_INTERVAL):
+            self.evict()
+
+    def download_cached(self, open_function, filename, code_commune, projection, bbox, width, height):
+        """Equivalent de tools.download_cached() passant par le cache.
+           Retourne True si le fichier a été réellement téléchargé."""
+        ok_filename = filename + ".ok"
+        if os.path.exists(filename) and os.path.exists(ok_filename):
+            return False
+        if os.path.exists(ok_filename):
+            os.remove(ok_filename)
+        key = TileCache.key(code_commune, projection, bbox, width, height)
+        if self.get(key, filename):
+            downloaded = False
+        else:
+            write_stream_to_file(open_function(), filename)
+            self.put(key, filename, code_commune, projection, bbox, width, height)
+            downloaded = True
+        open(ok_filename, 'a').close()
+        return downloaded
+
+    def evict(self):
+        """Supprime les PDF trop vieux, puis les moins récemment utilisés
+           si la taille totale dépasse la limite."""
+        with self.__connect() as db:
+            for (key,) in db.execute("SELECT key FROM tiles WHERE created < ?",
+                    (time.time() - self.max_age,)).fetchall():
+                self.__remove(db, key)
+            total = db.execute("SELECT COALESCE(SUM(size),0) FROM tiles").fetchone()[0]
+            if total > self.max_bytes:
+                target = self.max_bytes * TILE_CACHE_EVICTION_RATIO
+                for key, size in db.execute("SELECT key, size FROM tiles ORDER BY last_access").fetchall():
+                    if total <= target:
+                        break
+                    self.__remove(db, key)
+                    total -= size
+
+    def __remove(self, db, key):
+        db.execute("DELETE FROM tiles WHERE key=?", (key,))
+        tile_filename = self.__tile_filename(key)
+        if os.path.exists(tile_filename):
+            os.remove(tile_filename)
+
+    def get_stats(self):
+        with self.__connect() as db:
+            count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM tiles").fetchone()
+        return {"tiles": count, "bytes": total, "max_bytes": self.max_bytes, "max_age": self.max_age}
+
+
+# Nombre d'ajouts depuis le début du processus, pour chaque répertoire de
+# cache (voir count_insertion()):
+_insertions = {}
+_insertions_lock = threading.Lock()
+
+def count_insertion(directory, interval):
+    """Compte un ajout au cache du répertoire directory, et indique s'il
+       faut supprimer les fichiers en trop: au premier ajout, puis tous les
+       interval ajouts. Les caches sont recréés à chaque utilisation (voir
+       get_default_tile_cache()), le compte est donc fait par répertoire."""
+    with _insertions_lock:
+        count = _insertions.get(directory, 0)
+        _insertions[directory] = count + 1
+    return count % interval == 0
+
+def link_or_copy(source, destination):
+    """Remplace atomiquement destination par source, avec un lien physique
+       si possible (sinon par une copie)."""
+    tmp_filename = temporary_filename(destination)
+    try:
+        os.remove(tmp_filename)
+        try:
+            os.link(source, tmp_filename)
+        except OSError:
+            shutil.copyfile(source, tmp_filename)
+        os.replace(tmp_filename, destination)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def get_default_tile_cache():
+    """Retourne le cache défini par la variable d'environnement
+       CADASTRE_TILE_CACHE_DIR, ou None s'il n'est pas activé."""
+    if TILE_CACHE_DIR:
+        return TileCache(TILE_CACHE_DIR)
+    else:
+        return None
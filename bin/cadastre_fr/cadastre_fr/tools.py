@@ -19,7 +19,9 @@ import math
 import time
 import zipfile
 import os.path
+import tempfile
 import itertools
+import threading
 import subprocess
 import unicodedata
 import timeit
@@ -30,15 +32,29 @@ def write_string_to_file(string, filename):
   f.write(string)
   f.close()
 
+def temporary_filename(filename):
+    fd, tmp_filename = tempfile.mkstemp(prefix=os.path.basename(filename) + ".",
+        suffix=".tmp", dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    return tmp_filename
+
 def write_stream_to_file(stream, filename):
+    """Ecrit le contenu du stream dans un fichier temporaire qui remplace
+       ensuite filename, sans modifier l'ancien fichier, qui peut être un
+       lien physique vers un fichier du cache (voir tile_cache.py)."""
     CHUNK = 16 * 1024
-    output = open(filename, "wb")
-    while True:
-        chunk = stream.read(CHUNK)
-        if not chunk: break
-        output.write(chunk)
-    stream.close()
-    output.close()
+    tmp_filename = temporary_filename(filename)
+    try:
+        with open(tmp_filename, "wb") as output:
+            while True:
+                chunk = stream.read(CHUNK)
+                if not chunk: break
+                output.write(chunk)
+        stream.close()
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
 
 
 def download_cached(open_function, filename):
@@ -173,6 +189,24 @@ def command_line_error(error_message, help_message=""):
         sys.exit(0)
 
 
+class RateLimiter(object):
+    """Limite le nombre d'appels par seconde, de façon partagée entre
+       plusieurs threads: chaque appel à wait() bloque le temps nécessaire
+       pour ne pas dépasser max_rate appels par seconde.
+    """
+    def __init__(self, max_rate):
+        self.interval = (1.0 / max_rate) if max_rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
 class Timer():
     def __init__(self, msg):
         self.start = timeit.default_timer()
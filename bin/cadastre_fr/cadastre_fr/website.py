@@ -34,9 +34,16 @@ import urllib.request, urllib.error, urllib.parse
 import http.cookiejar
 import os.path
 import time
+import threading
+
+from .keepalive import ConnectionPool
+from .keepalive import KeepAliveHandler
+from .metadata import get_default_metadata_store
 
 
 CADASTRE_TIMEOUT_SESSION_SECONDES = 5*60
+# Nombre maximal de téléchargements simultanés pour une même session:
+CADASTRE_MAX_CONCURRENT_REQUESTS_PER_SESSION = 4
 
 MAP_PROJECTION_IGNF_VERS_EPSG_CODE = {
   # Metropole, Lambert 9 zones:
@@ -90,64 +97,173 @@ CORRECTIONS_PROJECTION_CADASTRE_COMMUNE = {
 }
 
 
+# Fonctions d'analyse des pages du site du cadastre, partagées par
+# CadastreWebsite et le client asynchrone (website_async.py):
+
+CADASTRE_SEARCH_URL = "https://www.cadastre.gouv.fr/scpc/rechercherPlan.do"
+
+def decode_html(data):
+  try:
+    return data.decode("utf8")
+  except:
+    return data.decode("8859")
+
+def parse_csrf_token(html):
+  """retourne le jeton CSRF_TOKEN de la session, trouvé dans la page html"""
+  csrf_token_index = html.find("CSRF_TOKEN=")
+  if csrf_token_index >= 0:
+      csrf_token_index  = csrf_token_index + len("CSRF_TOKEN=")
+      end_index = csrf_token_index
+      while html[end_index] not in ('"', '&', "'", " "):
+          end_index = end_index + 1
+      return html[csrf_token_index:end_index]
+  else:
+      return ""
+
+def parse_departements_list(html):
+  resultat = {}
+  html = html.split("<select name=\"codeDepartement\"")[1].split("</select>")[0]
+  pattern = re.compile("<option value=\"(...)\">([^<]*)</option>", re.S)
+  for match in pattern.finditer(html):
+    code_departement = match.group(1)
+    nom_departement = match.group(2).replace("&#39;","'")
+    resultat[code_departement] = nom_departement
+  return resultat
+
+def get_communes_list_url(csrf_token, code_departement):
+  return "https://www.cadastre.gouv.fr/scpc/listerCommune.do?CSRF_TOKEN=" + csrf_token + "&codeDepartement=" \
+      + code_departement \
+      + "&libelle=&keepVolatileSession=&offset=5000"
+
+def parse_communes_list(html):
+  communes = {}
+  table_pattern = re.compile("<table[^>]*class=\"resonglet\"[^>]*>(.*?)</table>", re.S)
+  # On ne considère que les communes vectorielles 'VECT':
+  code_pattern = re.compile("ajoutArticle\\('([^']*)','VECT',", re.S);
+  nom_pattern = re.compile("<strong>([^<]*)</strong>", re.S)
+  for table_match in table_pattern.finditer(html):
+    table_content = table_match.group(1)
+    nom_match = nom_pattern.search(table_content)
+    code_match = code_pattern.search(table_content)
+    if (nom_match and code_match):
+        code_commune = code_match.group(1)
+        nom_commune = nom_match.group(1).strip()
+        communes[code_commune] = nom_commune
+  return communes
+
+def get_commune_url(csrf_token, code_commune):
+  return 'https://www.cadastre.gouv.fr/scpc/afficherCarteCommune.do?CSRF_TOKEN=' + csrf_token \
+      + '&c=' + code_commune + '&dontSaveLastForward&keepVolatileSession='
+
+def parse_commune_projection_and_bbox(html, nom_commune):
+  """retourne la projection et la bbox de la commune, trouvées dans la page
+     html de sa carte"""
+  bbox_pattern = re.compile(
+      "new GeoBox\\(\\s*([0-9.]*),\\s*([0-9.]*),\\s*([0-9.]*),\\s*([0-9.]*)\\),\\s*\"([^\"]*)\",",
+      re.S);
+  bbox_match = bbox_pattern.search(html)
+  projection = bbox_match.group(5)
+  #print ("projection = " + projection)
+  if projection in CORRECTIONS_PROJECTION_CADASTRE:
+      print(("projection du cadastre corrigée de " + projection +
+          " vers " + CORRECTIONS_PROJECTION_CADASTRE[projection]))
+      projection = CORRECTIONS_PROJECTION_CADASTRE[projection]
+  if nom_commune in CORRECTIONS_PROJECTION_CADASTRE_COMMUNE:
+      print(("projection du cadastre corrigée de " + projection +
+          " vers " + CORRECTIONS_PROJECTION_CADASTRE_COMMUNE[nom_commune]))
+      projection = CORRECTIONS_PROJECTION_CADASTRE_COMMUNE[nom_commune]
+  x1 = float(bbox_match.group(1))
+  y1 = float(bbox_match.group(2))
+  x2 = float(bbox_match.group(3))
+  y2 = float(bbox_match.group(4))
+  return projection, (x1,y1,x2,y2)
+
+def get_pdf_url(csrf_token):
+  return "https://www.cadastre.gouv.fr/scpc/imprimerExtraitCadastralNonNormalise.do?CSRF_TOKEN=" + csrf_token
+
+def get_pdf_post_data(code_commune, bbox, width, height):
+  """paramètres de la requête d'export pdf de la commune, pour la bbox donnée,
+     avec la taille donnée"""
+  return {
+      "WIDTH" : "%d" % width,
+      "HEIGHT" : "%d" % height,
+      "MAPBBOX" : "%f,%f,%f,%f" % tuple(bbox),
+      "SLD_BODY" : "",
+      "RFV_REF" : code_commune
+  }
+
+
 class CadastreWebsite(object):
   """Accèss au site web https://cadastre.gouv.fr"""
 
-  def __init__(self):
+  def __init__(self, metadata_store=None, refresh_metadata=False):
+    """Si une base de métadonnées est donnée (par défaut celle de
+       get_default_metadata_store()), les départements, communes,
+       projections et bbox y sont lus en priorité, et la session avec le
+       site n'est ouverte qu'à la première requête qui en a besoin.
+       Avec refresh_metadata=True, elles sont toujours lues sur le site,
+       pour mettre à jour la base."""
     self.code_departement = None
     self.code_commune = None
-    self.reinit_session()
+    # Protège la réinitialisation de session lorsque plusieurs threads
+    # utilisent le même objet (téléchargements concurrents):
+    self.session_lock = threading.RLock()
+    # Limite le nombre de requêtes simultanées dans la session:
+    self.session_semaphore = threading.BoundedSemaphore(
+        CADASTRE_MAX_CONCURRENT_REQUESTS_PER_SESSION)
+    # Connexions HTTPS gardées ouvertes et réutilisées pour toutes les
+    # requêtes, y compris après une réinitialisation de session:
+    self.connection_pool = ConnectionPool()
+    self.metadata_store = metadata_store if metadata_store != None else get_default_metadata_store()
+    self.refresh_metadata = refresh_metadata
+    self.url_opener = None
+    self.CSRF_TOKEN = ""
+    self.communes = {}
+    self.projection = None
+    self.bbox = None
+    self.departements = {}
+    if self.metadata_store != None and not refresh_metadata:
+        self.departements = self.metadata_store.get_departements()
+    if not self.departements:
+        self.reinit_session()
 
   def reinit_session(self):
     self.session_start_time = time.time()
     # Crée un cookiejar pour maintenir le nouveau sessionid
     self.url_opener = urllib.request.build_opener(
-        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+        KeepAliveHandler(self.connection_pool))
     # Récupération de la liste des départements
-    self.departements = self.__parse_departements_list(
-        self.url_opener.open(
-            "https://www.cadastre.gouv.fr/scpc/rechercherPlan.do").read())
-    code_departement = self.code_departement
-    code_commune = self.code_commune
-    self.code_departement = None
-    self.code_commune = None
-    self.communes = {}
-    self.projection = None
-    self.bbox = None
-    if code_departement != None:
-        self.set_departement(code_departement)
-    if code_commune != None:
-        self.set_commune(code_commune)
+    html = decode_html(self.url_opener.open(CADASTRE_SEARCH_URL).read())
+    self.CSRF_TOKEN = parse_csrf_token(html)
+    self.departements = parse_departements_list(html)
+    if self.metadata_store != None and len(self.departements) > 0:
+        self.metadata_store.set_departements(self.departements)
+    # On repasse par les pages du département et de la commune courants
+    # pour que la nouvelle session les connaisse:
+    if self.code_departement != None:
+        self.__fetch_departement(self.code_departement)
+    if self.code_commune != None:
+        self.__fetch_commune(self.code_commune)
 
   def check_session_timeout(self):
-    if time.time() > (self.session_start_time +
-        CADASTRE_TIMEOUT_SESSION_SECONDES):
-      sys.stderr.write("Réinitialise la connexion avec le site du cadastre.\n")
-      sys.stderr.flush()
-      self.reinit_session()
-
-  def __parse_departements_list(self, html):
-    resultat = {}
-    html = html.decode("utf8")
-    csrf_token_index = html.find("CSRF_TOKEN=")
-    if csrf_token_index >= 0:
-        csrf_token_index  = csrf_token_index + len("CSRF_TOKEN=")
-        end_index = csrf_token_index
-        while html[end_index] not in ('"', '&', "'", " "):
-            end_index = end_index + 1
-        self.CSRF_TOKEN = html[csrf_token_index:end_index]
-    else:
-        self.CSRF_TOKEN = ""
-    html = html.split("<select name=\"codeDepartement\"")[1].split("</select>")[0]
-    pattern = re.compile("<option value=\"(...)\">([^<]*)</option>", re.S)
-    for match in pattern.finditer(html):
-      code_departement = match.group(1)
-      nom_departement = match.group(2).replace("&#39;","'")
-      resultat[code_departement] = nom_departement
-    return resultat
+    """ouvre la session avec le site si ce n'est pas déjà fait, ou la
+       réinitialise si elle a expiré"""
+    with self.session_lock:
+      if self.url_opener == None:
+        self.reinit_session()
+      elif time.time() > (self.session_start_time +
+          CADASTRE_TIMEOUT_SESSION_SECONDES):
+        sys.stderr.write("Réinitialise la connexion avec le site du cadastre.\n")
+        sys.stderr.flush()
+        self.reinit_session()
 
   def get_departements(self): return self.departements
 
+  def get_connection_stats(self):
+    """retourne les statistiques des connexions au site du cadastre """
+    return self.connection_pool.get_stats()
+
   def get_communes(self):
     """retourne la liste des communes du département courant """
     return self.communes
@@ -167,24 +283,21 @@ class CadastreWebsite(object):
     self.code_commune = None
     self.projection = None
     self.bbox = None
-    communes = {}
-    self.check_session_timeout()
-    url = "https://www.cadastre.gouv.fr/scpc/listerCommune.do?CSRF_TOKEN=" + self.CSRF_TOKEN + "&codeDepartement=" \
-        + code_departement \
-        + "&libelle=&keepVolatileSession=&offset=5000"
-    html = self.url_opener.open(url).read().decode("utf8")
-    table_pattern = re.compile("<table[^>]*class=\"resonglet\"[^>]*>(.*?)</table>", re.S)
-    # On ne considère que les communes vectorielles 'VECT':
-    code_pattern = re.compile("ajoutArticle\\('([^']*)','VECT',", re.S);
-    nom_pattern = re.compile("<strong>([^<]*)</strong>", re.S)
-    for table_match in table_pattern.finditer(html):
-      table_content = table_match.group(1)
-      nom_match = nom_pattern.search(table_content)
-      code_match = code_pattern.search(table_content)
-      if (nom_match and code_match):
-          code_commune = code_match.group(1)
-          nom_commune = nom_match.group(1).strip()
-          communes[code_commune] = nom_commune
+    communes = None
+    if self.metadata_store != None and not self.refresh_metadata:
+      communes = self.metadata_store.get_communes(code_departement)
+    if communes:
+      self.communes = communes
+      self.code_departement = code_departement
+    else:
+      self.check_session_timeout()
+      self.__fetch_departement(code_departement)
+
+  def __fetch_departement(self, code_departement):
+    url = get_communes_list_url(self.CSRF_TOKEN, code_departement)
+    communes = parse_communes_list(decode_html(self.url_opener.open(url).read()))
+    if self.metadata_store != None and len(communes) > 0:
+      self.metadata_store.set_communes(code_departement, communes)
     self.communes = communes
     self.code_departement = code_departement
 
@@ -194,50 +307,34 @@ class CadastreWebsite(object):
     self.code_commune = None
     self.projection = None
     self.bbox = None
-    self.check_session_timeout()
+    projection_and_bbox = None
+    if self.metadata_store != None and not self.refresh_metadata:
+      projection_and_bbox = self.metadata_store.get_commune_projection_and_bbox(
+          self.code_departement, code_commune)
+    if projection_and_bbox:
+      self.code_commune = code_commune
+      self.projection, self.bbox = projection_and_bbox
+    else:
+      self.check_session_timeout()
+      self.__fetch_commune(code_commune)
+
+  def __fetch_commune(self, code_commune):
     self.code_commune = code_commune
     url = self.__get_commune_url()
-    html = self.url_opener.open(url).read()
-    try:
-        html = html.decode("utf8")
-    except:
-        html = html.decode("8859")
-    bbox_pattern = re.compile(
-        "new GeoBox\\(\\s*([0-9.]*),\\s*([0-9.]*),\\s*([0-9.]*),\\s*([0-9.]*)\\),\\s*\"([^\"]*)\",",
-        re.S);
-    bbox_match = bbox_pattern.search(html)
-    self.projection = bbox_match.group(5)
-    #print ("projection = " + self.projection)
-    if self.projection in CORRECTIONS_PROJECTION_CADASTRE:
-        print(("projection du cadastre corrigée de " + self.projection +
-            " vers " + CORRECTIONS_PROJECTION_CADASTRE[self.projection]))
-        self.projection = CORRECTIONS_PROJECTION_CADASTRE[self.projection]
-    nom_commune = self.communes[self.code_commune]
-    if nom_commune in CORRECTIONS_PROJECTION_CADASTRE_COMMUNE:
-        print(("projection du cadastre corrigée de " + self.projection +
-            " vers " + CORRECTIONS_PROJECTION_CADASTRE_COMMUNE[nom_commune]))
-        self.projection = CORRECTIONS_PROJECTION_CADASTRE_COMMUNE[nom_commune]
-    x1 = float(bbox_match.group(1))
-    y1 = float(bbox_match.group(2))
-    x2 = float(bbox_match.group(3))
-    y2 = float(bbox_match.group(4))
-    self.bbox =  (x1,y1,x2,y2)
+    html = decode_html(self.url_opener.open(url).read())
+    self.projection, self.bbox = parse_commune_projection_and_bbox(
+        html, self.communes[self.code_commune])
+    if self.metadata_store != None:
+      self.metadata_store.set_commune_projection_and_bbox(
+          self.code_departement, self.code_commune, self.projection, self.bbox)
 
 
   def open_pdf(self, bbox, width, height):
     """ ouvre l'export pdf de la commune courante, pour la bbox donnée,
         avec la taille donnée """
     self.check_session_timeout()
-    post_data = {
-        #k.encode("utf8"):v.encode("utf8") for (k,v) in {
-          "WIDTH" : "%d" % width,
-          "HEIGHT" : "%d" % height,
-          "MAPBBOX" : "%f,%f,%f,%f" % bbox,
-          "SLD_BODY" : "",
-          "RFV_REF" : self.code_commune
-        #}.items()
-    }
-    url = "https://www.cadastre.gouv.fr/scpc/imprimerExtraitCadastralNonNormalise.do?CSRF_TOKEN=" + self.CSRF_TOKEN
+    post_data = get_pdf_post_data(self.code_commune, bbox, width, height)
+    url = get_pdf_url(self.CSRF_TOKEN)
     return self.url_opener.open(url, urllib.parse.urlencode(post_data).encode("utf8"))
 
   def get_parcel_lon_lat(self, lon, lat):
@@ -339,6 +436,7 @@ class CadastreWebsite(object):
 
   def get_parcel_info(self, parcel):
     """retourne les infos de la parcelle"""
+    self.check_session_timeout()
     data = "<PARCELLES><PARCELLE>" + parcel + "</PARCELLE></PARCELLES>"
     url = "https://www.cadastre.gouv.fr/scpc/afficherInfosParcelles.do?CSRF_TOKEN=" + self.CSRF_TOKEN
     request = urllib.request.Request(url)
@@ -359,8 +457,7 @@ class CadastreWebsite(object):
     return result
 
   def __get_commune_url(self):
-      return 'https://www.cadastre.gouv.fr/scpc/afficherCarteCommune.do?CSRF_TOKEN=' + self.CSRF_TOKEN \
-          + '&c=' + self.code_commune + '&dontSaveLastForward&keepVolatileSession='
+      return get_commune_url(self.CSRF_TOKEN, self.code_commune)
 
   def open_parcels_infos_pdf(self, parcels):
     """ouvre le pdf qui contient les infos des parcelles données"""
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This script is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with it. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Client asynchrone (asyncio) du site web du Cadastre (https://cadastre.gouv.fr)
+
+Contrairement à CadastreWebsite, qui n'a qu'une session et une commune
+courante, AsyncCadastreClient peut ouvrir plusieurs sessions simultanées,
+chacune liée à sa propre commune et renouvelée indépendamment des autres.
+Toutes les sessions partagent les mêmes connexions HTTPS et une même
+limite du nombre de requêtes par seconde et de requêtes simultanées, ce
+qui permet de traiter plusieurs communes dans un seul processus.
+
+ATTENTION: l'utilisation des données du cadastre n'est pas libre, et ce script doit
+donc être utilisé exclusivement pour contribuer à OpenStreetMap, voire
+http://wiki.openstreetmap.org/wiki/Cadastre_Fran%C3%A7ais/Conditions_d%27utilisation
+"""
+
+import os
+import sys
+import time
+import asyncio
+import traceback
+try:
+    import aiohttp
+except:
+    traceback.print_exc()
+    sys.stderr.write("Please install aiohttp (pip install aiohttp)\n")
+    sys.exit(-1)
+
+from .tools import write_string_to_file
+from .tile_cache import TileCache
+from .tile_cache import temporary_filename
+from .website import CADASTRE_SEARCH_URL
+from .website import CADASTRE_TIMEOUT_SESSION_SECONDES
+from .website import CADASTRE_MAX_CONCURRENT_REQUESTS_PER_SESSION
+from .website import decode_html
+from .website import parse_csrf_token
+from .website import parse_departements_list
+from .website import get_communes_list_url
+from .website import parse_communes_list
+from .website import get_commune_url
+from .website import parse_commune_projection_and_bbox
+from .website import get_pdf_url
+from .website import get_pdf_post_data
+from .download_pdf import get_overview_tile
+from .download_pdf import LimitBboxFilterFunc
+
+
+# Nombre maximal de requêtes simultanées, toutes sessions confondues:
+ASYNC_CADASTRE_MAX_CONCURRENT_REQUESTS = 8
+# Nombre maximal de requêtes par seconde, toutes sessions confondues:
+ASYNC_CADASTRE_MAX_REQUESTS_PER_SECOND = 2
+# Délai maximal d'une requête:
+ASYNC_CADASTRE_REQUEST_TIMEOUT_SECONDS = 5*60
+
+
+class AsyncThrottle(object):
+    """Limite le nombre de requêtes simultanées et le nombre de requêtes
+       par seconde, à utiliser avec "async with throttle:".
+       Equivalent asynchrone de tools.RateLimiter.
+    """
+    def __init__(self, max_rate, max_concurrent):
+        self.interval = (1.0 / max_rate) if max_rate else 0
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.next_time = 0
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval > 0:
+            now = time.time()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return self
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+
+class AsyncCadastreSession(object):
+    """Session du site du cadastre liée à une commune."""
+
+    def __init__(self, client, code_departement, code_commune):
+        self.client = client
+        self.code_departement = code_departement
+        self.code_commune = code_commune
+        self.nom_commune = None
+        self.departements = {}
+        self.communes = {}
+        self.projection = None
+        self.bbox = None
+        self.CSRF_TOKEN = ""
+        self.session_start_time = 0
+        # Chaque session a ses propres cookies, mais partage les connexions
+        # du client:
+        self.http = aiohttp.ClientSession(connector=client.connector,
+            connector_owner=False, cookie_jar=aiohttp.CookieJar(),
+            timeout=aiohttp.ClientTimeout(total=ASYNC_CADASTRE_REQUEST_TIMEOUT_SECONDS))
+        self.session_lock = asyncio.Lock()
+        # Limite le nombre de requêtes simultanées dans la session:
+        self.session_semaphore = asyncio.Semaphore(CADASTRE_MAX_CONCURRENT_REQUESTS_PER_SESSION)
+
+    async def reinit_session(self):
+        self.session_start_time = time.time()
+        self.http.cookie_jar.clear()
+        html = decode_html(await self.__read("GET", CADASTRE_SEARCH_URL))
+        self.CSRF_TOKEN = parse_csrf_token(html)
+        self.departements = parse_departements_list(html)
+        html = decode_html(await self.__read("GET",
+            get_communes_list_url(self.CSRF_TOKEN, self.code_departement)))
+        self.communes = parse_communes_list(html)
+        if self.code_commune not in self.communes:
+            raise KeyError("commune invalide: " + self.code_commune)
+        self.nom_commune = self.communes[self.code_commune]
+        html = decode_html(await self.__read("GET", self.get_commune_url()))
+        self.projection, self.bbox = parse_commune_projection_and_bbox(html, self.nom_commune)
+
+    async def check_session_timeout(self):
+        """Renouvelle la session si elle a expiré. Les autres sessions du
+           client ne sont pas affectées."""
+        async with self.session_lock:
+            if time.time() > (self.session_start_time +
+                    CADASTRE_TIMEOUT_SESSION_SECONDES):
+                if self.session_start_time > 0:
+                    sys.stderr.write("Réinitialise la connexion avec le site du cadastre pour la commune %s.\n" % self.code_commune)
+                    sys.stderr.flush()
+                await self.reinit_session()
+
+    def get_commune_url(self):
+        return get_commune_url(self.CSRF_TOKEN, self.code_commune)
+
+    def get_projection(self):
+        return self.projection
+
+    def get_bbox(self):
+        return self.bbox
+
+    async def get_pdf(self, bbox, width, height):
+        """retourne le contenu de l'export pdf de la commune, pour la bbox
+           donnée, avec la taille donnée"""
+        await self.check_session_timeout()
+        async with self.session_semaphore:
+            return await self.__read("POST", get_pdf_url(self.CSRF_TOKEN),
+                data=get_pdf_post_data(self.code_commune, bbox, width, height))
+
+    async def download_pdf(self, filename, bbox, width, height, tile_cache=None):
+        """Télécharge l'export pdf dans filename s'il n'est pas déjà présent
+           (voir tools.download_cached()), en passant par le cache partagé
+           s'il est donné. Retourne True si le pdf a été réellement téléchargé.
+           Les accès au cache (base SQLite et copies de fichiers) sont
+           bloquants, ils sont donc faits dans un thread pour ne pas bloquer
+           la boucle d'évènements."""
+        ok_filename = filename + ".ok"
+        if os.path.exists(filename) and os.path.exists(ok_filename):
+            return False
+        if os.path.exists(ok_filename):
+            os.remove(ok_filename)
+        key = TileCache.key(self.code_commune, self.projection, bbox, width, height)
+        if (tile_cache != None) and await asyncio.to_thread(tile_cache.get, key, filename):
+            downloaded = False
+        else:
+            data = await self.get_pdf(bbox, width, height)
+            tmp_filename = temporary_filename(filename)
+            try:
+                with open(tmp_filename, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_filename, filename)
+            finally:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+            if tile_cache != None:
+                await asyncio.to_thread(tile_cache.put, key, filename, self.code_commune, self.projection, bbox, width, height)
+            downloaded = True
+        open(ok_filename, 'a').close()
+        return downloaded
+
+    async def __read(self, method, url, data=None):
+        async with self.client.throttle:
+            async with self.http.request(method, url, data=data) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def close(self):
+        await self.http.close()
+
+
+class AsyncCadastreClient(object):
+    """Client asynchrone du site du cadastre, à utiliser avec
+       "async with AsyncCadastreClient() as client:"
+    """
+
+    def __init__(self, max_rate=ASYNC_CADASTRE_MAX_REQUESTS_PER_SECOND, max_concurrent=ASYNC_CADASTRE_MAX_CONCURRENT_REQUESTS):
+        self.connector = aiohttp.TCPConnector(limit=max_concurrent)
+        self.throttle = AsyncThrottle(max_rate, max_concurrent)
+        self.sessions = []
+
+    async def open_session(self, code_departement, code_commune):
+        """Ouvre une nouvelle session pour la commune donnée."""
+        session = AsyncCadastreSession(self, code_departement, code_commune)
+        try:
+            await session.check_session_timeout()
+        except:
+            await session.close()
+            raise
+        self.sessions.append(session)
+        return session
+
+    async def close(self):
+        for session in self.sessions:
+            await session.close()
+        self.sessions = []
+        await self.connector.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+async def download_overview_pdf(session, tile_cache=None):
+    """Equivalent asynchrone de download_pdf.download_overview_pdf()."""
+    code_commune = session.code_commune
+    overview_bbox, largeur, hauteur = get_overview_tile(session.get_bbox())
+    pdf_filename = code_commune + "-overview.pdf"
+    write_string_to_file(session.get_projection() + (":%f,%f,%f,%f" % overview_bbox), code_commune + "-overview.bbox")
+    try:
+        await session.download_pdf(pdf_filename, overview_bbox, largeur, hauteur, tile_cache)
+        return pdf_filename
+    except Exception:
+        traceback.print_exc()
+        sys.stderr.write("ATTENTION: problème lors du téléchargement de la vue d'ensemble de la commune %s\n" % code_commune)
+        return None
+
+async def download_commune_pdfs(session, liste, tile_cache=None):
+    """Télécharge les pdf du découpage liste (voir
+       download_pdf.decoupage_bbox_cadastre_size()) de la commune de la
+       session, et retourne la liste de leurs noms de fichiers.
+       Les pdf sont nommés comme ceux de download_pdf.download_pdfs(), et
+       comme elle on ne télécharge que ceux qui recoupent les limites de
+       la commune (voir download_pdf.LimitBboxFilterFunc), obtenues depuis
+       sa vue d'ensemble ou à défaut depuis les premiers pdf téléchargés.
+       Si le téléchargement d'un pdf échoue, ceux en cours sont annulés et
+       l'exception est transmise.
+    """
+    code_commune = session.code_commune
+    projection = session.get_projection()
+    limitBboxFilterFunc = LimitBboxFilterFunc()
+    overview_filename = await download_overview_pdf(session, tile_cache)
+    if overview_filename:
+        await asyncio.to_thread(limitBboxFilterFunc.feed_overview_pdf, overview_filename)
+    # Comme dans download_pdf.iter_pdf_tiles(), le filtre est appliqué au
+    # dernier moment, pour tenir compte des pdf déjà téléchargés: les pdf
+    # sont traités dans l'ordre, au plus
+    # CADASTRE_MAX_CONCURRENT_REQUESTS_PER_SESSION à la fois.
+    slots = asyncio.Semaphore(CADASTRE_MAX_CONCURRENT_REQUESTS_PER_SESSION)
+    feed_lock = asyncio.Lock()
+    async def download(i, j, sous_bbox, largeur, hauteur):
+        async with slots:
+            if not limitBboxFilterFunc(sous_bbox):
+                return None
+            name = code_commune + ("-%d-%d" % (i,j))
+            write_string_to_file(projection + (":%f,%f,%f,%f" % sous_bbox), name + ".bbox")
+            await session.download_pdf(name + ".pdf", sous_bbox, largeur, hauteur, tile_cache)
+            async with feed_lock:
+                await asyncio.to_thread(limitBboxFilterFunc.feed_pdf, name + ".pdf")
+            return name + ".pdf"
+    tasks = [asyncio.ensure_future(download(i, j, sous_bbox, largeur, hauteur))
+        for ((i,j), sous_bbox, (largeur,hauteur)) in liste]
+    try:
+        filenames = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [filename for filename in filenames if filename is not None]
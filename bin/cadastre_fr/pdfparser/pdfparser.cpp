@@ -25,11 +25,49 @@
  * et génère pour chaque path:
  *  - 1 ligne représentant le path au format SVG (attribut d d'un <path/>)
  *  - 1 ligne représentant son style (attribut style d'un <path/>)
+ *
+ * Avec l'option -b, la sortie est binaire, ce qui évite au programme python
+ * de re-parser le texte des paths. Elle commence par BINARY_MAGIC, suivi
+ * d'enregistrements composés d'un octet de type, de la longueur (uint32)
+ * des données puis des données:
+ *  - type 'S' (définition d'un style): id (uint32) puis le style en UTF-8.
+ *    Chaque style n'est défini qu'une seule fois, avant le premier path
+ *    qui l'utilise.
+ *  - type 'P' (path): id du style (uint32), nombre de commandes (uint32),
+ *    les commandes (1 octet chacune parmi M, L, C et Z), puis les
+ *    coordonnées x,y des points (float64).
+ * Tous les nombres sont en little-endian.
+ *
+ * Avec l'option -s (mode serveur), le programme lit sur son entrée standard
+ * les noms de fichiers PDF à traiter, un par ligne, et écrit pour chacun,
+ * au format binaire, un enregistrement de type 'F' (début de fichier), les
+ * paths du fichier puis un enregistrement de type 'E' (fin de fichier).
+ * Les données de l'enregistrement 'F' sont le numéro du fichier (uint32,
+ * en commençant à 0), celles de l'enregistrement 'E' le numéro du fichier
+ * suivi de 1 si le fichier a pu être lu, 0 sinon (uint32).
+ * Les styles définis restent valables pour les fichiers suivants.
+ *
+ * En mode binaire ou serveur, l'option -f <filtre> (ou en mode serveur une
+ * ligne "-f <filtre>", valable pour les fichiers suivants) permet de
+ * n'écrire que les paths acceptés par une des règles du filtre, séparées
+ * par des '|'. Chaque règle est une liste de conditions séparées par des
+ * espaces, qui doivent toutes être vérifiées:
+ *  - "@lines": les commandes du path sont des polygones (MLLLL*Z)+
+ *  - "@=C1,C2,...": les commandes du path sont une des valeurs données
+ *  - "@glyph=C1,C2,...": les commandes du path jusqu'au premier Z sont
+ *    une des valeurs données (voir TextPathRecognizer.recognize())
+ *  - "propriété:valeur": le style a cette valeur pour cette propriété
+ *  - "propriété~a..b,c..d": la valeur de la propriété du style est un
+ *    nombre strictement compris entre a et b ou entre c et d.
+ * L'enregistrement 'E' contient alors aussi le nombre de paths écrits et
+ * le nombre de paths filtrés (uint32). En mode binaire simple, il est écrit
+ * à la fin de la sortie, avec le numéro de fichier 0.
  */
 
 #include <podofo/base/PdfParser.h>
 #include <podofo/base/PdfObject.h>
 #include <podofo/base/PdfStream.h>
+#include <podofo/base/PdfError.h>
 
 #include <QList>
 #include <QStack>
@@ -39,7 +77,14 @@
 
 
 #include <iostream>
+#include <sstream>
+#include <string>
+#include <map>
+#include <set>
+#include <vector>
 #include <cstdlib>
+#include <cstring>
+#include <stdint.h>
 #include <errno.h>
 #include <assert.h>
 
@@ -84,7 +129,341 @@ std::ostream& operator<<( std::ostream& stream, FloatText const& t )
 }
 
 
-bool parseStream(const char *stream, unsigned long streamLen) {
+static std::vector<std::string> split(const std::string& str, char separator) {
+    std::vector<std::string> result;
+    size_t start = 0;
+    while (true) {
+        size_t end = str.find(separator, start);
+        if (end == std::string::npos) {
+            result.push_back(str.substr(start));
+            return result;
+        }
+        result.push_back(str.substr(start, end - start));
+        start = end + 1;
+    }
+}
+
+
+/***
+ * Filtre des paths, voir la description au début de ce fichier.
+ */
+class PathFilter {
+private:
+    enum CommandsTest { COMMANDS_ANY, COMMANDS_LINES, COMMANDS_EXACT, COMMANDS_GLYPH };
+    struct Range {
+        double min;
+        double max;
+    };
+    struct Rule {
+        CommandsTest commandsTest;
+        std::set<std::string> commands;
+        std::vector<std::pair<std::string, std::string> > equals;
+        std::vector<std::pair<std::string, std::vector<Range> > > ranges;
+    };
+    bool active;
+    std::vector<Rule> rules;
+    // Résultat du test des conditions de style de chaque règle, par style:
+    std::map<std::string, std::vector<bool> > styleCache;
+
+    static bool isLinesCommands(const std::string& commands) {
+        size_t i = 0;
+        size_t n = commands.size();
+        if (n == 0)
+            return false;
+        while (i < n) {
+            if (commands[i] != 'M')
+                return false;
+            i++;
+            size_t nbLines = 0;
+            while ((i < n) && (commands[i] == 'L')) {
+                i++;
+                nbLines++;
+            }
+            if ((nbLines < 3) || (i >= n) || (commands[i] != 'Z'))
+                return false;
+            i++;
+        }
+        return true;
+    }
+    static bool commandsMatch(const Rule& rule, const std::string& commands) {
+        switch (rule.commandsTest) {
+        case COMMANDS_LINES:
+            return isLinesCommands(commands);
+        case COMMANDS_EXACT:
+            return rule.commands.count(commands) > 0;
+        case COMMANDS_GLYPH: {
+            // Même index que TextPathRecognizer.database:
+            size_t z = commands.find('Z');
+            std::string idx = (z != std::string::npos) ? commands.substr(0, z)
+                : commands.substr(0, commands.empty() ? 0 : commands.size() - 1);
+            return rule.commands.count(idx) > 0;
+        }
+        default:
+            return true;
+        }
+    }
+    const std::vector<bool>& styleMatches(const std::string& style) {
+        std::map<std::string, std::vector<bool> >::iterator it = styleCache.find(style);
+        if (it != styleCache.end())
+            return it->second;
+        std::map<std::string, std::string> properties;
+        std::vector<std::string> tokens = split(style, ';');
+        for (size_t i=0; i<tokens.size(); i++) {
+            size_t colon = tokens[i].find(':');
+            if (colon != std::string::npos)
+                properties[tokens[i].substr(0, colon)] = tokens[i].substr(colon + 1);
+        }
+        std::vector<bool>& result = styleCache[style];
+        for (size_t r=0; r<rules.size(); r++) {
+            const Rule& rule = rules[r];
+            bool ok = true;
+            for (size_t i=0; ok && (i<rule.equals.size()); i++) {
+                std::map<std::string, std::string>::iterator p = properties.find(rule.equals[i].first);
+                ok = (p != properties.end()) && (p->second == rule.equals[i].second);
+            }
+            for (size_t i=0; ok && (i<rule.ranges.size()); i++) {
+                std::map<std::string, std::string>::iterator p = properties.find(rule.ranges[i].first);
+                ok = false;
+                if (p != properties.end()) {
+                    double value = strtod(p->second.c_str(), NULL);
+                    const std::vector<Range>& ranges = rule.ranges[i].second;
+                    for (size_t j=0; j<ranges.size(); j++) {
+                        if ((value > ranges[j].min) && (value < ranges[j].max))
+                            ok = true;
+                    }
+                }
+            }
+            result.push_back(ok);
+        }
+        return result;
+    }
+public:
+    PathFilter() : active(false) {}
+    bool isActive() const {
+        return active;
+    }
+    void clear() {
+        active = false;
+        rules.clear();
+        styleCache.clear();
+    }
+    void parse(const std::string& spec) {
+        clear();
+        active = true;
+        std::vector<std::string> ruleSpecs = split(spec, '|');
+        for (size_t r=0; r<ruleSpecs.size(); r++) {
+            Rule rule;
+            rule.commandsTest = COMMANDS_ANY;
+            std::vector<std::string> conditions = split(ruleSpecs[r], ' ');
+            for (size_t i=0; i<conditions.size(); i++) {
+                const std::string& condition = conditions[i];
+                size_t pos;
+                if (condition.empty()) {
+                    continue;
+                } else if (condition == "@lines") {
+                    rule.commandsTest = COMMANDS_LINES;
+                } else if (condition.compare(0, 2, "@=") == 0) {
+                    rule.commandsTest = COMMANDS_EXACT;
+                    std::vector<std::string> values = split(condition.substr(2), ',');
+                    rule.commands.insert(values.begin(), values.end());
+                } else if (condition.compare(0, 7, "@glyph=") == 0) {
+                    rule.commandsTest = COMMANDS_GLYPH;
+                    std::vector<std::string> values = split(condition.substr(7), ',');
+                    rule.commands.insert(values.begin(), values.end());
+                } else if ((pos = condition.find('~')) != std::string::npos) {
+                    std::vector<Range> ranges;
+                    std::vector<std::string> values = split(condition.substr(pos + 1), ',');
+                    for (size_t j=0; j<values.size(); j++) {
+                        size_t dots = values[j].find("..");
+                        if (dots == std::string::npos)
+                            continue;
+                        Range range;
+                        range.min = strtod(values[j].substr(0, dots).c_str(), NULL);
+                        range.max = strtod(values[j].substr(dots + 2).c_str(), NULL);
+                        ranges.push_back(range);
+                    }
+                    rule.ranges.push_back(std::make_pair(condition.substr(0, pos), ranges));
+                } else if ((pos = condition.find(':')) != std::string::npos) {
+                    rule.equals.push_back(std::make_pair(condition.substr(0, pos), condition.substr(pos + 1)));
+                } else {
+                    std::cerr << "ERROR: invalid filter condition: " << condition << std::endl;
+                }
+            }
+            rules.push_back(rule);
+        }
+    }
+    bool accept(const std::string& commands, const std::string& style) {
+        if (!active)
+            return true;
+        const std::vector<bool>& styleOk = styleMatches(style);
+        for (size_t r=0; r<rules.size(); r++) {
+            if (styleOk[r] && commandsMatch(rules[r], commands))
+                return true;
+        }
+        return false;
+    }
+};
+
+
+/***
+ * Destination des paths trouvés dans le PDF.
+ */
+class PathWriter {
+public:
+    virtual ~PathWriter() {}
+    virtual void moveTo(const FloatText& x, const FloatText& y) = 0;
+    virtual void lineTo(const FloatText& x, const FloatText& y) = 0;
+    virtual void curveTo(const FloatText& x1, const FloatText& y1,
+                         const FloatText& x2, const FloatText& y2,
+                         const FloatText& x3, const FloatText& y3) = 0;
+    virtual void closePath() = 0;
+    virtual void endPath(const std::string& style) = 0;
+    virtual void finish() {}
+};
+
+
+/***
+ * Sortie texte: une ligne au format SVG puis une ligne de style par path.
+ */
+class TextPathWriter : public PathWriter {
+public:
+    void moveTo(const FloatText& x, const FloatText& y) {
+        std::cout << " M " << x << ',' << y;
+    }
+    void lineTo(const FloatText& x, const FloatText& y) {
+        std::cout << " L " << x << ',' << y;
+    }
+    void curveTo(const FloatText& x1, const FloatText& y1,
+                 const FloatText& x2, const FloatText& y2,
+                 const FloatText& x3, const FloatText& y3) {
+        std::cout << " C " << x1 << ',' << y1 << ' ' << x2 << ',' << y2 << ' ' << x3 << ',' << y3;
+    }
+    void closePath() {
+        std::cout << " Z";
+    }
+    void endPath(const std::string& style) {
+        std::cout << std::endl << style << std::endl;
+    }
+};
+
+
+static const char BINARY_MAGIC[] = "PDFPB001";
+
+/***
+ * Sortie binaire, voir la description du format au début de ce fichier.
+ */
+class BinaryPathWriter : public PathWriter {
+private:
+    std::string commands;
+    std::vector<double> points;
+    std::map<std::string, uint32_t> styles;
+    std::string record;
+    uint32_t keptPaths;
+    uint32_t droppedPaths;
+
+    static void appendUInt32(std::string& buffer, uint32_t value) {
+        for (int i=0; i<4; i++) {
+            buffer.push_back(char((value >> (8*i)) & 0xff));
+        }
+    }
+    static void appendDouble(std::string& buffer, double value) {
+        uint64_t bits;
+        memcpy(&bits, &value, sizeof(bits));
+        for (int i=0; i<8; i++) {
+            buffer.push_back(char((bits >> (8*i)) & 0xff));
+        }
+    }
+    void writeRecord(char type) {
+        std::string header(1, type);
+        appendUInt32(header, record.size());
+        std::cout.write(header.data(), header.size());
+        std::cout.write(record.data(), record.size());
+    }
+    void addPoint(const FloatText& x, const FloatText& y) {
+        points.push_back(x.value());
+        points.push_back(y.value());
+    }
+public:
+    PathFilter filter;
+
+    BinaryPathWriter() : keptPaths(0), droppedPaths(0) {
+        std::cout.write(BINARY_MAGIC, strlen(BINARY_MAGIC));
+    }
+    void moveTo(const FloatText& x, const FloatText& y) {
+        commands.push_back('M');
+        addPoint(x, y);
+    }
+    void lineTo(const FloatText& x, const FloatText& y) {
+        commands.push_back('L');
+        addPoint(x, y);
+    }
+    void curveTo(const FloatText& x1, const FloatText& y1,
+                 const FloatText& x2, const FloatText& y2,
+                 const FloatText& x3, const FloatText& y3) {
+        commands.push_back('C');
+        addPoint(x1, y1);
+        addPoint(x2, y2);
+        addPoint(x3, y3);
+    }
+    void closePath() {
+        commands.push_back('Z');
+    }
+    void endPath(const std::string& style) {
+        if (!filter.accept(commands, style)) {
+            droppedPaths++;
+            commands.clear();
+            points.clear();
+            return;
+        }
+        keptPaths++;
+        std::map<std::string, uint32_t>::iterator it = styles.find(style);
+        uint32_t styleId;
+        if (it == styles.end()) {
+            styleId = styles.size();
+            styles[style] = styleId;
+            record.clear();
+            appendUInt32(record, styleId);
+            record.append(style);
+            writeRecord('S');
+        } else {
+            styleId = it->second;
+        }
+        record.clear();
+        appendUInt32(record, styleId);
+        appendUInt32(record, commands.size());
+        record.append(commands);
+        for (size_t i=0; i<points.size(); i++) {
+            appendDouble(record, points[i]);
+        }
+        writeRecord('P');
+        commands.clear();
+        points.clear();
+    }
+    void beginFile(uint32_t fileId) {
+        commands.clear();
+        points.clear();
+        keptPaths = 0;
+        droppedPaths = 0;
+        record.clear();
+        appendUInt32(record, fileId);
+        writeRecord('F');
+    }
+    void endFile(uint32_t fileId, bool ok) {
+        record.clear();
+        appendUInt32(record, fileId);
+        appendUInt32(record, ok ? 1 : 0);
+        appendUInt32(record, keptPaths);
+        appendUInt32(record, droppedPaths);
+        writeRecord('E');
+        std::cout.flush();
+    }
+    void finish() {
+        std::cout.flush();
+    }
+};
+
+
+bool parseStream(const char *stream, unsigned long streamLen, PathWriter& writer) {
     //std::cout << "parseStream of length " << streamLen << std::endl;
     setlocale(LC_ALL, "C");
     QStack<FloatText> stack;
@@ -102,6 +481,7 @@ bool parseStream(const char *stream, unsigned long streamLen) {
     currentContext.pen.setColor(Qt::black);
     QString currentPath;
     FloatText cur_x, cur_y;
+    std::ostringstream style;
     do {
         // Special case : array handling
         if (stream[tokenPosition] == '[') {
@@ -120,7 +500,7 @@ bool parseStream(const char *stream, unsigned long streamLen) {
                 y1 = stack.pop();
                 x1 = stack.pop();
                 //currentPath.lineTo(x1, y1);
-                std::cout << " L " << x1 << ',' << y1;
+                writer.lineTo(x1, y1);
                 cur_x = x1;
                 cur_y = y1;
                 break;
@@ -130,7 +510,7 @@ bool parseStream(const char *stream, unsigned long streamLen) {
                 y2 = stack.pop();
                 x2 = stack.pop();
                 //currentPath.quadTo(x2, y2, x3, y3); WRONG, it's not a quad but a cubic command !
-                std::cout << " C " << cur_x << ',' << cur_y << ' ' << x2 << ',' << y2 << ' ' << x3 << ',' << y3;
+                writer.curveTo(cur_x, cur_y, x2, y2, x3, y3);
                 cur_x = x3;
                 cur_y = y3;
                 break;
@@ -139,7 +519,7 @@ bool parseStream(const char *stream, unsigned long streamLen) {
                 x3 = stack.pop();
                 y2 = stack.pop();
                 x2 = stack.pop();
-                std::cout << " C " << x2 << ',' << y2 << ' ' << x3 << ',' << y3 << ' ' << x3 << ',' << y3;
+                writer.curveTo(x2, y2, x3, y3, x3, y3);
                 cur_x = x3;
                 cur_y = y3;
                 break;
@@ -147,13 +527,13 @@ bool parseStream(const char *stream, unsigned long streamLen) {
                 y1 = stack.pop();
                 x1 = stack.pop();
                 //currentPath.moveTo(x1, y1);
-                std::cout << " M " << x1 << ',' << y1;
+                writer.moveTo(x1, y1);
                 cur_x = x1;
                 cur_y = y1;
                 break;
             case 'h':
                 //currentPath.closeSubpath();
-                std::cout << " Z";
+                writer.closePath();
                 break;
             case 'W':
                 //if (currentContext.clipPath.length() == 0)
@@ -169,7 +549,7 @@ bool parseStream(const char *stream, unsigned long streamLen) {
                 break;
             case 'n':
                 //currentPath = VectorPath();
-                std::cout << std::endl << "" << std::endl;
+                writer.endPath("");
                 break;
             case 'q':
                 contexts.append(currentContext);
@@ -180,13 +560,14 @@ bool parseStream(const char *stream, unsigned long streamLen) {
             case 'S':
                 //emit strikePath(currentPath, currentContext);
                 //currentPath = VectorPath();
-                std::cout << std::endl << "fill:none;stroke:" << currentContext.pen.color().name().toStdString();
-                std::cout << ";stroke-opacity:1";
+                style.str("");
+                style << "fill:none;stroke:" << currentContext.pen.color().name().toStdString();
+                style << ";stroke-opacity:1";
                 if (currentContext.pen.style() == Qt::SolidLine) {
-                    std::cout << ";stroke-dasharray:none";
+                    style << ";stroke-dasharray:none";
                 }
-                std::cout << ";stroke-width:" << currentContext.pen.widthF();
-                std::cout << std::endl;
+                style << ";stroke-width:" << currentContext.pen.widthF();
+                writer.endPath(style.str());
                 break;
             case 'w':
                 currentContext.pen.setWidthF(stack.pop().value());
@@ -212,16 +593,17 @@ bool parseStream(const char *stream, unsigned long streamLen) {
                 currentContext.pen.setMiterLimit(stack.pop().value());
                 break;
             case 'f':
-                std::cout << std::endl << "fill:" << currentContext.brush.color().name().toStdString();
-                std::cout << ";stroke:none";
+                style.str("");
+                style << "fill:" << currentContext.brush.color().name().toStdString();
+                style << ";stroke:none";
                 if (stream[previousPosition+1] == '*')
                     //emit fillPath(currentPath, currentContext, Qt::OddEvenFill);
-                    std::cout << ";fill-rule:evenodd";
+                    style << ";fill-rule:evenodd";
                 else
                     //emit fillPath(currentPath, currentContext, Qt::WindingFill);
-                    std::cout << ";fill-rule:nonzero";
+                    style << ";fill-rule:nonzero";
                 //currentPath = VectorPath();
-                std::cout << std::endl;
+                writer.endPath(style.str());
                 break;
             case 'd':
                 offset = stack.pop().value();
@@ -249,7 +631,7 @@ bool parseStream(const char *stream, unsigned long streamLen) {
                 y1 = stack.pop();
                 x1 = stack.pop();
                 //currentPath.cubicTo(x1, y1, x2, y2, x3, y3);
-                std::cout << " C " << x1 << ',' << y1 << ' ' << x2 << ',' << y2 << ' ' << x3 << ',' << y3;
+                writer.curveTo(x1, y1, x2, y2, x3, y3);
                 cur_x = x3;
                 cur_y = y3;
                 break;
@@ -287,7 +669,7 @@ bool parseStream(const char *stream, unsigned long streamLen) {
 }
 
 
-bool parsepdf(const char* filename) {
+bool parsepdf(const char* filename, PathWriter& writer) {
   PoDoFo::PdfVecObjects objects;
   PoDoFo::PdfParser parser(&objects, filename);
   PoDoFo::TIVecObjects it = objects.begin();
@@ -305,7 +687,7 @@ bool parsepdf(const char* filename) {
         stream->GetFilteredCopy(&buffer, &bufferLen);
         //std::cerr << "Buffer length : " << bufferLen << std::endl;
         if (bufferLen > 500)
-            result = parseStream(buffer, bufferLen);
+            result = parseStream(buffer, bufferLen, writer);
         free(buffer);
     }
     it++;
@@ -313,12 +695,68 @@ bool parsepdf(const char* filename) {
   return result;
 }
 
-int main(int argc, char** argv) {
+static int usage(const char* program) {
+    std::cerr << "ERROR: wrong number of argument" << std::endl;
+    std::cerr << "usage: " << program << " [-b [-f filter]] file.pdf" << std::endl;
+    std::cerr << "       " << program << " -s [-f filter]" << std::endl;
+    return -1;
+}
 
-  if (argc != 2) {
-      std::cerr << "ERROR: wrong number of argument" << std::endl;
-      return -1;
+int main(int argc, char** argv) {
+  bool binary = false;
+  bool server = false;
+  std::string filterSpec;
+  bool filter = false;
+  int i = 1;
+  for (; (i < argc) && (argv[i][0] == '-'); i++) {
+      if (strcmp(argv[i], "-b") == 0) {
+          binary = true;
+      } else if (strcmp(argv[i], "-s") == 0) {
+          server = true;
+      } else if ((strcmp(argv[i], "-f") == 0) && (i + 1 < argc)) {
+          filter = true;
+          filterSpec = argv[++i];
+      } else {
+          return usage(argv[0]);
+      }
+  }
+  if ((server && (i != argc)) || (!server && (i != argc - 1)) || (filter && !binary && !server)) {
+      return usage(argv[0]);
+  } else if (server) {
+      BinaryPathWriter writer;
+      if (filter)
+          writer.filter.parse(filterSpec);
+      writer.finish();
+      std::string line;
+      uint32_t fileId = 0;
+      while (std::getline(std::cin, line)) {
+          if (line == "-f") {
+              writer.filter.clear();
+              continue;
+          } else if (line.compare(0, 3, "-f ") == 0) {
+              writer.filter.parse(line.substr(3));
+              continue;
+          }
+          writer.beginFile(fileId);
+          bool ok = true;
+          try {
+              parsepdf(line.c_str(), writer);
+          } catch (const PoDoFo::PdfError& e) {
+              std::cerr << "ERROR: " << line << ": " << e.what() << std::endl;
+              ok = false;
+          }
+          writer.endFile(fileId, ok);
+          fileId++;
+      }
+  } else if (binary) {
+      BinaryPathWriter writer;
+      if (filter)
+          writer.filter.parse(filterSpec);
+      parsepdf(argv[i], writer);
+      writer.endFile(0, true);
   } else {
-      parsepdf(argv[1]);
+      TextPathWriter writer;
+      parsepdf(argv[i], writer);
+      writer.finish();
   }
 }
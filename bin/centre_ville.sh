@@ -1,5 +1,8 @@
 #!/bin/bash
 
+. `dirname $0`/../config || exit -1
+export CADASTRE_METADATA_DB="${metadata_db:-$work_dir/metadata/metadata.sqlite}"
+
 `dirname $0`/cadastre_fr/bin/cadastre_center.py "$@"
 
 
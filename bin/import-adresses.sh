@@ -4,6 +4,9 @@
 umask 002
 
 export MPLCONFIGDIR="$work_dir/tmp"
+export CADASTRE_TILE_CACHE_DIR="${tile_cache_dir:-$work_dir/tile_cache}"
+export CADASTRE_PARSE_CACHE_DIR="${parse_cache_dir:-$work_dir/parse_cache}"
+export CADASTRE_METADATA_DB="${metadata_db:-$work_dir/metadata/metadata.sqlite}"
 
 if [[ $# != 3 && $# != 5 ]] ; then
     echo "ERREUR: mauvais nombre d'arguments"
@@ -79,6 +82,7 @@ $command3 "${file1}" "${file1/associatedStreet/addrstreet}"
 $command3 "${file2}" "${file2/associatedStreet/addrstreet}"
 mv "$communedir/${code_commune}-lieux-dits.zip" "${file5}"
 mv "$communedir/${code_commune}-mots.zip" "${file6}"
+cp -f "$communedir/${code_commune}-adresses-recognition.json" "${depdir}/${code_commune}-${nom_commune}-adresses-recognition.json"
 
 #cd $command2dir && $command2 || exit -1
 
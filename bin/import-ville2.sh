@@ -17,11 +17,14 @@ bbox="$4"
 cd $data_dir || exit -1
 umask 002
 export MPLCONFIGDIR="$work_dir/tmp"
+export CADASTRE_TILE_CACHE_DIR="${tile_cache_dir:-$work_dir/tile_cache}"
+export CADASTRE_PARSE_CACHE_DIR="${parse_cache_dir:-$work_dir/parse_cache}"
+export CADASTRE_METADATA_DB="${metadata_db:-$work_dir/metadata/metadata.sqlite}"
 
 Qadastre2OSM="$bin_dir/Qadastre2OSM"
 cadastre_2_pdf="$bin_dir/cadastre_fr/bin/cadastre_2_pdf.py"
 osm_houses_simplify="$bin_dir/cadastre_fr/bin/osm_houses_simplify.py"
-pdf_2_osm_houses="$bin_dir/cadastre_fr/bin/pdf_2_osm_houses.py "
+pdf_2_osm_layers="$bin_dir/cadastre_fr/bin/pdf_2_osm_layers.py "
 segmented_building_predict="env  PYTHONPATH=$bin_dir/cadastre_fr/cadastre_fr_segmented/lib $bin_dir/cadastre_fr/bin/osm_segmented_building_predict.py"
 
 [ -d $dep ] || mkdir $dep
@@ -52,7 +55,7 @@ chmod 777 $download_dir 2>/dev/null
 
 city_limit_top_size=0
 
-$cadastre_2_pdf $bboxargs -size 200 $dep $code | while read pdf; do
+$cadastre_2_pdf $bboxargs -size 200 -j 4 $dep $code | while read pdf; do
   echo $pdf
   basename=`basename "$pdf" .pdf`
   index=`echo "$basename" |cut -c 7-`
@@ -77,10 +80,15 @@ $cadastre_2_pdf $bboxargs -size 200 $dep $code | while read pdf; do
   
 done
 
-$pdf_2_osm_houses $code
-mv $code-houses.osm "$dest_dir/$code-$name-houses.osm"
-mv $code-city-limit.osm "$dest_dir/$code-$name-city-limit.osm"
-mv $code-water.osm "$water_dir/$code-$name-water.osm"
+# Les résultats sont copiés (et non déplacés) pour que pdf_2_osm_layers
+# puisse les réutiliser si les PDF n'ont pas changé (voir $code-manifest.json).
+# L'analyse des PDF faite pour les bâtiments est aussi enregistrée pour
+# l'import des adresses (voir $code-pdf-parse.pickle):
+$pdf_2_osm_layers $code
+cp -f $code-houses.osm "$dest_dir/$code-$name-houses.osm"
+cp -f $code-city-limit.osm "$dest_dir/$code-$name-city-limit.osm"
+cp -f $code-water.osm "$water_dir/$code-$name-water.osm"
+cp -f $code-houses-recognition.json "$dest_dir/$code-$name-houses-recognition.json"
 cd "$dest_dir" && $osm_houses_simplify "$code-$name-houses.osm"
 cd "$dest_dir" && $segmented_building_predict "$code-$name-houses-simplifie.osm" "$code-$name-houses-prediction_segmente.osm"
 cd "$dest_dir" && tar jcf "$code-$name.tar.bz2" --exclude="*-water.osm" $code-"$name"*.osm
@@ -11,10 +11,33 @@ umask 002
 echo "Nettoyage des données"
 test -d "$water_dir"  && rm -rf "$water_dir"/* 2>/dev/null
 test -d "$log_dir"    && rm -rf "$log_dir"/* 2>/dev/null
-test -d "$hidden_dir" && rm -rf "$hidden_dir"/* 2>/dev/null
+# Dans le répertoire caché on garde les manifestes et les résultats
+# intermédiaires, qui seront réutilisés pour les communes dont les PDF
+# n'ont pas changé, mais on supprime les fichiers téléchargés:
+test -d "$hidden_dir" && find "$hidden_dir" -type f \! \( \
+    -name "*-manifest.json" -or -name "*-pdf-parse.pickle" -or -name "*-recognition.json" \
+    -or -name "*-houses.osm" -or -name "*-water.osm" -or -name "*-city-limit.osm" \
+    -or -name "*-housenumbers.osm" -or -name "*-mots.osm" \) \
+    -exec rm -f {} \; 2>/dev/null
 test -d "$lock_dir"   && rm -rf "$lock_dir"/* 2>/dev/null
 
-for dir in "$data_dir" "$water_dir" "$hidden_dir" "$log_dir" "$lock_dir" ; do
+# Le cache partagé des PDF et celui des résultats de leur analyse ne sont
+# pas vidés, on supprime seulement les fichiers trop vieux ou les moins
+# récemment utilisés:
+tile_cache_dir="${tile_cache_dir:-$work_dir/tile_cache}"
+mkdir -p "$tile_cache_dir"
+"$bin_dir/cadastre_fr/bin/cadastre_tile_cache.py" -evict "$tile_cache_dir"
+parse_cache_dir="${parse_cache_dir:-$work_dir/parse_cache}"
+mkdir -p "$parse_cache_dir"
+"$bin_dir/cadastre_fr/bin/cadastre_tile_cache.py" -evict -parse "$parse_cache_dir"
+
+# Base des métadonnées (départements, communes, projections et bbox),
+# remise à jour par cadastre_liste.py:
+export CADASTRE_METADATA_DB="${metadata_db:-$work_dir/metadata/metadata.sqlite}"
+metadata_dir=`dirname "$CADASTRE_METADATA_DB"`
+mkdir -p "$metadata_dir"
+
+for dir in "$data_dir" "$water_dir" "$hidden_dir" "$log_dir" "$lock_dir" "$tile_cache_dir" "$parse_cache_dir" "$metadata_dir" ; do
 	find "$dir" -type d -exec chgrp www-data {} \; -exec chmod g+rwxs {} \;
 done
 
@@ -34,3 +57,4 @@ echo "Récupération de la liste de départements et des communes…"
 cd "$data_dir" && "$bin_dir/cadastre_fr/bin/cadastre_liste.py"
 
 find "$data_dir" -type d -exec chgrp www-data {} \; -exec chmod g+rwxs {} \;
+find "$metadata_dir" -type f -exec chgrp www-data {} \; -exec chmod g+rw {} \;